@@ -0,0 +1,151 @@
+# api_budget.py — persistent per-API daily call budgets + a backlog of deferred calls (MariaDB)
+# - api_usage: calls per API per UTC day (shared by every run / process that day), plus when the
+#   provider told us the quota was gone ("Request limit reached!" for OMDb)
+# - Budget counts in memory (thread-safe; refresh mode calls from a pool) and is written back
+#   with flush(); try_spend() refuses once today's quota is used up
+# - api_backlog: calls we chose not to make yet, with a priority; callers drain it highest
+#   priority first with whatever quota is left (see enrich_details.drain_box_office)
+# - retry_delay(): how long to back off before retrying a throttled / failed call (TMDb, JustWatch)
+
+import threading
+from datetime import datetime, timezone
+
+SQL_CREATE_USAGE = """
+CREATE TABLE IF NOT EXISTS api_usage (
+  api          VARCHAR(16) NOT NULL,
+  day          DATE NOT NULL,                 -- UTC
+  calls        INT NOT NULL DEFAULT 0,
+  exhausted_at DATETIME NULL,
+  PRIMARY KEY (api, day)
+) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci;
+"""
+
+SQL_CREATE_BACKLOG = """
+CREATE TABLE IF NOT EXISTS api_backlog (
+  api             VARCHAR(16) NOT NULL,
+  film_id         INT NOT NULL,
+  priority        INT NOT NULL,
+  reason          VARCHAR(32) NULL,
+  attempts        INT NOT NULL DEFAULT 0,
+  queued_at       DATETIME NOT NULL,
+  last_attempt_at DATETIME NULL,
+  PRIMARY KEY (api, film_id),
+  KEY ix_api_backlog_priority (api, priority, film_id)
+) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci;
+"""
+
+SQL_GET_USAGE = "SELECT calls, exhausted_at FROM api_usage WHERE api=%s AND day=%s"
+
+SQL_ADD_USAGE = """
+INSERT INTO api_usage (api, day, calls, exhausted_at)
+VALUES (%s, %s, %s, %s)
+ON DUPLICATE KEY UPDATE calls = calls + VALUES(calls),
+                        exhausted_at = COALESCE(exhausted_at, VALUES(exhausted_at));
+"""
+
+SQL_ENQUEUE = """
+INSERT INTO api_backlog (api, film_id, priority, reason, queued_at)
+VALUES (%s, %s, %s, %s, NOW())
+ON DUPLICATE KEY UPDATE priority = VALUES(priority), reason = VALUES(reason);
+"""
+
+SQL_RETRY_LATER = """
+UPDATE api_backlog SET attempts = attempts + 1, last_attempt_at = NOW()
+WHERE api=%s AND film_id=%s;
+"""
+
+SQL_DROP_FAILED = "DELETE FROM api_backlog WHERE api=%s AND film_id=%s AND attempts >= %s"
+
+RETRY_AFTER_MAX_S = 60   # cap on a server's Retry-After
+
+class QuotaExhausted(Exception):
+    """The provider (or our own daily budget) says no more calls today."""
+
+def ensure_schema(cur):
+    cur.execute(SQL_CREATE_USAGE)
+    cur.execute(SQL_CREATE_BACKLOG)
+
+def retry_delay(resp, attempt, backoff_s=0.5):
+    """Seconds to wait before retrying: Retry-After (capped at RETRY_AFTER_MAX_S) when the server
+    sent one in seconds, else exponential backoff. resp: a requests / httpx response, or None."""
+    ra = resp.headers.get("Retry-After") if resp is not None else None
+    try:
+        return min(RETRY_AFTER_MAX_S, max(0.0, float(ra)))
+    except (TypeError, ValueError):
+        return min(30, backoff_s * 2 ** attempt)
+
+def _today():
+    return datetime.now(timezone.utc).date()
+
+class Budget:
+    """Daily call budget for one API. quota=0 means unlimited (usage is still recorded)."""
+
+    def __init__(self, api, quota):
+        self.api = api
+        self.quota = quota
+        self._lock = threading.Lock()
+        self._day = None
+        self._used = 0          # calls today, persisted + pending
+        self._pending = {}      # day -> calls not yet written
+        self._exhausted = {}    # day -> datetime the provider said stop (not yet written)
+        self._exhausted_today = False
+
+    def load(self, cur):
+        """Read today's usage so far (other runs today count against the same quota)."""
+        day = _today()
+        cur.execute(SQL_GET_USAGE, (self.api, day))
+        row = cur.fetchone() or {}
+        with self._lock:
+            self._day = day
+            self._used = (row.get("calls") or 0) + self._pending.get(day, 0)
+            self._exhausted_today = bool(row.get("exhausted_at")) or day in self._exhausted
+
+    def _roll(self):
+        day = _today()
+        if day != self._day:
+            self._day, self._used, self._exhausted_today = day, self._pending.get(day, 0), False
+
+    def remaining(self):
+        """Calls left today; None when unlimited."""
+        with self._lock:
+            self._roll()
+            if self._exhausted_today:
+                return 0
+            return None if not self.quota else max(0, self.quota - self._used)
+
+    def try_spend(self):
+        """Reserve one call; False once today's quota is used or the provider cut us off."""
+        with self._lock:
+            self._roll()
+            if self._exhausted_today or (self.quota and self._used >= self.quota):
+                return False
+            self._used += 1
+            self._pending[self._day] = self._pending.get(self._day, 0) + 1
+            return True
+
+    def mark_exhausted(self):
+        """Provider refused for quota reasons: no more calls until the UTC day changes."""
+        with self._lock:
+            self._roll()
+            self._exhausted_today = True
+            self._exhausted[self._day] = datetime.now(timezone.utc).replace(tzinfo=None)
+
+    def flush(self, cur):
+        with self._lock:
+            days = set(self._pending) | set(self._exhausted)
+            rows = [(self.api, d, self._pending.get(d, 0), self._exhausted.get(d)) for d in sorted(days)]
+            self._pending, self._exhausted = {}, {}
+        for r in rows:
+            cur.execute(SQL_ADD_USAGE, r)
+
+# ---------- Backlog ----------
+
+def enqueue(cur, api, items):
+    """items: [(film_id, priority, reason)]; re-queueing updates the priority."""
+    if items:
+        cur.executemany(SQL_ENQUEUE, [(api, fid, prio, reason) for fid, prio, reason in items])
+
+def retry_later(cur, api, film_id, max_attempts):
+    """Count a failed attempt; drops the item once it has failed max_attempts times."""
+    cur.execute(SQL_RETRY_LATER, (api, film_id))
+    cur.execute(SQL_DROP_FAILED, (api, film_id, max_attempts))
@@ -0,0 +1,447 @@
+# api_server.py — read-only HTTP/JSON API over the loaded Letterboxd data
+# - Endpoints:
+#     GET /availability?provider=8&monetization=FLATRATE   watchlist titles on offer now (jw_offers_current)
+#     GET /stats/diary?top=20                               diary / watchlist summary tables (stats.py)
+#     GET /films/<id>                                       one film_details row, JSON columns decoded
+#     GET /offers/recent?days=7                             offers that appeared / disappeared lately
+#     GET /healthz                                          liveness + current data generation
+# - Small pool of read-only DB connections shared by the request threads
+# - Responses are cached in-process (LRU + TTL) per data generation: the id of the latest
+#   pipeline_runs marker (pipeline_state.mark_run_complete). A finished stage bumps it, which
+#   drops the cache and changes every ETag; If-None-Match → 304 without touching the tables
+# - List endpoints stream rows (unbuffered cursor, chunked JSON) and are cached only when small
+#
+#   python api_server.py            # listens on API_HOST:API_PORT (default 0.0.0.0:8088)
+
+import os
+import re
+import json
+import time
+import queue
+import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import date, datetime
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+import pymysql
+from pymysql.cursors import DictCursor, SSDictCursor
+from dotenv import load_dotenv
+
+from logger import log_to_db
+import metrics
+import pipeline_state
+
+PROJECT_NAME = "lbx-api"
+
+load_dotenv()
+
+API_HOST          = os.getenv("API_HOST", "0.0.0.0")
+API_PORT          = int(os.getenv("API_PORT", "8088"))
+POOL_SIZE         = int(os.getenv("API_DB_POOL", "4"))
+CACHE_ENTRIES     = int(os.getenv("API_CACHE_ENTRIES", "256"))
+CACHE_TTL_S       = float(os.getenv("API_CACHE_TTL_S", "300"))
+CACHE_MAX_BYTES   = int(os.getenv("API_CACHE_MAX_BYTES", "1000000"))   # larger responses are streamed, not kept
+GENERATION_POLL_S = float(os.getenv("API_GENERATION_POLL_S", "5"))
+DEFAULT_LIMIT     = int(os.getenv("API_DEFAULT_LIMIT", "1000"))
+MAX_LIMIT         = int(os.getenv("API_MAX_LIMIT", "100000"))
+STREAM_BATCH      = int(os.getenv("API_STREAM_BATCH", "500"))
+ACCESS_LOG        = os.getenv("API_ACCESS_LOG", "0") == "1"
+
+# Separate credentials so the API can run as a SELECT-only user; falls back to the pipeline's
+DB = dict(
+    host=os.getenv("API_DB_HOST", os.getenv("MARIADB_HOST", "localhost")),
+    port=int(os.getenv("API_DB_PORT", os.getenv("MARIADB_PORT", "3306"))),
+    user=os.getenv("API_DB_USER", os.getenv("MARIADB_USER", "root")),
+    password=os.getenv("API_DB_PASS", os.getenv("MARIADB_PASS", "")),
+    database=os.getenv("MARIADB_DB", "letterboxd"),
+    charset="utf8mb4",
+    cursorclass=DictCursor,
+    autocommit=True,
+    init_command="SET SESSION TRANSACTION READ ONLY",
+)
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+# ---------- DB pool ----------
+
+class Pool:
+    """Fixed-size pool of pymysql connections, opened lazily and pinged on checkout."""
+
+    def __init__(self, size):
+        self._free = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    @contextmanager
+    def connection(self):
+        self._slots.acquire()
+        conn = None
+        try:
+            try:
+                conn = self._free.get_nowait()
+                conn.ping(reconnect=True)
+            except queue.Empty:
+                conn = pymysql.connect(**DB)
+            yield conn
+        except pymysql.err.OperationalError:
+            # broken connection: don't hand it out again
+            if conn is not None:
+                conn.close()
+                conn = None
+            raise
+        finally:
+            if conn is not None:
+                self._free.put(conn)
+            self._slots.release()
+
+POOL = Pool(POOL_SIZE)
+
+# ---------- Response cache ----------
+
+class ResponseCache:
+    """LRU + TTL cache of encoded response bodies, tagged with the data generation."""
+
+    def __init__(self, max_entries, ttl_s):
+        self._max = max_entries
+        self._ttl = ttl_s
+        self._items = OrderedDict()   # key -> (generation, stored_at, body)
+        self._lock = threading.Lock()
+
+    def get(self, key, generation):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            gen, stored_at, body = item
+            if gen != generation or time.monotonic() - stored_at > self._ttl:
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return body
+
+    def put(self, key, generation, body):
+        with self._lock:
+            self._items[key] = (generation, time.monotonic(), body)
+            self._items.move_to_end(key)
+            while len(self._items) > self._max:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+CACHE = ResponseCache(CACHE_ENTRIES, CACHE_TTL_S)
+
+# ---------- Data generation ----------
+
+_gen_lock = threading.Lock()
+_generation = None
+_generation_checked = 0.0
+
+def current_generation():
+    """Latest pipeline_runs id, re-read at most every GENERATION_POLL_S; a change clears the cache."""
+    global _generation, _generation_checked
+    with _gen_lock:
+        if _generation is not None and time.monotonic() - _generation_checked < GENERATION_POLL_S:
+            return _generation
+        try:
+            with POOL.connection() as conn, conn.cursor() as c, metrics.timed_sql("api_generation"):
+                gen = pipeline_state.last_run_id(c)
+        except pymysql.err.ProgrammingError:
+            gen = 0   # no stage has finished yet (table missing)
+        if gen != _generation:
+            if _generation is not None:
+                log_to_db(PROJECT_NAME, "INFO", f"🔄 Data generation {_generation} → {gen}, response cache cleared")
+            CACHE.clear()
+            _generation = gen
+        _generation_checked = time.monotonic()
+        return _generation
+
+def etag_for(generation, key):
+    return f'"{generation}-{hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]}"'
+
+# ---------- JSON ----------
+
+def _json_default(v):
+    if isinstance(v, (datetime, date)):
+        return v.isoformat()
+    if isinstance(v, Decimal):
+        return float(v)
+    if isinstance(v, bytes):
+        return v.decode("utf-8", "replace")
+    raise TypeError(f"not JSON serializable: {type(v).__name__}")
+
+def dumps(obj):
+    return json.dumps(obj, default=_json_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+# ---------- Params ----------
+
+def int_param(params, name, default=None, lo=None, hi=None):
+    raw = params.get(name, [None])[0]
+    if raw is None or raw == "":
+        return default
+    try:
+        v = int(raw)
+    except ValueError:
+        raise ApiError(400, f"{name} must be an integer")
+    if (lo is not None and v < lo) or (hi is not None and v > hi):
+        raise ApiError(400, f"{name} must be between {lo} and {hi}")
+    return v
+
+def str_param(params, name):
+    raw = params.get(name, [None])[0]
+    return raw.strip() if raw and raw.strip() else None
+
+def limit_param(params):
+    return int_param(params, "limit", DEFAULT_LIMIT, 1, MAX_LIMIT)
+
+# ---------- Endpoints ----------
+# object endpoints return a JSON-able value; list endpoints return (sql, args) to stream
+
+SQL_AVAILABILITY = """
+SELECT c.watchlist_id, w.film_name, w.film_year, c.provider_id, c.provider_name,
+       c.monetization_type, c.presentation_type, c.url, c.valid_from
+FROM jw_offers_current c
+JOIN watchlist w ON w.id = c.watchlist_id
+{where}
+ORDER BY c.provider_id, c.watchlist_id
+LIMIT %s
+"""
+
+SQL_RECENT_OFFERS = """
+SELECT * FROM (
+  SELECT h.watchlist_id, w.film_name, w.film_year, h.provider_id, h.provider_name,
+         h.presentation_type, h.monetization_type, h.url, 'added' AS change_type, h.valid_from AS changed_at
+  FROM jw_offers_history h JOIN watchlist w ON w.id = h.watchlist_id
+  WHERE h.valid_from >= NOW() - INTERVAL %s DAY
+  UNION ALL
+  SELECT h.watchlist_id, w.film_name, w.film_year, h.provider_id, h.provider_name,
+         h.presentation_type, h.monetization_type, h.url, 'removed' AS change_type, h.valid_to AS changed_at
+  FROM jw_offers_history h JOIN watchlist w ON w.id = h.watchlist_id
+  WHERE h.valid_to >= NOW() - INTERVAL %s DAY
+) x
+ORDER BY changed_at DESC
+LIMIT %s
+"""
+
+SQL_FILM = "SELECT * FROM film_details WHERE id = %s"
+
+SQL_FILM_WATCHES = """
+SELECT d.id, d.logged_date, d.watched_date, d.rating, d.rewatch
+FROM jw_title_map m JOIN diary d ON d.id = m.source_row_id
+WHERE m.film_id = %s AND m.source = 'DIARY'
+ORDER BY COALESCE(d.watched_date, d.logged_date)
+"""
+
+STATS_QUERIES = {
+    "months": """SELECT month, entries, films, rewatches, rated,
+                        ROUND(rating_sum / NULLIF(rated, 0), 2) AS avg_rating
+                 FROM stats_diary_month ORDER BY month""",
+    "ratings": "SELECT rating_half / 2 AS rating, entries FROM stats_diary_rating ORDER BY rating_half",
+    "film_years": """SELECT film_year, entries, rated, ROUND(rating_sum / NULLIF(rated, 0), 2) AS avg_rating
+                     FROM stats_diary_film_year ORDER BY film_year""",
+    "watchlist_months": "SELECT month, added FROM stats_watchlist_month ORDER BY month",
+    "top_genres": """SELECT genre_id, name, entries, films, minutes, ROUND(rating_sum / NULLIF(rated, 0), 2) AS avg_rating
+                     FROM stats_genre ORDER BY entries DESC LIMIT %s""",
+    "top_directors": """SELECT person_id, name, entries, films, ROUND(rating_sum / NULLIF(rated, 0), 2) AS avg_rating
+                        FROM stats_director ORDER BY entries DESC LIMIT %s""",
+}
+
+def availability(params, _):
+    where, args = [], []
+    provider = int_param(params, "provider")
+    if provider is not None:
+        where.append("c.provider_id = %s")
+        args.append(provider)
+    monetization = str_param(params, "monetization")
+    if monetization:
+        where.append("c.monetization_type = %s")
+        args.append(monetization.upper())
+    args.append(limit_param(params))
+    return SQL_AVAILABILITY.format(where=("WHERE " + " AND ".join(where)) if where else ""), args
+
+def recent_offers(params, _):
+    days = int_param(params, "days", 7, 1, 3650)
+    return SQL_RECENT_OFFERS, (days, days, limit_param(params))
+
+def diary_stats(params, _):
+    top = int_param(params, "top", 20, 1, 1000)
+    out = {}
+    with POOL.connection() as conn, conn.cursor() as c:
+        for name, sql in STATS_QUERIES.items():
+            with metrics.timed_sql(f"api_stats_{name}"):
+                c.execute(sql, (top,) if "%s" in sql else None)
+                out[name] = c.fetchall()
+    return out
+
+def film(params, match):
+    film_id = int(match.group(1))
+    with POOL.connection() as conn, conn.cursor() as c:
+        with metrics.timed_sql("api_film"):
+            c.execute(SQL_FILM, (film_id,))
+            row = c.fetchone()
+        if not row:
+            raise ApiError(404, f"film {film_id} not found")
+        with metrics.timed_sql("api_film_watches"):
+            c.execute(SQL_FILM_WATCHES, (film_id,))
+            row["diary"] = c.fetchall()
+    for col in [k for k in row if k.endswith("_json")]:
+        try:
+            row[col[:-5]] = json.loads(row.pop(col) or "null")
+        except ValueError:
+            row[col[:-5]] = None
+    return row
+
+# (pattern, route label for metrics, handler, streams a list?)
+ROUTES = [
+    (re.compile(r"^/availability$"),   "availability",  availability,  True),
+    (re.compile(r"^/offers/recent$"),  "offers_recent", recent_offers, True),
+    (re.compile(r"^/stats/diary$"),    "stats_diary",   diary_stats,   False),
+    (re.compile(r"^/films/(\d+)$"),    "film",          film,          False),
+]
+
+# ---------- HTTP ----------
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # keep-alive + chunked responses
+    server_version = "lbx-api"
+
+    def log_message(self, fmt, *args):
+        if ACCESS_LOG:
+            super().log_message(fmt, *args)
+
+    def do_GET(self):
+        t0 = time.perf_counter()
+        parts = urlsplit(self.path)
+        route, status = "unknown", 500
+        self._streaming = False
+        try:
+            if parts.path == "/healthz":
+                route = "healthz"
+                status = self._send_json(200, dumps({"ok": True, "generation": current_generation()}))
+                return
+            for pattern, label, handler, streams in ROUTES:
+                m = pattern.match(parts.path)
+                if m:
+                    route = label
+                    status = self._serve(parts, m, handler, streams)
+                    return
+            status = self._send_error(404, "no such endpoint")
+        except ApiError as e:
+            status = self._send_error(e.status, str(e))
+        except Exception as e:
+            log_to_db(PROJECT_NAME, "ERROR", f"❌ {self.path} failed: {e}")
+            if self._streaming:
+                # status line already sent; dropping the connection tells the client the body is incomplete
+                self.close_connection = True
+                status = 500
+            else:
+                status = self._send_error(500, "internal error")
+        finally:
+            metrics.inc("http_requests_total", route=route, status=status)
+            metrics.observe("http_latency_seconds", time.perf_counter() - t0, route=route)
+            metrics.maybe_flush(PROJECT_NAME)
+
+    def _serve(self, parts, match, handler, streams):
+        params = parse_qs(parts.query)
+        key = f"{parts.path}?{parts.query}"
+        gen = current_generation()
+        etag = etag_for(gen, key)
+
+        if etag in [t.strip() for t in self.headers.get("If-None-Match", "").split(",")]:
+            metrics.inc("cache_hits_total", cache="api_etag")
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return 304
+
+        body = CACHE.get(key, gen)
+        if body is not None:
+            metrics.inc("cache_hits_total", cache="api_response")
+            return self._send_json(200, body, etag)
+
+        if not streams:
+            body = dumps(handler(params, match))
+            if len(body) <= CACHE_MAX_BYTES:
+                CACHE.put(key, gen, body)
+            return self._send_json(200, body, etag)
+
+        sql, args = handler(params, match)
+        return self._stream(sql, args, key, gen, etag)
+
+    def _stream(self, sql, args, key, gen, etag):
+        """Send rows as a chunked JSON array straight off an unbuffered cursor.
+        The body is kept for the cache until it outgrows CACHE_MAX_BYTES."""
+        kept, kept_bytes = [], 0
+        with POOL.connection() as conn, conn.cursor(SSDictCursor) as c:
+            with metrics.timed_sql("api_stream_query"):
+                c.execute(sql, args)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", "no-cache")
+            self.end_headers()
+            self._streaming = True
+
+            first = True
+            self._chunk(b"[")
+            kept.append(b"[")
+            while True:
+                rows = c.fetchmany(STREAM_BATCH)
+                if not rows:
+                    break
+                data = (b"" if first else b",") + b",".join(dumps(r) for r in rows)
+                first = False
+                self._chunk(data)
+                if kept is not None:
+                    kept.append(data)
+                    kept_bytes += len(data)
+                    if kept_bytes > CACHE_MAX_BYTES:
+                        kept = None
+            self._chunk(b"]")
+            self._chunk(b"")   # terminating chunk
+
+        if kept is not None:
+            kept.append(b"]")
+            CACHE.put(key, gen, b"".join(kept))
+        return 200
+
+    def _chunk(self, data):
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+
+    def _send_json(self, status, body, etag=None):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        if etag:
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", "no-cache")   # always revalidate; 304s are cheap
+        self.end_headers()
+        self.wfile.write(body)
+        return status
+
+    def _send_error(self, status, message):
+        return self._send_json(status, dumps({"error": message}))
+
+def main():
+    server = ThreadingHTTPServer((API_HOST, API_PORT), Handler)
+    server.daemon_threads = True
+    log_to_db(PROJECT_NAME, "INFO", f"▶ Query API listening on {API_HOST}:{API_PORT} (pool={POOL_SIZE})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        metrics.flush(PROJECT_NAME)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,417 @@
+# api_sim.py — local stand-in for JustWatch GraphQL, TMDb and OMDb (throughput + backoff testing)
+# - One HTTP server, three APIs:
+#     POST /graphql            JustWatch (GetSearchTitles, GetTitleOffers)  → JW_API_URL=http://host:port/graphql
+#     GET  /3/...              TMDb search/details/changes                   → TMDB_BASE_URL=http://host:port/3
+#     GET  /omdb/?i=tt...      OMDb by imdb id                               → OMDB_BASE_URL=http://host:port/omdb/
+# - Responses come from fixtures/api_sim.json; unknown titles are synthesized deterministically
+#   so a benchmark DB full of generated titles still gets plausible answers
+# - Fault injection: fixed latency + jitter, random 429s with Retry-After, a max-RPS limiter,
+#   timeouts (request held open past the client timeout) and 5xx errors
+# - GET /_stats returns per-API/endpoint/status request counts as JSON
+#
+#   python api_sim.py --port 8765 --latency-ms 80 --rate-429 0.05 --retry-after 1
+
+import os
+import re
+import sys
+import json
+import time
+import zlib
+import random
+import argparse
+import threading
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_FIXTURES = os.path.join(HERE, "fixtures", "api_sim.json")
+
+SYNTH_GENRES    = ["Drama", "Comedy", "Thriller", "Documentary", "Romance", "Horror", "Animation", "Crime"]
+SYNTH_COUNTRIES = ["US", "GB", "FR", "JP", "KR", "DE", "IT", "IN"]
+SYNTH_PROVIDERS = [(8, "Netflix"), (9, "Amazon Prime Video"), (337, "Disney Plus"), (11, "MUBI"), (2, "Apple TV")]
+
+COUNTRY_ALIAS = re.compile(r"\b([A-Z]{2}): offers\(country:")
+
+def norm(s):
+    return (s or "").strip().lower()
+
+# ---------- Fault injection ----------
+
+class Faults:
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, rate_429=0.0, retry_after=1, max_rps=0.0,
+                 rate_timeout=0.0, timeout_s=30.0, rate_error=0.0, omdb_daily_limit=0, seed=None,
+                 changes_rate=0.3):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.max_rps = max_rps
+        self.rate_timeout = rate_timeout
+        self.timeout_s = timeout_s
+        self.rate_error = rate_error
+        self.omdb_daily_limit = omdb_daily_limit
+        self.changes_rate = changes_rate
+        self.rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._window = []   # request timestamps inside the last second (max_rps limiter)
+
+    def over_rps(self):
+        if not self.max_rps:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            self._window = [t for t in self._window if now - t < 1.0]
+            if len(self._window) >= self.max_rps:
+                return True
+            self._window.append(now)
+            return False
+
+    def decide(self):
+        """Returns None (serve normally) or one of '429', 'timeout', 'error'."""
+        delay = self.latency_ms + (self.rng.uniform(-self.jitter_ms, self.jitter_ms) if self.jitter_ms else 0)
+        if delay > 0:
+            time.sleep(delay / 1000.0)
+        if self.over_rps():
+            return "429"
+        with self._lock:
+            roll = self.rng.random()
+        if roll < self.rate_429:
+            return "429"
+        roll -= self.rate_429
+        if roll < self.rate_timeout:
+            return "timeout"
+        roll -= self.rate_timeout
+        if roll < self.rate_error:
+            return "error"
+        return None
+
+# ---------- Fixture store ----------
+
+class Catalog:
+    """Fixture titles indexed by title / ids, with deterministic synthesis for unknown titles."""
+
+    def __init__(self, path=None, synthesize=True):
+        self.synthesize = synthesize
+        self._lock = threading.Lock()
+        self.by_title, self.by_jw, self.by_tmdb, self.by_imdb = {}, {}, {}, {}
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for t in json.load(f).get("titles", []):
+                    self.add(t)
+
+    def add(self, t):
+        with self._lock:
+            self.by_title.setdefault(norm(t["title"]), []).append(t)
+            if t.get("original_title"):
+                self.by_title.setdefault(norm(t["original_title"]), []).append(t)
+            self.by_jw[t["jw_id"]] = t
+            self.by_tmdb[(t["type"], int(t["tmdb_id"]))] = t
+            if t.get("imdb_id"):
+                self.by_imdb[t["imdb_id"]] = t
+
+    def synth(self, title, obj_type="MOVIE", year=None):
+        h = zlib.crc32(f"{norm(title)}|{obj_type}".encode("utf-8"))
+        rng = random.Random(h)
+        n = 100000 + h % 900000
+        t = {
+            "title": title.strip(), "year": year or rng.randint(1930, 2024), "type": obj_type,
+            "jw_id": f"{'tm' if obj_type == 'MOVIE' else 'ts'}{n}", "tmdb_id": n,
+            "imdb_id": f"tt{n:07d}" if rng.random() < 0.9 else None,
+            "genres": rng.sample(SYNTH_GENRES, rng.randint(1, 3)),
+            "countries": rng.sample(SYNTH_COUNTRIES, rng.randint(1, 2)),
+            "languages": ["en"], "runtime": rng.randint(75, 180),
+            "vote_average": round(rng.uniform(4, 9), 1), "vote_count": rng.randint(0, 20000),
+            "box_office": rng.randint(10**5, 10**9) if obj_type == "MOVIE" and rng.random() < 0.6 else None,
+            "directors": [{"id": 900000 + h % 5000, "name": f"Director {h % 5000}"}],
+            "cast": [{"id": 800000 + (h + i) % 20000, "name": f"Actor {(h + i) % 20000}", "character": f"Role {i}"}
+                     for i in range(rng.randint(2, 8))],
+            "offers": [{"provider_id": pid, "provider_name": pname,
+                        "monetization": rng.choice(["FLATRATE", "RENT", "BUY"]),
+                        "presentation": rng.choice(["SD", "HD", "4K"])}
+                       for pid, pname in rng.sample(SYNTH_PROVIDERS, rng.randint(0, 3))],
+        }
+        self.add(t)
+        return t
+
+    def search(self, query, obj_type=None, year=None, count=4):
+        with self._lock:
+            hits = list(self.by_title.get(norm(query), []))
+            if not hits:
+                q = norm(query)
+                hits = [t for k, ts in self.by_title.items() if q and q in k for t in ts][:count]
+        if obj_type:
+            hits = [t for t in hits if t["type"] == obj_type]
+        if not hits and self.synthesize and query.strip():
+            hits = [self.synth(query, obj_type or "MOVIE", year)]
+        # uniq by jw_id, keep order
+        seen, out = set(), []
+        for t in hits:
+            if t["jw_id"] not in seen:
+                seen.add(t["jw_id"])
+                out.append(t)
+        return out[:count]
+
+# ---------- Response shapes ----------
+
+def jw_offer(o, country):
+    return {
+        "id": f"of-{o['provider_id']}-{o['presentation']}", "monetizationType": o["monetization"],
+        "presentationType": o["presentation"], "retailPrice": None, "retailPriceValue": None,
+        "currency": "GBP" if country == "GB" else "USD", "lastChangeRetailPriceValue": None,
+        "type": "AGGREGATED", "standardWebURL": f"https://example.invalid/{o['provider_id']}",
+        "elementCount": 1, "availableTo": None, "deeplinkRoku": None, "subtitleLanguages": [],
+        "videoTechnology": [], "audioTechnology": [], "audioLanguages": [],
+        "package": {"id": f"pk{o['provider_id']}", "packageId": o["provider_id"], "clearName": o["provider_name"],
+                    "technicalName": norm(o["provider_name"]).replace(" ", ""), "shortName": o["provider_name"][:3],
+                    "monetizationTypes": [o["monetization"]], "icon": None},
+    }
+
+def jw_node(t):
+    kind = "movie" if t["type"] == "MOVIE" else "tv-show"
+    return {
+        "id": t["jw_id"], "objectId": int(t["tmdb_id"]), "objectType": t["type"],
+        "content": {
+            "title": t["title"], "fullPath": f"/uk/{kind}/{t['jw_id']}",
+            "originalReleaseYear": t["year"], "originalReleaseDate": f"{t['year']}-01-01",
+            "runtime": t.get("runtime"), "shortDescription": "", "genres": [],
+            "externalIds": {"imdbId": t.get("imdb_id"), "tmdbId": str(t["tmdb_id"])},
+            "posterUrl": None, "backdrops": [], "ageCertification": None,
+        },
+        "offers": [],
+    }
+
+def tmdb_search_result(t):
+    if t["type"] == "MOVIE":
+        return {"id": t["tmdb_id"], "title": t["title"], "original_title": t.get("original_title") or t["title"],
+                "release_date": f"{t['year']}-01-01"}
+    return {"id": t["tmdb_id"], "name": t["title"], "original_name": t.get("original_title") or t["title"],
+            "first_air_date": f"{t['year']}-01-01"}
+
+def tmdb_details(t):
+    d = tmdb_search_result(t)
+    d.update({
+        "genres": [{"id": i, "name": g} for i, g in enumerate(t["genres"])],
+        "production_countries": [{"iso_3166_1": c} for c in t["countries"]],
+        "spoken_languages": [{"iso_639_1": l} for l in t["languages"]],
+        "poster_path": f"/p{t['tmdb_id']}.jpg", "backdrop_path": f"/b{t['tmdb_id']}.jpg",
+        "vote_average": t["vote_average"], "vote_count": t["vote_count"],
+        "external_ids": {"imdb_id": t.get("imdb_id")},
+        "credits": {
+            "crew": [{"id": p["id"], "name": p["name"], "job": "Director"} for p in t["directors"]],
+            "cast": t["cast"],
+        },
+        "images": {"posters": [], "backdrops": []},
+    })
+    if t["type"] == "MOVIE":
+        d["runtime"] = t["runtime"]
+    else:
+        d["episode_run_time"] = [t["runtime"]]
+    return d
+
+# ---------- HTTP ----------
+
+class SimServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, addr, catalog, faults, quiet=True):
+        super().__init__(addr, SimHandler)
+        self.catalog = catalog
+        self.faults = faults
+        self.quiet = quiet
+        self.stats = {}
+        self.stats_lock = threading.Lock()
+        self.omdb_calls = 0
+
+    def count(self, api, endpoint, status):
+        key = f"{api}.{endpoint}.{status}"
+        with self.stats_lock:
+            self.stats[key] = self.stats.get(key, 0) + 1
+
+class SimHandler(BaseHTTPRequestHandler):
+    server_version = "lbx-api-sim/1"
+
+    def log_message(self, fmt, *args):
+        if not self.server.quiet:
+            super().log_message(fmt, *args)
+
+    def send_json(self, status, payload, api, endpoint, headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.count(api, endpoint, status)
+
+    def faulted(self, api, endpoint):
+        """Apply fault injection; returns True when a fault response was sent."""
+        f = self.server.faults
+        fault = f.decide()
+        if fault == "429":
+            self.send_json(429, {"status_message": "Too many requests (simulated)"}, api, endpoint,
+                           {"Retry-After": str(f.retry_after)})
+        elif fault == "timeout":
+            time.sleep(f.timeout_s)
+            self.send_json(504, {"status_message": "Gateway timeout (simulated)"}, api, endpoint)
+        elif fault == "error":
+            self.send_json(503, {"status_message": "Service unavailable (simulated)"}, api, endpoint)
+        return fault is not None
+
+    # ---- GET: TMDb, OMDb, stats ----
+    def do_GET(self):
+        u = urlparse(self.path)
+        q = {k: v[0] for k, v in parse_qs(u.query).items()}
+        parts = [p for p in u.path.split("/") if p]
+
+        if u.path == "/_stats":
+            with self.server.stats_lock:
+                return self.send_json(200, dict(self.server.stats), "sim", "stats")
+
+        if parts[:1] == ["omdb"]:
+            return self.omdb(q)
+
+        if parts[:1] == ["3"]:
+            return self.tmdb(parts[1:], q)
+
+        self.send_json(404, {"error": "unknown route"}, "sim", "unknown")
+
+    def tmdb(self, parts, q):
+        endpoint = "_".join(p if not p.isdigit() else "id" for p in parts) or "root"
+        if not q.get("api_key"):
+            return self.send_json(401, {"status_message": "Invalid API key"}, "tmdb", endpoint)
+        if self.faulted("tmdb", endpoint):
+            return
+        cat = self.server.catalog
+
+        if len(parts) == 2 and parts[0] == "search" and parts[1] in ("movie", "tv"):
+            obj_type = "MOVIE" if parts[1] == "movie" else "SHOW"
+            year = q.get("year") or q.get("first_air_date_year")
+            hits = cat.search(q.get("query", ""), obj_type, int(year) if (year or "").isdigit() else None)
+            res = [tmdb_search_result(t) for t in hits]
+            return self.send_json(200, {"page": 1, "results": res, "total_pages": 1, "total_results": len(res)},
+                                  "tmdb", endpoint)
+
+        if len(parts) == 2 and parts[0] in ("movie", "tv") and parts[1] == "changes":
+            # a stable pseudo-random share of known ids, plus ids we've never heard of, 100 per page
+            obj_type = "MOVIE" if parts[0] == "movie" else "SHOW"
+            seed = zlib.crc32(f"{q.get('start_date')}|{q.get('end_date')}".encode())
+            rng = random.Random(seed)
+            known = sorted(tid for (typ, tid) in list(cat.by_tmdb) if typ == obj_type)
+            ids = [tid for tid in known if rng.random() < self.server.faults.changes_rate]
+            ids += [rng.randint(10**7, 2 * 10**7) for _ in range(len(ids) + 50)]
+            page = max(1, int(q.get("page") or 1))
+            pages = max(1, -(-len(ids) // 100))
+            res = [{"id": i, "adult": False} for i in ids[(page - 1) * 100:page * 100]]
+            return self.send_json(200, {"results": res, "page": page, "total_pages": pages,
+                                        "total_results": len(ids)}, "tmdb", endpoint)
+
+        if len(parts) == 2 and parts[0] in ("movie", "tv") and parts[1].isdigit():
+            t = cat.by_tmdb.get(("MOVIE" if parts[0] == "movie" else "SHOW", int(parts[1])))
+            if not t:
+                return self.send_json(404, {"status_message": "not found"}, "tmdb", endpoint)
+            return self.send_json(200, tmdb_details(t), "tmdb", endpoint)
+
+        self.send_json(404, {"status_message": "unknown TMDb route"}, "tmdb", endpoint)
+
+    def omdb(self, q):
+        if not q.get("apikey"):
+            return self.send_json(401, {"Response": "False", "Error": "No API key provided."}, "omdb", "title")
+        if self.faulted("omdb", "title"):
+            return
+        srv = self.server
+        with srv.stats_lock:
+            srv.omdb_calls += 1
+            over = srv.faults.omdb_daily_limit and srv.omdb_calls > srv.faults.omdb_daily_limit
+        if over:
+            return self.send_json(401, {"Response": "False", "Error": "Request limit reached!"}, "omdb", "title")
+        t = srv.catalog.by_imdb.get(q.get("i", ""))
+        if not t:
+            return self.send_json(200, {"Response": "False", "Error": "Incorrect IMDb ID."}, "omdb", "title")
+        bo = f"${t['box_office']:,}" if t.get("box_office") else "N/A"
+        self.send_json(200, {"Response": "True", "Title": t["title"], "Year": str(t["year"]),
+                             "imdbID": t["imdb_id"], "BoxOffice": bo}, "omdb", "title")
+
+    # ---- POST: JustWatch GraphQL ----
+    def do_POST(self):
+        if urlparse(self.path).path != "/graphql":
+            return self.send_json(404, {"error": "unknown route"}, "sim", "unknown")
+        try:
+            req = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+        except ValueError:
+            return self.send_json(400, {"errors": [{"message": "bad JSON"}]}, "justwatch", "bad_request")
+        op = req.get("operationName") or "unknown"
+        if self.faulted("justwatch", op):
+            return
+        v = req.get("variables") or {}
+        cat = self.server.catalog
+
+        if op == "GetSearchTitles":
+            query = ((v.get("searchTitlesFilter") or {}).get("searchQuery")) or ""
+            hits = cat.search(query, count=int(v.get("first") or 4))
+            edges = [{"node": jw_node(t)} for t in hits]
+            return self.send_json(200, {"data": {"popularTitles": {"edges": edges}}}, "justwatch", op)
+
+        if op == "GetTitleOffers":
+            t = cat.by_jw.get(v.get("nodeId"))
+            countries = COUNTRY_ALIAS.findall(req.get("query") or "") or ["GB"]
+            node = {c: [jw_offer(o, c) for o in (t or {}).get("offers", [])] for c in countries}
+            return self.send_json(200, {"data": {"node": node}}, "justwatch", op)
+
+        self.send_json(200, {"errors": [{"message": f"operation {op} not simulated"}]}, "justwatch", op)
+
+def add_fault_args(ap):
+    ap.add_argument("--latency-ms", type=float, default=float(os.getenv("SIM_LATENCY_MS", "30")))
+    ap.add_argument("--jitter-ms", type=float, default=float(os.getenv("SIM_JITTER_MS", "10")))
+    ap.add_argument("--rate-429", type=float, default=float(os.getenv("SIM_RATE_429", "0")),
+                    help="Share of requests answered 429 + Retry-After")
+    ap.add_argument("--retry-after", type=int, default=int(os.getenv("SIM_RETRY_AFTER", "1")))
+    ap.add_argument("--max-rps", type=float, default=float(os.getenv("SIM_MAX_RPS", "0")),
+                    help="429 once requests in the last second exceed this (0 = off)")
+    ap.add_argument("--rate-timeout", type=float, default=float(os.getenv("SIM_RATE_TIMEOUT", "0")),
+                    help="Share of requests held for --timeout-s before a 504")
+    ap.add_argument("--timeout-s", type=float, default=float(os.getenv("SIM_TIMEOUT_S", "30")))
+    ap.add_argument("--rate-error", type=float, default=float(os.getenv("SIM_RATE_ERROR", "0")),
+                    help="Share of requests answered 503")
+    ap.add_argument("--omdb-daily-limit", type=int, default=int(os.getenv("SIM_OMDB_DAILY_LIMIT", "0")),
+                    help="OMDb 'Request limit reached!' after this many calls (0 = unlimited)")
+    ap.add_argument("--changes-rate", type=float, default=float(os.getenv("SIM_CHANGES_RATE", "0.3")),
+                    help="Share of known titles reported by /movie|tv/changes")
+    ap.add_argument("--fixtures", default=os.getenv("SIM_FIXTURES", DEFAULT_FIXTURES))
+    ap.add_argument("--no-synthesize", action="store_true", help="Only serve fixture titles")
+    ap.add_argument("--seed", type=int, default=None)
+
+def make_server(args, host="127.0.0.1", port=0, quiet=True):
+    faults = Faults(args.latency_ms, args.jitter_ms, args.rate_429, args.retry_after, args.max_rps,
+                    args.rate_timeout, args.timeout_s, args.rate_error, args.omdb_daily_limit, args.seed,
+                    args.changes_rate)
+    catalog = Catalog(args.fixtures, synthesize=not args.no_synthesize)
+    return SimServer((host, port), catalog, faults, quiet=quiet)
+
+def start_in_thread(server):
+    t = threading.Thread(target=server.serve_forever, name="api-sim", daemon=True)
+    t.start()
+    return f"http://{server.server_address[0]}:{server.server_address[1]}"
+
+def main():
+    ap = argparse.ArgumentParser(description="Local JustWatch/TMDb/OMDb simulator")
+    ap.add_argument("--host", default=os.getenv("SIM_HOST", "127.0.0.1"))
+    ap.add_argument("--port", type=int, default=int(os.getenv("SIM_PORT", "8765")))
+    ap.add_argument("--verbose", action="store_true", help="Log every request")
+    add_fault_args(ap)
+    args = ap.parse_args()
+
+    srv = make_server(args, args.host, args.port, quiet=not args.verbose)
+    base = f"http://{args.host}:{srv.server_address[1]}"
+    print(f"api_sim listening on {base}", file=sys.stderr)
+    print(f"  JW_API_URL={base}/graphql  TMDB_BASE_URL={base}/3  OMDB_BASE_URL={base}/omdb/", file=sys.stderr)
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        srv.server_close()
+
+if __name__ == "__main__":
+    main()
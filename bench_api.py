@@ -0,0 +1,145 @@
+# bench_api.py — drive jw_update.py and enrich_details.py against api_sim.py
+# - Starts the simulator in-process (or uses --sim-url for one started separately)
+# - Optionally seeds the bench DB with a generated export (gen_export.py + loader.py)
+# - Runs each stage as a child process with JW_API_URL / TMDB_BASE_URL / OMDB_BASE_URL pointed
+#   at the simulator and the polite sleeps turned off (override with --jw-sleep / --enrich-sleep)
+# - Reports titles/sec, API calls per title (client-side metrics) and what the simulator saw
+#   (status codes incl. injected 429s) as JSON
+#
+#   python bench_api.py --rows 2000 --latency-ms 80 --rate-429 0.05 --out bench_api.json
+
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+import platform
+import urllib.request
+from datetime import datetime, timezone
+
+import api_sim
+from bench_loader import BENCH_DB_NAME, SPLIT, git_rev, reset_db, read_prom, run_loader, run_stage, stage_env
+from gen_export import generate
+
+def sim_stats(base):
+    with urllib.request.urlopen(f"{base}/_stats", timeout=10) as r:
+        return json.load(r)
+
+def stats_delta(before, after):
+    return {k: v - before.get(k, 0) for k, v in after.items() if v - before.get(k, 0)}
+
+def summarize(prom_path, titles_table):
+    """Titles processed + API calls/latency per endpoint out of one stage's metrics file."""
+    titles, calls, retries, latency = 0, {}, {}, {}
+    for name, labels, value in read_prom(prom_path):
+        if name == "rows_total" and labels.get("table") == titles_table:
+            titles = int(value)
+        elif name == "api_calls_total":
+            key = f"{labels.get('api')}.{labels.get('endpoint')}.{labels.get('outcome')}"
+            calls[key] = int(value)
+        elif name == "api_retries_total":
+            retries[f"{labels.get('api')}.{labels.get('reason')}"] = int(value)
+        elif name in ("api_latency_seconds_sum", "api_latency_seconds_count"):
+            key = f"{labels.get('api')}.{labels.get('endpoint')}"
+            latency.setdefault(key, {})[name.rsplit("_", 1)[1]] = value
+    total_calls = sum(calls.values())
+    return {
+        "titles": titles,
+        "api_calls": calls,
+        "api_calls_total": total_calls,
+        "api_calls_per_title": round(total_calls / titles, 2) if titles else None,
+        "retries": retries,
+        "mean_latency_ms": {k: round(1000 * v["sum"] / v["count"], 1) for k, v in latency.items() if v.get("count")},
+    }
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark JustWatch mapping + enrichment against api_sim.py")
+    ap.add_argument("--sim-url", help="Use an already running simulator instead of starting one")
+    ap.add_argument("--rows", type=int, default=0, help="Reset the bench DB and load a generated export of this size")
+    ap.add_argument("--stages", default="jw_watchlist,jw_diary,enrich", help="Comma-separated subset to run")
+    ap.add_argument("--jw-sleep", type=float, default=0.0, help="JW_SLEEP_S for the run")
+    ap.add_argument("--enrich-sleep", type=float, default=0.0, help="ENRICH_SLEEP_SECONDS for the run")
+    ap.add_argument("--batch", type=int, default=100000, help="JW_BATCH_SIZE / ENRICH_BATCH_LIMIT")
+    ap.add_argument("--out", help="Write results JSON here (default: stdout only)")
+    api_sim.add_fault_args(ap)
+    args = ap.parse_args()
+
+    server = None
+    base = args.sim_url
+    if not base:
+        server = api_sim.make_server(args)
+        base = api_sim.start_in_thread(server)
+        print(f"▶ api_sim on {base}", file=sys.stderr)
+
+    work = tempfile.mkdtemp(prefix="lbx-bench-api-")
+    results = []
+    try:
+        if args.rows:
+            export_dir = os.path.join(work, "exports")
+            os.makedirs(export_dir)
+            counts = {k: int(args.rows * v) for k, v in SPLIT.items()}
+            generate(os.path.join(export_dir, "letterboxd-bench.zip"), counts["watchlist"], counts["watched"],
+                     counts["diary"], seed=args.seed or 42, folder="letterboxd-bench")
+            reset_db()
+            code, _, _ = run_loader(export_dir, os.path.join(work, "metrics-loader"))
+            if code != 0:
+                raise SystemExit("loader failed while seeding the bench DB")
+
+        api_env = dict(
+            JW_API_URL=f"{base}/graphql", TMDB_BASE_URL=f"{base}/3", OMDB_BASE_URL=f"{base}/omdb/",
+            TMDB_API_KEY=os.getenv("TMDB_API_KEY", "sim"), OMDB_API_KEY=os.getenv("OMDB_API_KEY", "sim"),
+        )
+        plan = {
+            "jw_watchlist": ("jw_update.py", "lbx-justwatch", "watchlist",
+                             dict(JW_SOURCE="WATCHLIST", JW_SLEEP_S=args.jw_sleep, JW_BATCH_SIZE=args.batch)),
+            "jw_diary":     ("jw_update.py", "lbx-justwatch", "diary",
+                             dict(JW_SOURCE="DIARY", JW_SLEEP_S=args.jw_sleep, JW_BATCH_SIZE=args.batch)),
+            "enrich":       ("enrich_details.py", "lbx-enrich", "jw_title_map",
+                             dict(ENRICH_SLEEP_SECONDS=args.enrich_sleep, ENRICH_BATCH_LIMIT=args.batch)),
+        }
+        for step in [s.strip() for s in args.stages.split(",") if s.strip()]:
+            script, job, titles_table, extra = plan[step]
+            metrics_dir = os.path.join(work, f"metrics-{step}")
+            print(f"▶ {step}", file=sys.stderr)
+            before = sim_stats(base)
+            code, wall, peak_kib = run_stage(script, stage_env(metrics_dir, **api_env, **extra))
+            summary = summarize(os.path.join(metrics_dir, f"{job}.prom"), titles_table)
+            summary.update(
+                step=step,
+                exit_code=code,
+                seconds=round(wall, 3),
+                titles_per_sec=round(summary["titles"] / wall, 2) if wall else None,
+                peak_rss_mb=round(peak_kib / 1024, 1),
+                simulator=stats_delta(before, sim_stats(base)),
+            )
+            print(f"  {summary['titles']} titles, {summary['titles_per_sec']} titles/s, "
+                  f"{summary['api_calls_per_title']} calls/title, exit={code}", file=sys.stderr)
+            results.append(summary)
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+        if server:
+            server.shutdown()
+            server.server_close()
+
+    report = {
+        "benchmark": "api",
+        "started_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "git_rev": git_rev(),
+        "python": platform.python_version(),
+        "db": BENCH_DB_NAME,
+        "faults": {k: getattr(args, k) for k in ("latency_ms", "jitter_ms", "rate_429", "retry_after", "max_rps",
+                                                  "rate_timeout", "timeout_s", "rate_error", "omdb_daily_limit")},
+        "results": results,
+    }
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    print(text)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+
+    if any(r["exit_code"] != 0 for r in results):
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+# bench_loader.py — end-to-end loader benchmark against a throwaway MariaDB
+# - Generates synthetic exports (gen_export.py) at one or more sizes
+# - Runs loader.py as a child process per size, into a fresh BENCH_DB each time
+# - Records wall time, rows/sec, peak RSS, SQL statement counts per table (from
+#   the loader's metrics textfile) and final table row counts
+# - Writes machine-readable JSON; --baseline fails the run on a throughput regression
+#
+# Throwaway DB: `docker compose --profile bench up -d lbx-bench-db` (port 3307), then
+#   python bench_loader.py --sizes 10000,100000,1000000 --out bench_loader.json
+
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+from datetime import datetime, timezone
+
+import pymysql
+
+from gen_export import generate
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+BENCH_DB = dict(
+    host=os.getenv("BENCH_DB_HOST", "127.0.0.1"),
+    port=int(os.getenv("BENCH_DB_PORT", "3307")),
+    user=os.getenv("BENCH_DB_USER", "root"),
+    password=os.getenv("BENCH_DB_PASS", ""),
+)
+BENCH_DB_NAME = os.getenv("BENCH_DB_NAME", "lbx_bench")
+
+# Row mix per export, roughly a heavy Letterboxd user
+SPLIT = {"watchlist": 0.2, "watched": 0.4, "diary": 0.4}
+
+# logger.log_to_db target inside the bench DB, so stages log to a table that exists instead of
+# paying a failed connection + error print per log line
+SQL_CREATE_LOGS = """
+CREATE TABLE logs (
+  id           BIGINT AUTO_INCREMENT PRIMARY KEY,
+  project_name VARCHAR(64) NOT NULL,
+  log_level    VARCHAR(16) NOT NULL,
+  message      TEXT,
+  created_at   TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci
+"""
+
+METRIC_LINE = re.compile(r'^lbx_(\w+?)(?:\{([^}]*)\})? (\S+)$')
+
+def git_rev():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=HERE, text=True).strip()
+    except Exception:
+        return None
+
+def reset_db():
+    conn = pymysql.connect(**BENCH_DB, autocommit=True)
+    try:
+        with conn.cursor() as c:
+            c.execute(f"DROP DATABASE IF EXISTS `{BENCH_DB_NAME}`")
+            c.execute(f"CREATE DATABASE `{BENCH_DB_NAME}` CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci")
+            c.execute(f"USE `{BENCH_DB_NAME}`")
+            c.execute(SQL_CREATE_LOGS)
+    finally:
+        conn.close()
+
+def table_counts():
+    conn = pymysql.connect(**BENCH_DB, database=BENCH_DB_NAME)
+    try:
+        out = {}
+        with conn.cursor() as c:
+            for t in ("watchlist", "watched", "diary"):
+                c.execute(f"SELECT COUNT(*) FROM `{t}`")
+                out[t] = c.fetchone()[0]
+        return out
+    finally:
+        conn.close()
+
+def read_prom(path):
+    """Parse a metrics .prom file into [(name, labels, value)], skipping comments."""
+    out = []
+    if not os.path.exists(path):
+        return out
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            m = METRIC_LINE.match(line.strip())
+            if m:
+                out.append((m.group(1), dict(re.findall(r'(\w+)="([^"]*)"', m.group(2) or "")), float(m.group(3))))
+    return out
+
+def parse_metrics(path):
+    """Pull statement counts and rows_total out of a loader .prom file."""
+    stmts, rows = {}, {}
+    for name, labels, value in read_prom(path):
+        if name == "rows_total":
+            rows[labels.get("table")] = int(value)
+        elif name == "sql_latency_seconds_count":
+            stmts[labels.get("statement")] = int(value)
+    return stmts, rows
+
+def stage_env(metrics_dir, **extra):
+    """Environment for running a pipeline stage against the bench DB."""
+    env = dict(os.environ)
+    env.update(
+        METRICS_DIR=metrics_dir,
+        MARIADB_HOST=BENCH_DB["host"],
+        MARIADB_PORT=str(BENCH_DB["port"]),
+        MARIADB_USER=BENCH_DB["user"],
+        MARIADB_PASS=BENCH_DB["password"],
+        MARIADB_DB=BENCH_DB_NAME,
+        # keep benchmark log lines out of the real logs DB (reset_db creates a logs table here)
+        LOG_DB_HOST=BENCH_DB["host"],
+        LOG_DB_PORT=str(BENCH_DB["port"]),
+        LOG_DB_USER=BENCH_DB["user"],
+        LOG_DB_PASS=BENCH_DB["password"],
+        LOG_DB_NAME=BENCH_DB_NAME,
+        PYTHONUNBUFFERED="1",
+    )
+    env.update({k: str(v) for k, v in extra.items()})
+    return env
+
+def run_stage(script, env):
+    """Run one stage script as a child; returns (exit_code, wall_s, peak_rss_kib)."""
+    t0 = time.perf_counter()
+    # stage output goes to stderr so stdout stays pure JSON
+    p = subprocess.Popen([sys.executable, os.path.join(HERE, script)], env=env, cwd=HERE, stdout=sys.stderr)
+    _, status, usage = os.wait4(p.pid, 0)
+    wall = time.perf_counter() - t0
+    p.returncode = os.waitstatus_to_exitcode(status)
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = usage.ru_maxrss / 1024 if platform.system() == "Darwin" else usage.ru_maxrss
+    return p.returncode, wall, peak
+
+def run_loader(export_dir, metrics_dir):
+    return run_stage("loader.py", stage_env(metrics_dir, DOWNLOAD_DIR=export_dir))
+
+def bench_size(total_rows, args):
+    counts = {k: int(total_rows * v) for k, v in SPLIT.items()}
+    work = tempfile.mkdtemp(prefix="lbx-bench-")
+    try:
+        export_dir = os.path.join(work, "exports")
+        metrics_dir = os.path.join(work, "metrics")
+        os.makedirs(export_dir)
+
+        t0 = time.perf_counter()
+        generate(os.path.join(export_dir, "letterboxd-bench.zip"), counts["watchlist"], counts["watched"],
+                 counts["diary"], args.dup_rate, args.malformed_rate, args.seed, folder="letterboxd-bench")
+        gen_s = time.perf_counter() - t0
+
+        reset_db()
+        code, wall, peak_kib = run_loader(export_dir, metrics_dir)
+        stmts, rows = parse_metrics(os.path.join(metrics_dir, "letterboxd_loader.prom"))
+        return {
+            "rows": sum(counts.values()),
+            "csv_rows": counts,
+            "exit_code": code,
+            "generate_seconds": round(gen_s, 3),
+            "seconds": round(wall, 3),
+            "rows_per_sec": round(sum(counts.values()) / wall, 1) if wall else None,
+            "peak_rss_mb": round(peak_kib / 1024, 1),
+            "statements": stmts,
+            "rows_upserted": rows,
+            "table_rows": table_counts() if code == 0 else None,
+        }
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+def check_regressions(results, baseline_path, max_regression):
+    """Compare rows/sec per size against a previous run; returns list of failure messages."""
+    with open(baseline_path, encoding="utf-8") as f:
+        base = {r["rows"]: r for r in json.load(f).get("results", [])}
+    failures = []
+    for r in results:
+        b = base.get(r["rows"])
+        if not b or not b.get("rows_per_sec") or not r.get("rows_per_sec"):
+            continue
+        drop = 1 - r["rows_per_sec"] / b["rows_per_sec"]
+        if drop > max_regression:
+            failures.append(f"rows={r['rows']}: {r['rows_per_sec']} rows/s vs baseline "
+                            f"{b['rows_per_sec']} ({drop:.0%} slower)")
+    return failures
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark loader.py end to end")
+    ap.add_argument("--sizes", default="10000,100000", help="Comma-separated total row counts")
+    ap.add_argument("--dup-rate", type=float, default=0.02)
+    ap.add_argument("--malformed-rate", type=float, default=0.005)
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--out", help="Write results JSON here (default: stdout only)")
+    ap.add_argument("--baseline", help="Previous results JSON to compare rows/sec against")
+    ap.add_argument("--max-regression", type=float, default=0.15, help="Allowed rows/sec drop vs baseline")
+    ap.add_argument("--keep-db", action="store_true", help="Don't drop BENCH_DB_NAME at the end")
+    args = ap.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    results = []
+    for n in sizes:
+        print(f"▶ loader benchmark: {n} rows", file=sys.stderr)
+        r = bench_size(n, args)
+        print(f"  {r['rows_per_sec']} rows/s, {r['seconds']}s, peak RSS {r['peak_rss_mb']} MB, exit={r['exit_code']}",
+              file=sys.stderr)
+        results.append(r)
+
+    report = {
+        "benchmark": "loader",
+        "started_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "git_rev": git_rev(),
+        "python": platform.python_version(),
+        "results": results,
+    }
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    print(text)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+
+    if not args.keep_db:
+        conn = pymysql.connect(**BENCH_DB, autocommit=True)
+        try:
+            with conn.cursor() as c:
+                c.execute(f"DROP DATABASE IF EXISTS `{BENCH_DB_NAME}`")
+        finally:
+            conn.close()
+
+    failed = [r for r in results if r["exit_code"] != 0]
+    if failed:
+        raise SystemExit(f"loader failed for sizes: {[r['rows'] for r in failed]}")
+    if args.baseline:
+        regressions = check_regressions(results, args.baseline, args.max_regression)
+        if regressions:
+            raise SystemExit("Throughput regression:\n  " + "\n  ".join(regressions))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+# bench_matching.py — accuracy + throughput of jw_update.pick_best_match on labeled title cases
+# - fixtures/title_match.json: query title/year, the search results (JustWatch-shaped dicts) and the
+#   index of the right answer; covers diacritics, articles ("Matrix, The"), punctuation, &/and,
+#   typos and same-title remakes that only the year separates
+# - "legacy" is the exact-string scorer pick_best_match used before title_match.py, kept here so
+#   the two can be compared on the same cases
+# - Throughput replays the cases --repeat times (normalize() is LRU-cached, like a real batch run
+#   that sees the same titles across sources)
+#
+#   python bench_matching.py --repeat 200 --out bench_matching.json
+
+import os
+import json
+import time
+import argparse
+import platform
+from datetime import datetime, timezone
+
+import jw_update
+import title_match
+from bench_loader import git_rev
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+FIXTURE = os.path.join(HERE, "fixtures", "title_match.json")
+
+def legacy_pick(results, title, year):
+    """Pre-title_match scorer: exact / substring match on strip().lower()."""
+    def norm(s): return (s or "").strip().lower()
+    tnorm = norm(title)
+    scored = []
+    for i, r in enumerate(results):
+        r_title = jw_update.g(r, "title", "original_title", "name") or ""
+        r_year = jw_update.result_year(r)
+        score = 0
+        if norm(r_title) == tnorm:
+            score += 10
+            if year and r_year == year:
+                score += 10
+        elif tnorm and tnorm in norm(r_title):
+            score += 3
+            if year and r_year and abs(r_year - year) <= 1:
+                score += 2
+        scored.append((score, i))
+    if not scored:
+        return None
+    scored.sort(key=lambda x: x[0], reverse=True)
+    return scored[0][1]
+
+def current_pick(results, title, year):
+    best = jw_update.pick_best_match(results, title, year)[0]
+    return next((i for i, r in enumerate(results) if r is best), None)
+
+SCORERS = {"legacy": legacy_pick, "title_match": current_pick}
+
+def run(name, pick, cases, repeat):
+    misses = [c for c in cases if pick(c["results"], c["query"], c["year"]) != c["expect"]]
+    title_match.normalize.cache_clear()
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        for c in cases:
+            pick(c["results"], c["query"], c["year"])
+    elapsed = time.perf_counter() - t0
+    n = repeat * len(cases)
+    return {
+        "scorer": name,
+        "cases": len(cases),
+        "correct": len(cases) - len(misses),
+        "accuracy": round((len(cases) - len(misses)) / len(cases), 4),
+        "misses": [{"query": c["query"], "year": c["year"], "note": c.get("note")} for c in misses],
+        "lookups": n,
+        "seconds": round(elapsed, 4),
+        "lookups_per_s": round(n / elapsed, 1) if elapsed else None,
+    }
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark title matching accuracy and throughput")
+    ap.add_argument("--fixture", default=FIXTURE, help="Labeled cases JSON")
+    ap.add_argument("--repeat", type=int, default=200, help="Times to replay the cases for throughput")
+    ap.add_argument("--out", help="Write results JSON here (default: stdout only)")
+    args = ap.parse_args()
+
+    with open(args.fixture, encoding="utf-8") as f:
+        cases = json.load(f)
+
+    report = {
+        "benchmark": "matching",
+        "started_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "git_rev": git_rev(),
+        "python": platform.python_version(),
+        "fixture": os.path.relpath(args.fixture, HERE),
+        "results": [run(name, pick, cases, args.repeat) for name, pick in SCORERS.items()],
+    }
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    print(text)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,18 @@
 import os, time, json
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 import requests
 import pymysql
 from pymysql.cursors import DictCursor
 from dotenv import load_dotenv
 from logger import log_to_db
+import metrics
+import profiling
+import pipeline_state
+import film_dims
+import stats
+import api_budget
+import title_match
 
 PROJECT = "lbx-enrich"
 load_dotenv()
@@ -25,10 +34,73 @@ DB = dict(
 
 BATCH_LIMIT   = int(os.getenv("ENRICH_BATCH_LIMIT", "300"))  # how many jw_title_map rows per run
 SLEEP_SECONDS = float(os.getenv("ENRICH_SLEEP_SECONDS", "0.35"))  # be nice to TMDb
+DIMS_BATCH    = int(os.getenv("ENRICH_DIMS_BATCH", "25"))  # films per bulk write of genre/person/country links
+
+# ENRICH_MODE=enrich  → new jw_title_map rows (default)
+# ENRICH_MODE=refresh → re-fetch film_details rows TMDb reports as changed since the last checkpoint
+# ENRICH_MODE=boxoffice → queue every film still missing box office, then spend today's OMDb quota
+ENRICH_MODE           = os.getenv("ENRICH_MODE", "enrich").lower()
+REFRESH_BATCH_SIZE    = int(os.getenv("REFRESH_BATCH_SIZE", "50"))
+REFRESH_WORKERS       = int(os.getenv("REFRESH_WORKERS", "4"))
+REFRESH_LOOKBACK_DAYS = int(os.getenv("REFRESH_LOOKBACK_DAYS", "1"))   # first run, no checkpoint yet
+REFRESH_MAX_ATTEMPTS  = int(os.getenv("REFRESH_MAX_ATTEMPTS", "5"))    # failed ids retried on later runs
+TMDB_CHANGES_MAX_DAYS = 14                                             # TMDb rejects longer ranges
+
+# API endpoints are overridable so runs can target api_sim.py instead of production quotas
+TMDB_BASE        = os.getenv("TMDB_BASE_URL", "https://api.themoviedb.org/3").rstrip("/")
+OMDB_BASE        = os.getenv("OMDB_BASE_URL", "https://www.omdbapi.com/")
+TMDB_TIMEOUT_S   = float(os.getenv("TMDB_TIMEOUT_S", "20"))
+TMDB_MAX_RETRIES = int(os.getenv("TMDB_MAX_RETRIES", "3"))   # 429 / 5xx / timeouts; honours Retry-After
+RETRY_STATUS     = {429, 500, 502, 503, 504}
+
+# Daily quotas (UTC days, tracked in api_usage across runs); 0 = unlimited, usage still recorded.
+# OMDb box office lookups are queued in api_backlog and made highest priority first at the end of
+# each run; OMDB_MIN_PRIORITY=0 also spends leftover quota on series (OMDb has no box office for them)
+OMDB_DAILY_QUOTA  = int(os.getenv("OMDB_DAILY_QUOTA", "1000"))   # free key limit
+TMDB_DAILY_QUOTA  = int(os.getenv("TMDB_DAILY_QUOTA", "0"))
+OMDB_MIN_PRIORITY = int(os.getenv("OMDB_MIN_PRIORITY", "1"))
+OMDB_MAX_ATTEMPTS = int(os.getenv("OMDB_MAX_ATTEMPTS", "3"))
+OMDB_QUOTA_ERROR  = "Request limit reached!"
+
+OMDB_BUDGET = api_budget.Budget("omdb", OMDB_DAILY_QUOTA)
+TMDB_BUDGET = api_budget.Budget("tmdb", TMDB_DAILY_QUOTA)
+
+# one keep-alive connection pool for TMDb + OMDb, shared by the refresh workers
+HTTP = requests.Session()
+HTTP.mount("https://", requests.adapters.HTTPAdapter(pool_maxsize=max(10, REFRESH_WORKERS)))
+HTTP.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=max(10, REFRESH_WORKERS)))
 
 # ---- SQL ----
+SQL_CREATE_DETAILS = """
+CREATE TABLE IF NOT EXISTS film_details (
+  id              INT AUTO_INCREMENT PRIMARY KEY,
+  type            VARCHAR(8),
+  title           VARCHAR(255),
+  original_title  VARCHAR(255),
+  year            INT NULL,
+  release_date    VARCHAR(10) NULL,
+  imdb_id         VARCHAR(16) NULL,
+  tmdb_id         INT NULL,
+  jw_entry_id     VARCHAR(32) NULL,
+  genres_json     TEXT,
+  runtime_min     INT NULL,
+  countries_json  TEXT,
+  languages_json  TEXT,
+  directors_json  TEXT,
+  cast_json       TEXT,
+  poster_url      VARCHAR(255),
+  backdrop_url    VARCHAR(255),
+  tmdb_vote_avg   FLOAT NULL,
+  tmdb_vote_count INT NULL,
+  box_office_usd  BIGINT NULL,
+  UNIQUE KEY uq_film_details_tmdb (type, tmdb_id),
+  KEY ix_imdb_id (imdb_id),
+  KEY ix_jw_entry_id (jw_entry_id)
+) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci;
+"""
+
 SQL_SELECT_TARGETS = f"""
-SELECT source, source_row_id, entry_id, matched_title, matched_year, matched_type
+SELECT source, source_row_id, entry_id, matched_title, matched_year, matched_type, matched_title_norm
 FROM jw_title_map
 WHERE film_id IS NULL
 ORDER BY source, source_row_id
@@ -60,7 +132,7 @@ ON DUPLICATE KEY UPDATE
   backdrop_url=VALUES(backdrop_url),
   tmdb_vote_avg=VALUES(tmdb_vote_avg),
   tmdb_vote_count=VALUES(tmdb_vote_count),
-  box_office_usd=VALUES(box_office_usd);
+  box_office_usd=COALESCE(VALUES(box_office_usd), box_office_usd);
 """
 
 SQL_RESOLVE_FILM_ID = """
@@ -71,6 +143,65 @@ WHERE (imdb_id IS NOT NULL AND imdb_id=%s)
 LIMIT 1;
 """
 
+SQL_SELECT_TMDB_IDS = """
+SELECT id, tmdb_id, imdb_id FROM film_details
+WHERE type=%s AND tmdb_id IS NOT NULL;
+"""
+
+# Refresh keeps box_office_usd / jw_entry_id (not from TMDb) and never blanks a known imdb_id
+SQL_REFRESH_DETAILS = """
+UPDATE film_details SET
+  title=%s, original_title=%s, year=%s, release_date=%s,
+  imdb_id=COALESCE(%s, imdb_id),
+  genres_json=%s, runtime_min=%s, countries_json=%s, languages_json=%s,
+  directors_json=%s, cast_json=%s, poster_url=%s, backdrop_url=%s,
+  tmdb_vote_avg=%s, tmdb_vote_count=%s
+WHERE id=%s;
+"""
+
+# box office backlog: live film_details row decides whether the call is still worth making
+SQL_CLEAN_BOX_OFFICE_BACKLOG = """
+DELETE b FROM api_backlog b
+JOIN film_details f ON f.id = b.film_id
+WHERE b.api = 'omdb' AND f.box_office_usd IS NOT NULL;
+"""
+
+SQL_NEXT_BOX_OFFICE = """
+SELECT b.film_id, b.priority, f.imdb_id
+FROM api_backlog b
+JOIN film_details f ON f.id = b.film_id
+WHERE b.api = 'omdb' AND b.priority >= %s AND f.imdb_id IS NOT NULL AND f.box_office_usd IS NULL
+  AND (b.priority < %s OR (b.priority = %s AND b.film_id > %s))
+ORDER BY b.priority DESC, b.film_id
+LIMIT %s;
+"""
+
+SQL_SEED_BOX_OFFICE = """
+INSERT IGNORE INTO api_backlog (api, film_id, priority, reason, queued_at)
+SELECT 'omdb', id,
+       CASE WHEN type <> 'MOVIE' THEN 0
+            WHEN imdb_id IS NULL THEN -1
+            ELSE 10 + LEAST(90, COALESCE(tmdb_vote_count, 0) DIV 100) END,
+       'backfill', NOW()
+FROM film_details
+WHERE box_office_usd IS NULL;
+"""
+
+SQL_SET_BOX_OFFICE = "UPDATE film_details SET box_office_usd=%s WHERE id=%s"
+
+SQL_DONE_BOX_OFFICE = "DELETE FROM api_backlog WHERE api='omdb' AND film_id=%s"
+
+# changed ids whose refresh fetch failed; retried by the next refresh run (api_backlog api='tmdb_refresh')
+SQL_SELECT_REFRESH_RETRIES = """
+SELECT f.tmdb_id
+FROM api_backlog b
+JOIN film_details f ON f.id = b.film_id
+WHERE b.api = 'tmdb_refresh' AND f.type = %s AND f.tmdb_id IS NOT NULL;
+"""
+SQL_DONE_REFRESH = "DELETE FROM api_backlog WHERE api='tmdb_refresh' AND film_id=%s"
+
+SQL_FILM_BY_ENTRY = "SELECT id FROM film_details WHERE jw_entry_id=%s LIMIT 1"
+
 SQL_SET_MAP_FILM_ID = """
 UPDATE jw_title_map
 SET film_id=%s
@@ -78,30 +209,55 @@ WHERE source=%s AND source_row_id=%s;
 """
 
 # ---- TMDb / OMDb helpers ----
-TMDB_BASE = "https://api.themoviedb.org/3"
-
-def tmdb_get(path, params=None):
+def tmdb_get(path, params=None, endpoint=None):
     if not TMDB_API_KEY:
         raise RuntimeError("Set TMDB_API_KEY")
     p = {"api_key": TMDB_API_KEY}
     if params: p.update(params)
-    r = requests.get(f"{TMDB_BASE}/{path.lstrip('/')}", params=p, timeout=20)
-    r.raise_for_status()
-    return r.json()
+    url = f"{TMDB_BASE}/{path.lstrip('/')}"
+    for attempt in range(TMDB_MAX_RETRIES + 1):
+        last_try = attempt == TMDB_MAX_RETRIES
+        if not TMDB_BUDGET.try_spend():
+            raise api_budget.QuotaExhausted("TMDB_DAILY_QUOTA used up for today")
+        try:
+            with metrics.timed_api("tmdb", endpoint) as call:
+                r = HTTP.get(url, params=p, timeout=TMDB_TIMEOUT_S)
+                call.status(r.status_code)
+        except (requests.Timeout, requests.ConnectionError):
+            if last_try:
+                raise
+            metrics.inc("api_retries_total", api="tmdb", reason="timeout")
+            time.sleep(api_budget.retry_delay(None, attempt))
+            continue
+        if r.status_code in RETRY_STATUS and not last_try:
+            metrics.inc("api_retries_total", api="tmdb", reason=str(r.status_code))
+            time.sleep(api_budget.retry_delay(r, attempt))
+            continue
+        r.raise_for_status()
+        return r.json()
 
-def tmdb_search(title, year, obj_type):
+def tmdb_search(title, year, obj_type, title_norm=None):
     media = "movie" if (obj_type or "").upper() == "MOVIE" else "tv"
     params = {"query": title}
     if year and media == "movie":
         params["year"] = year
     if year and media == "tv":
         params["first_air_date_year"] = year
-    js = tmdb_get(f"/search/{media}", params)
+    js = tmdb_get(f"/search/{media}", params, endpoint=f"search_{media}")
     res = js.get("results") or []
-    return res[0]["id"] if res else None, media
+    if media == "movie":
+        candidates = [((r.get("title"), r.get("original_title")), _year_of(r.get("release_date"))) for r in res]
+    else:
+        candidates = [((r.get("name"), r.get("original_name")), _year_of(r.get("first_air_date"))) for r in res]
+    idx, _, _ = title_match.best_match(title, year, candidates, query_norm=title_norm or None)
+    return res[idx]["id"] if idx is not None else None, media
+
+def _year_of(date_str):
+    y = (date_str or "")[:4]
+    return int(y) if y.isdigit() else None
 
 def tmdb_bundle(tmdb_id, media):
-    core = tmdb_get(f"/{media}/{tmdb_id}", {"append_to_response": "external_ids,credits,images"})
+    core = tmdb_get(f"/{media}/{tmdb_id}", {"append_to_response": "external_ids,credits,images"}, endpoint=f"{media}_details")
     ext  = (core.get("external_ids") or {})
     imdb_id = ext.get("imdb_id")
 
@@ -138,21 +294,110 @@ def tmdb_bundle(tmdb_id, media):
         vote_avg=vote_avg, vote_count=vote_cnt
     )
 
+def tmdb_changed_ids(media, start, end):
+    """All ids TMDb reports as changed for movie|tv between two dates (≤ 14 days apart), all pages."""
+    ids, page, pages = set(), 1, 1
+    while page <= pages:
+        js = tmdb_get(f"/{media}/changes", {
+            "start_date": start.strftime("%Y-%m-%d"),
+            "end_date": end.strftime("%Y-%m-%d"),
+            "page": page,
+        }, endpoint=f"{media}_changes")
+        ids.update(r["id"] for r in (js.get("results") or []) if r.get("id") is not None)
+        pages = int(js.get("total_pages") or 1)
+        page += 1
+    return ids
+
+def box_office_priority(media_type, imdb_id, vote_count):
+    """Value of an OMDb box office lookup: popular movies first, series last, no imdb id = can't ask."""
+    if media_type != "MOVIE":
+        return 0
+    if not imdb_id:
+        return -1
+    return 10 + min(90, (vote_count or 0) // 100)
+
 def omdb_box_office(imdb_id):
-    if not OMDB_API_KEY or not imdb_id:
-        return None
-    try:
-        r = requests.get("https://www.omdbapi.com/", params={"apikey": OMDB_API_KEY, "i": imdb_id}, timeout=15)
-        r.raise_for_status()
-        data = r.json()
-        if data.get("Response") != "True":
-            return None
-        raw = (data.get("BoxOffice") or "").replace("$","").replace(",","").strip()
-        return int(raw) if raw.isdigit() else None
-    except Exception:
+    """Box office in USD, or None when OMDb has none. Raises api_budget.QuotaExhausted when OMDb
+    refuses for quota reasons and requests errors for anything retryable."""
+    with metrics.timed_api("omdb", "title") as call:
+        r = HTTP.get(OMDB_BASE, params={"apikey": OMDB_API_KEY, "i": imdb_id}, timeout=15)
+        call.status(r.status_code)
+        try:
+            data = r.json()
+        except ValueError:
+            data = {}
+        if data.get("Error") == OMDB_QUOTA_ERROR:
+            call.outcome = "throttled"
+    if data.get("Error") == OMDB_QUOTA_ERROR:
+        raise api_budget.QuotaExhausted(OMDB_QUOTA_ERROR)
+    r.raise_for_status()
+    if data.get("Response") != "True":
         return None
+    raw = (data.get("BoxOffice") or "").replace("$","").replace(",","").strip()
+    return int(raw) if raw.isdigit() else None
+
+def queue_box_office(conn, films, reason):
+    """films: [(film_id, media_type, imdb_id, vote_count)] → api_backlog (no-op without an OMDb key)."""
+    if not OMDB_API_KEY or not films:
+        return
+    with conn.cursor() as c, metrics.timed_sql("queue_box_office"):
+        api_budget.enqueue(c, "omdb", [(fid, box_office_priority(t, imdb, votes), reason)
+                                       for fid, t, imdb, votes in films])
+
+def drain_box_office(conn):
+    """Spend what's left of today's OMDb quota on the highest-priority queued films."""
+    if not OMDB_API_KEY:
+        return
+    with conn.cursor() as c:
+        c.execute(SQL_CLEAN_BOX_OFFICE_BACKLOG)
+        OMDB_BUDGET.load(c)
+    if OMDB_BUDGET.remaining() == 0:
+        log_to_db(PROJECT, "INFO", "OMDb quota already used up today; box office backlog waits for tomorrow")
+        return
+
+    found = tried = 0
+    cursor = (10 ** 9, 0)   # keyset over (priority DESC, film_id)
+    stop = False
+    while not stop:
+        with conn.cursor() as c, metrics.timed_sql("select_box_office_backlog"):
+            c.execute(SQL_NEXT_BOX_OFFICE, (OMDB_MIN_PRIORITY, cursor[0], cursor[0], cursor[1], 100))
+            rows = c.fetchall()
+        if not rows:
+            break
+        for r in rows:
+            cursor = (r["priority"], r["film_id"])
+            if not OMDB_BUDGET.try_spend():
+                stop = True
+                break
+            tried += 1
+            try:
+                value = omdb_box_office(r["imdb_id"])
+            except api_budget.QuotaExhausted:
+                OMDB_BUDGET.mark_exhausted()
+                log_to_db(PROJECT, "WARNING", f"OMDb says \"{OMDB_QUOTA_ERROR}\" after {tried} calls; stopping for today")
+                stop = True
+                break
+            except Exception as e:
+                log_to_db(PROJECT, "WARNING", f"OMDb lookup failed for film {r['film_id']} ({r['imdb_id']}): {e}")
+                with conn.cursor() as c:
+                    api_budget.retry_later(c, "omdb", r["film_id"], OMDB_MAX_ATTEMPTS)
+                continue
+            with conn.cursor() as c, metrics.timed_sql("set_box_office"):
+                if value is not None:
+                    c.execute(SQL_SET_BOX_OFFICE, (value, r["film_id"]))
+                    found += 1
+                c.execute(SQL_DONE_BOX_OFFICE, (r["film_id"],))
+            time.sleep(SLEEP_SECONDS)
+        with conn.cursor() as c:
+            OMDB_BUDGET.flush(c)
+        metrics.maybe_flush(PROJECT)
+
+    metrics.inc("rows_total", found, stage=PROJECT, table="box_office")
+    log_to_db(PROJECT, "INFO", f"✓ Box office: {tried} OMDb calls, {found} figures found, "
+                               f"{OMDB_BUDGET.remaining()} calls left today")
 
 # ---- Core ----
+@profiling.hot
 def enrich_one(conn, row):
     src, src_id = row["source"], row["source_row_id"]
     title       = (row["matched_title"] or "").strip()
@@ -165,7 +410,7 @@ def enrich_one(conn, row):
         return
 
     # 1) Find TMDb id
-    tmdb_id, media = tmdb_search(title, year, obj_type)
+    tmdb_id, media = tmdb_search(title, year, obj_type, row.get("matched_title_norm"))
     if not tmdb_id:
         log_to_db(PROJECT, "WARNING", f"No TMDb match: {title} ({year}) [{obj_type}]")
         return
@@ -173,37 +418,265 @@ def enrich_one(conn, row):
     # 2) Fetch full bundle (and imdb id)
     b = tmdb_bundle(tmdb_id, media)
 
-    # 3) Optional OMDb box office
-    box_office = omdb_box_office(b.get("imdb_id"))
-
     # 4) Upsert into film_details
     with conn.cursor() as c:
-        c.execute(SQL_UPSERT_DETAILS, (
-            "MOVIE" if media == "movie" else "SHOW",
-            b["title"], b["original_title"], b["year"], b["release_date"],
-            b["imdb_id"], tmdb_id, entry_id,
-            json.dumps(b["genres"], ensure_ascii=False),
-            b["runtime_min"],
-            json.dumps(b["countries"], ensure_ascii=False),
-            json.dumps(b["languages"], ensure_ascii=False),
-            json.dumps(b["directors"], ensure_ascii=False),
-            json.dumps(b["cast"], ensure_ascii=False),
-            b["poster"], b["backdrop"],
-            b["vote_avg"], b["vote_count"],
-            box_office
-        ))
+        with metrics.timed_sql("upsert_details"):
+            c.execute(SQL_UPSERT_DETAILS, (
+                "MOVIE" if media == "movie" else "SHOW",
+                b["title"], b["original_title"], b["year"], b["release_date"],
+                b["imdb_id"], tmdb_id, entry_id,
+                json.dumps(b["genres"], ensure_ascii=False),
+                b["runtime_min"],
+                json.dumps(b["countries"], ensure_ascii=False),
+                json.dumps(b["languages"], ensure_ascii=False),
+                json.dumps(b["directors"], ensure_ascii=False),
+                json.dumps(b["cast"], ensure_ascii=False),
+                b["poster"], b["backdrop"],
+                b["vote_avg"], b["vote_count"],
+                None   # box office comes later from the OMDb backlog (drain_box_office)
+            ))
 
         # resolve id
-        c.execute(SQL_RESOLVE_FILM_ID, (b["imdb_id"], tmdb_id, entry_id))
-        film = c.fetchone()
+        with metrics.timed_sql("resolve_film_id"):
+            c.execute(SQL_RESOLVE_FILM_ID, (b["imdb_id"], tmdb_id, entry_id))
+            film = c.fetchone()
         if not film:
             log_to_db(PROJECT, "ERROR", f"Upsert ok but SELECT id failed for {title}")
             return
+    # jw_title_map.film_id is set by enrich_rows once the film's dimension links are written
 
-        # 5) Backfill jw_title_map.film_id
-        c.execute(SQL_SET_MAP_FILM_ID, (film["id"], src, src_id))
-
+    queue_box_office(conn, [(film["id"], "MOVIE" if media == "movie" else "SHOW", b["imdb_id"], b["vote_count"])], "enrich")
+    metrics.inc("rows_total", stage=PROJECT, table="film_details")
     log_to_db(PROJECT, "INFO", f"Enriched {src}:{src_id} → film_id {film['id']} ({b['title']})")
+    return film_dims.from_bundle(film["id"], b)
+
+def known_film(conn, row, film_ids):
+    """film_details id already enriched for this row's JustWatch entry (film_ids caches
+    entry_id → film id for the run), or None when the entry is new."""
+    entry_id = row.get("entry_id")
+    if not entry_id:
+        return None
+    if entry_id not in film_ids:
+        with conn.cursor() as c, metrics.timed_sql("film_by_entry"):
+            c.execute(SQL_FILM_BY_ENTRY, (entry_id,))
+            film = c.fetchone()
+        if not film:
+            return None
+        film_ids[entry_id] = film["id"]
+    return film_ids[entry_id]
+
+def enrich_rows(conn, rows, total="?", film_ids=None):
+    """
+    Enrich jw_title_map rows (any iterable: a SELECT result, or pipeline.py's queue) and refresh
+    the genre / director stats they touch. With a film_ids dict, rows whose JustWatch entry is
+    already in film_details (same film on watchlist and diary, re-mapped rows) are linked without
+    calling TMDb.
+
+    Dimension links are written in bulk every DIMS_BATCH rows, and jw_title_map.film_id only
+    after them: a crash in between leaves the rows with film_id NULL, so the next run redoes them
+    instead of leaving films without links.
+    """
+    pending = []        # film_dims payloads of newly enriched films
+    pending_maps = []   # (film_id, source, source_row_id) waiting for those links
+    genre_ids, person_ids = set(), set()
+    linked = set()      # films newly linked to diary rows: their links move the stats
+
+    def flush():
+        nonlocal pending, pending_maps
+        try:
+            touched = film_dims.sync_films(conn, pending)
+            if pending_maps:
+                with conn.cursor() as c, metrics.timed_sql("set_map_film_id"):
+                    c.executemany(SQL_SET_MAP_FILM_ID, pending_maps)
+        except Exception as e:
+            # mappings without film_id are picked up again by the next run
+            log_to_db(PROJECT, "ERROR", f"Writing {len(pending_maps)} enriched rows failed: {e}")
+        else:
+            genre_ids.update(touched["genre_ids"])
+            person_ids.update(touched["person_ids"])
+            linked.update(fid for fid, src, _ in pending_maps if src == "DIARY")
+        pending, pending_maps = [], []
+
+    for i, r in enumerate(rows, 1):
+        log_to_db(PROJECT, "INFO", f"[{i}/{total}] {r['source']}:{r['source_row_id']} – {r['matched_title']} ({r.get('matched_year')})")
+        try:
+            film_id = known_film(conn, r, film_ids) if film_ids is not None else None
+            if film_id:
+                pending_maps.append((film_id, r["source"], r["source_row_id"]))
+                metrics.inc("rows_total", stage=PROJECT, table="jw_title_map")
+                continue
+            dims = enrich_one(conn, r)
+            if dims:
+                pending.append(dims)
+                pending_maps.append((dims["film_id"], r["source"], r["source_row_id"]))
+                if film_ids is not None and r.get("entry_id"):
+                    film_ids[r["entry_id"]] = dims["film_id"]
+        except api_budget.QuotaExhausted as e:
+            log_to_db(PROJECT, "WARNING", f"Stopping enrichment at {i}/{total}: {e}")
+            break
+        except Exception as e:
+            # one bad title (API error after retries, bad payload) shouldn't end the batch
+            log_to_db(PROJECT, "ERROR", f"enrich_one failed for {r['source']}:{r['source_row_id']}: {e}")
+        finally:
+            if len(pending_maps) >= DIMS_BATCH:
+                flush()
+        metrics.inc("rows_total", stage=PROJECT, table="jw_title_map")
+        metrics.maybe_flush(PROJECT)
+        time.sleep(SLEEP_SECONDS)
+    flush()
+    try:
+        # newly linked diary rows move their films' genre / director aggregates
+        known = film_dims.linked_keys(conn, linked)
+        stats.refresh(conn, genre_ids=genre_ids | known["genre_ids"], person_ids=person_ids | known["person_ids"])
+    except Exception as e:
+        log_to_db(PROJECT, "ERROR", f"Stats refresh after enrichment failed (python stats.py rebuilds them): {e}")
+
+def run_enrich(conn):
+    with conn.cursor() as c, metrics.timed_sql("select_targets"):
+        c.execute(SQL_SELECT_TARGETS)
+        rows = c.fetchall()
+
+    log_to_db(PROJECT, "INFO", f"Targets: {len(rows)}")
+    enrich_rows(conn, rows, total=len(rows))
+    log_to_db(PROJECT, "INFO", "✓ Enrichment complete")
+
+# ---- Refresh (TMDb changes feed) ----
+GONE = object()   # fetch_refresh: TMDb answered 404, nothing to refresh or retry
+
+def fetch_refresh(tmdb_id, media):
+    """Bundle for one changed id; GONE when TMDb no longer has it, None when the call failed.
+    api_budget.QuotaExhausted is raised: the refresh has to stop, not skip the id."""
+    try:
+        return tmdb_bundle(tmdb_id, media)
+    except api_budget.QuotaExhausted:
+        raise
+    except requests.HTTPError as e:
+        if e.response is not None and e.response.status_code == 404:
+            log_to_db(PROJECT, "WARNING", f"TMDb {media}/{tmdb_id} is gone (404), keeping stored details")
+            return GONE
+        log_to_db(PROJECT, "ERROR", f"Refresh fetch failed for {media}/{tmdb_id}: {e}")
+    except Exception as e:
+        log_to_db(PROJECT, "ERROR", f"Refresh fetch failed for {media}/{tmdb_id}: {e}")
+    return None
+
+def refresh_media(conn, pool, media, since, until):
+    """
+    Re-fetch film_details rows of one media type that changed on TMDb in [since, until], plus
+    ids whose fetch failed on earlier runs. Failed ids go (back) to api_backlog, so the caller
+    can move the checkpoint past this window without losing them.
+    """
+    media_type = "MOVIE" if media == "movie" else "SHOW"
+    with conn.cursor() as c, metrics.timed_sql("select_tmdb_ids"):
+        c.execute(SQL_SELECT_TMDB_IDS, (media_type,))
+        rows = c.fetchall()
+        ours = {r["tmdb_id"]: r["id"] for r in rows}
+        had_imdb = {r["tmdb_id"] for r in rows if r["imdb_id"]}
+        c.execute(SQL_SELECT_REFRESH_RETRIES, (media_type,))
+        retries = {r["tmdb_id"] for r in c.fetchall()}
+    if not ours:
+        return 0
+
+    changed = set()
+    start = since
+    while start < until:
+        end = min(start + timedelta(days=TMDB_CHANGES_MAX_DAYS), until)
+        changed |= tmdb_changed_ids(media, start, end)
+        start = end
+    todo = sorted((changed | retries) & ours.keys())
+    log_to_db(PROJECT, "INFO", f"TMDb {media} changes since {since:%Y-%m-%d}: {len(changed)} total, "
+                               f"{len(todo)} ours ({len(retries)} retried from earlier runs)")
+
+    refreshed = 0
+    for i in range(0, len(todo), REFRESH_BATCH_SIZE):
+        batch = todo[i:i + REFRESH_BATCH_SIZE]
+        fetched = list(pool.map(lambda tid: (tid, fetch_refresh(tid, media)), batch))
+        bundles = [(tid, b) for tid, b in fetched if b and b is not GONE]
+        failed = [tid for tid, b in fetched if b is None]
+        params = [(
+            b["title"], b["original_title"], b["year"], b["release_date"], b["imdb_id"],
+            json.dumps(b["genres"], ensure_ascii=False),
+            b["runtime_min"],
+            json.dumps(b["countries"], ensure_ascii=False),
+            json.dumps(b["languages"], ensure_ascii=False),
+            json.dumps(b["directors"], ensure_ascii=False),
+            json.dumps(b["cast"], ensure_ascii=False),
+            b["poster"], b["backdrop"], b["vote_avg"], b["vote_count"],
+            ours[tid],
+        ) for tid, b in bundles]
+        if params:
+            conn.begin()
+            try:
+                with conn.cursor() as c, metrics.timed_sql("refresh_details"):
+                    c.executemany(SQL_REFRESH_DETAILS, params)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            touched = film_dims.sync_films(conn, [film_dims.from_bundle(ours[tid], b) for tid, b in bundles])
+            stats.refresh(conn, genre_ids=touched["genre_ids"], person_ids=touched["person_ids"])
+            # a refresh can bring the imdb id a box office lookup was waiting for; films that
+            # already had one were queued (and maybe answered without BoxOffice) before
+            if media == "movie":
+                queue_box_office(conn, [(ours[tid], "MOVIE", b["imdb_id"], b["vote_count"])
+                                        for tid, b in bundles if b["imdb_id"] and tid not in had_imdb], "refresh")
+        with conn.cursor() as c, metrics.timed_sql("refresh_backlog"):
+            done = [ours[tid] for tid, b in fetched if b is not None and tid in retries]
+            if done:
+                c.executemany(SQL_DONE_REFRESH, [(fid,) for fid in done])
+            for tid in failed:
+                if tid in retries:
+                    api_budget.retry_later(c, "tmdb_refresh", ours[tid], REFRESH_MAX_ATTEMPTS)
+                else:
+                    api_budget.enqueue(c, "tmdb_refresh", [(ours[tid], 0, "refresh")])
+        refreshed += len(params)
+        metrics.inc("rows_total", len(params), stage=PROJECT, table="film_details_refresh")
+        metrics.maybe_flush(PROJECT)
+        log_to_db(PROJECT, "INFO", f"Refreshed {media} batch {i // REFRESH_BATCH_SIZE + 1}: {len(params)}/{len(batch)}")
+        time.sleep(SLEEP_SECONDS)
+    return refreshed
+
+def run_refresh(conn):
+    # naive UTC, matching how checkpoints are stored
+    run_started = datetime.now(timezone.utc).replace(tzinfo=None)
+    with conn.cursor() as c:
+        pipeline_state.ensure_schema(c)
+
+    with ThreadPoolExecutor(max_workers=REFRESH_WORKERS) as pool:
+        for media in ("movie", "tv"):
+            name = f"tmdb_changes_{media}"
+            with conn.cursor() as c:
+                since = pipeline_state.get_checkpoint(c, name) or run_started - timedelta(days=REFRESH_LOOKBACK_DAYS)
+            try:
+                n = refresh_media(conn, pool, media, since, run_started)
+            except api_budget.QuotaExhausted as e:
+                # checkpoint stays put: the next run re-reads this window once quota is back
+                log_to_db(PROJECT, "WARNING", f"Stopping {media} refresh, checkpoint unchanged: {e}")
+                return
+            # every id in the window was refreshed, is gone (404) or is queued for retry
+            with conn.cursor() as c:
+                pipeline_state.set_checkpoint(c, name, run_started)
+            log_to_db(PROJECT, "INFO", f"✓ Refreshed {n} {media} rows (checkpoint → {run_started:%Y-%m-%d %H:%M})")
+
+def ensure_schema(c):
+    c.execute(SQL_CREATE_DETAILS)
+    # SQL_SELECT_TARGETS reads matched_title_norm even if jw_update.py hasn't run since it was added
+    c.execute("SHOW TABLES LIKE 'jw_title_map'")
+    if c.fetchone() is not None:
+        c.execute("SHOW COLUMNS FROM jw_title_map LIKE 'matched_title_norm'")
+        if c.fetchone() is None:
+            c.execute("ALTER TABLE jw_title_map ADD COLUMN matched_title_norm VARCHAR(255) NULL")
+    film_dims.ensure_schema(c)
+    stats.ensure_schema(c)
+    pipeline_state.ensure_schema(c)
+    api_budget.ensure_schema(c)
+
+def flush_budgets(conn):
+    try:
+        with conn.cursor() as c:
+            TMDB_BUDGET.flush(c)
+            OMDB_BUDGET.flush(c)
+    except Exception as e:
+        log_to_db(PROJECT, "ERROR", f"Failed to record API usage: {e}")
 
 def main():
     if not TMDB_API_KEY:
@@ -212,18 +685,25 @@ def main():
     conn = pymysql.connect(**DB)
     try:
         with conn.cursor() as c:
-            c.execute(SQL_SELECT_TARGETS)
-            rows = c.fetchall()
-
-        log_to_db(PROJECT, "INFO", f"Targets: {len(rows)}")
-        for i, r in enumerate(rows, 1):
-            log_to_db(PROJECT, "INFO", f"[{i}/{len(rows)}] {r['source']}:{r['source_row_id']} – {r['matched_title']} ({r.get('matched_year')})")
-            enrich_one(conn, r)
-            time.sleep(SLEEP_SECONDS)
-
-        log_to_db(PROJECT, "INFO", "✓ Enrichment complete")
+            ensure_schema(c)
+            TMDB_BUDGET.load(c)
+
+        if ENRICH_MODE == "refresh":
+            run_refresh(conn)
+        elif ENRICH_MODE == "boxoffice":
+            with conn.cursor() as c, metrics.timed_sql("seed_box_office"):
+                c.execute(SQL_SEED_BOX_OFFICE)
+                log_to_db(PROJECT, "INFO", f"Queued {c.rowcount} films missing box office")
+        else:
+            run_enrich(conn)
+        drain_box_office(conn)
+        with conn.cursor() as c:
+            pipeline_state.mark_run_complete(c, f"{PROJECT}:{ENRICH_MODE}")
     finally:
+        flush_budgets(conn)
         conn.close()
+        metrics.flush(PROJECT)
 
 if __name__ == "__main__":
-    main()
+    with profiling.run(PROJECT):
+        main()
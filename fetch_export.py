@@ -3,6 +3,8 @@ from datetime import datetime, timezone
 from playwright.async_api import async_playwright
 from dotenv import load_dotenv
 from logger import log_to_db  # <-- NEW
+import metrics
+import profiling
 
 ts = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
 load_dotenv()
@@ -58,8 +60,10 @@ async def run():
             page = await ctx.new_page()
 
             log_to_db(PROJECT_NAME, "INFO", "Opening data settings page")
-            await page.goto(EXPORT_SETTINGS_PATH, wait_until="domcontentloaded")
-            await ensure_signed_in(page)
+            with metrics.timed_api("letterboxd", "settings_page"):
+                await page.goto(EXPORT_SETTINGS_PATH, wait_until="domcontentloaded")
+            with metrics.timed_api("letterboxd", "sign_in"):
+                await ensure_signed_in(page)
 
             if "settings/data" not in page.url:
                 await page.goto(EXPORT_SETTINGS_PATH, wait_until="domcontentloaded")
@@ -80,14 +84,16 @@ async def run():
             except:
                 modal_export = page.locator("a.export-data-button")
 
-            async with page.expect_download() as dl_info:
-                await modal_export.first.click()
-            download = await dl_info.value
+            with metrics.timed_api("letterboxd", "export_download"):
+                async with page.expect_download() as dl_info:
+                    await modal_export.first.click()
+                download = await dl_info.value
 
             ts = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
             suggested = download.suggested_filename or "letterboxd-export.zip"
             out_path = os.path.join(DOWNLOAD_DIR, f"{ts}-{suggested}")
             await download.save_as(out_path)
+            metrics.inc("rows_total", stage=PROJECT_NAME, table="export_zip")
 
             await ctx.storage_state(path=STATE_PATH)
             await browser.close()
@@ -102,4 +108,8 @@ async def run():
 if __name__ == "__main__":
     if not USER or not PASS:
         raise SystemExit("Set LETTERBOXD_USER and LETTERBOXD_PASS (via .env or env vars).")
-    asyncio.run(run())
+    try:
+        with profiling.run(PROJECT_NAME):
+            asyncio.run(run())
+    finally:
+        metrics.flush(PROJECT_NAME)
@@ -0,0 +1,257 @@
+# film_dims.py — normalized genre / person / country / language tables for film_details
+# - film_details keeps its *_json columns; these tables are indexed copies for analytics
+#   ("diary entries directed by X", "hours watched per genre") without parsing JSON per row
+# - sync_films() is called by enrich_details.py per batch; links are rewritten in bulk
+# - Run directly for the one-off backfill over existing film_details rows:
+#     python film_dims.py
+
+import os
+import json
+import pymysql
+from pymysql.cursors import DictCursor
+from dotenv import load_dotenv
+
+from logger import log_to_db
+import metrics
+
+PROJECT_NAME = "lbx-film-dims"
+
+load_dotenv()
+
+BATCH_SIZE = int(os.getenv("FILM_DIMS_BATCH_SIZE", "500"))
+
+DB = dict(
+    host=os.getenv("MARIADB_HOST", "localhost"),
+    port=int(os.getenv("MARIADB_PORT", "3306")),
+    user=os.getenv("MARIADB_USER", "root"),
+    password=os.getenv("MARIADB_PASS", ""),
+    database=os.getenv("MARIADB_DB", "letterboxd"),
+    charset="utf8mb4",
+    cursorclass=DictCursor,
+    autocommit=True,
+)
+
+# ---------- Schema ----------
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS genres (
+      id   INT AUTO_INCREMENT PRIMARY KEY,
+      name VARCHAR(100) NOT NULL,
+      UNIQUE KEY uq_genres_name (name)
+    ) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci;""",
+    """
+    CREATE TABLE IF NOT EXISTS countries (
+      code CHAR(2) PRIMARY KEY
+    ) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci;""",
+    """
+    CREATE TABLE IF NOT EXISTS people (
+      id   INT PRIMARY KEY,              -- TMDb person id
+      name VARCHAR(255) NOT NULL,
+      KEY ix_people_name (name)
+    ) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci;""",
+    """
+    CREATE TABLE IF NOT EXISTS film_genres (
+      film_id  INT NOT NULL,
+      genre_id INT NOT NULL,
+      PRIMARY KEY (film_id, genre_id),
+      KEY ix_film_genres_genre (genre_id, film_id)
+    ) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci;""",
+    """
+    CREATE TABLE IF NOT EXISTS film_countries (
+      film_id      INT NOT NULL,
+      country_code CHAR(2) NOT NULL,
+      PRIMARY KEY (film_id, country_code),
+      KEY ix_film_countries_country (country_code, film_id)
+    ) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci;""",
+    """
+    CREATE TABLE IF NOT EXISTS film_languages (
+      film_id   INT NOT NULL,
+      lang_code VARCHAR(8) NOT NULL,
+      PRIMARY KEY (film_id, lang_code),
+      KEY ix_film_languages_lang (lang_code, film_id)
+    ) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci;""",
+    """
+    CREATE TABLE IF NOT EXISTS film_people (
+      film_id        INT NOT NULL,
+      person_id      INT NOT NULL,
+      role           ENUM('DIRECTOR','CAST') NOT NULL,
+      billing_order  SMALLINT NULL,
+      character_name VARCHAR(255) NULL,
+      PRIMARY KEY (film_id, role, person_id),
+      KEY ix_film_people_person (person_id, role, film_id)
+    ) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci;""",
+]
+
+def ensure_schema(cur):
+    for ddl in SCHEMA:
+        cur.execute(ddl)
+    # film → diary/watchlist joins go through jw_title_map.film_id
+    cur.execute("SHOW TABLES LIKE 'jw_title_map'")
+    if cur.fetchone() is None:
+        return
+    cur.execute("SHOW INDEX FROM jw_title_map WHERE Column_name='film_id' AND Seq_in_index=1")
+    if cur.fetchone() is None:
+        cur.execute("ALTER TABLE jw_title_map ADD KEY ix_film_id (film_id)")
+
+# ---------- Input shapes ----------
+
+def from_bundle(film_id, b):
+    """Dimension payload from an enrich_details.tmdb_bundle() dict."""
+    return dict(film_id=film_id, genres=b.get("genres") or [], countries=b.get("countries") or [],
+                languages=b.get("languages") or [], directors=b.get("directors") or [], cast=b.get("cast") or [])
+
+def _loads(s):
+    try:
+        v = json.loads(s) if s else []
+    except (TypeError, ValueError):
+        return []
+    return v if isinstance(v, list) else []
+
+def from_row(row):
+    """Dimension payload from a film_details row (the *_json columns)."""
+    return dict(film_id=row["id"], genres=_loads(row.get("genres_json")), countries=_loads(row.get("countries_json")),
+                languages=_loads(row.get("languages_json")), directors=_loads(row.get("directors_json")),
+                cast=_loads(row.get("cast_json")))
+
+# ---------- Bulk sync ----------
+
+def _in(ids):
+    return ",".join(["%s"] * len(ids))
+
+def linked_keys(conn, film_ids):
+    """Genre / person ids currently linked to these films (stats keys a newly linked diary row moves)."""
+    ids = sorted(set(film_ids))
+    if not ids:
+        return {"genre_ids": set(), "person_ids": set()}
+    with conn.cursor() as c, metrics.timed_sql("film_dims_keys"):
+        c.execute(f"SELECT DISTINCT genre_id FROM film_genres WHERE film_id IN ({_in(ids)})", ids)
+        genre_ids = {r["genre_id"] for r in c.fetchall()}
+        c.execute(f"SELECT DISTINCT person_id FROM film_people WHERE film_id IN ({_in(ids)})", ids)
+        person_ids = {r["person_id"] for r in c.fetchall()}
+    return {"genre_ids": genre_ids, "person_ids": person_ids}
+
+def sync_films(conn, films):
+    """
+    Rewrite dimension links for a batch of films in one transaction.
+    Returns the keys whose aggregates may have changed (old ∪ new links):
+    {"film_ids", "genre_ids", "person_ids"}.
+    """
+    films = [f for f in films if f.get("film_id")]
+    touched = {"film_ids": set(), "genre_ids": set(), "person_ids": set()}
+    if not films:
+        return touched
+    ids = sorted({f["film_id"] for f in films})
+    touched["film_ids"].update(ids)
+
+    genre_names = {g.strip() for f in films for g in f["genres"] if isinstance(g, str) and g.strip()}
+    country_codes = {c.upper() for f in films for c in f["countries"] if isinstance(c, str) and len(c) == 2}
+    people = {}
+    for f in films:
+        for p in list(f["directors"]) + list(f["cast"]):
+            if isinstance(p, dict) and p.get("id") and p.get("name"):
+                people[int(p["id"])] = p["name"][:255]
+
+    conn.begin()
+    try:
+        with conn.cursor() as c, metrics.timed_sql("film_dims_sync"):
+            c.execute(f"SELECT DISTINCT genre_id FROM film_genres WHERE film_id IN ({_in(ids)})", ids)
+            touched["genre_ids"].update(r["genre_id"] for r in c.fetchall())
+            c.execute(f"SELECT DISTINCT person_id FROM film_people WHERE film_id IN ({_in(ids)})", ids)
+            touched["person_ids"].update(r["person_id"] for r in c.fetchall())
+
+            # dimensions
+            genre_ids = {}
+            if genre_names:
+                names = sorted(genre_names)
+                c.executemany("INSERT IGNORE INTO genres (name) VALUES (%s)", [(n,) for n in names])
+                c.execute(f"SELECT id, name FROM genres WHERE name IN ({_in(names)})", names)
+                genre_ids = {r["name"].casefold(): r["id"] for r in c.fetchall()}
+            if country_codes:
+                c.executemany("INSERT IGNORE INTO countries (code) VALUES (%s)", [(cc,) for cc in sorted(country_codes)])
+            if people:
+                c.executemany("INSERT INTO people (id, name) VALUES (%s, %s) ON DUPLICATE KEY UPDATE name=VALUES(name)",
+                              sorted(people.items()))
+
+            # links: drop and rewrite for the whole batch
+            for table in ("film_genres", "film_countries", "film_languages", "film_people"):
+                c.execute(f"DELETE FROM {table} WHERE film_id IN ({_in(ids)})", ids)
+
+            fg, fc, fl, fp = set(), set(), set(), {}
+            for f in films:
+                fid = f["film_id"]
+                for g in f["genres"]:
+                    gid = genre_ids.get(g.strip().casefold()) if isinstance(g, str) else None
+                    if gid:
+                        fg.add((fid, gid))
+                for cc in f["countries"]:
+                    if isinstance(cc, str) and len(cc) == 2:
+                        fc.add((fid, cc.upper()))
+                for lang in f["languages"]:
+                    if isinstance(lang, str) and lang:
+                        fl.add((fid, lang[:8]))
+                for role, plist in (("DIRECTOR", f["directors"]), ("CAST", f["cast"])):
+                    for order, p in enumerate(plist):
+                        if isinstance(p, dict) and p.get("id") and int(p["id"]) in people:
+                            fp.setdefault((fid, int(p["id"]), role), (order, (p.get("character") or "")[:255] or None))
+
+            if fg:
+                c.executemany("INSERT INTO film_genres (film_id, genre_id) VALUES (%s, %s)", sorted(fg))
+            if fc:
+                c.executemany("INSERT INTO film_countries (film_id, country_code) VALUES (%s, %s)", sorted(fc))
+            if fl:
+                c.executemany("INSERT INTO film_languages (film_id, lang_code) VALUES (%s, %s)", sorted(fl))
+            if fp:
+                c.executemany(
+                    "INSERT INTO film_people (film_id, person_id, role, billing_order, character_name) "
+                    "VALUES (%s, %s, %s, %s, %s)",
+                    [(fid, pid, role, order, ch) for (fid, pid, role), (order, ch) in sorted(fp.items())])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    touched["genre_ids"].update(gid for _, gid in fg)
+    touched["person_ids"].update(pid for (_, pid, _) in fp)
+    metrics.inc("rows_total", len(ids), stage=PROJECT_NAME, table="film_dims")
+    return touched
+
+# ---------- Backfill ----------
+
+SQL_SELECT_DETAILS_PAGE = """
+SELECT id, genres_json, countries_json, languages_json, directors_json, cast_json
+FROM film_details
+WHERE id > %s
+ORDER BY id
+LIMIT %s;
+"""
+
+def main():
+    conn = pymysql.connect(**DB)
+    try:
+        with conn.cursor() as c:
+            ensure_schema(c)
+
+        last_id, total = 0, 0
+        while True:
+            with conn.cursor() as c, metrics.timed_sql("select_details_page"):
+                c.execute(SQL_SELECT_DETAILS_PAGE, (last_id, BATCH_SIZE))
+                rows = c.fetchall()
+            if not rows:
+                break
+            sync_films(conn, [from_row(r) for r in rows])
+            last_id = rows[-1]["id"]
+            total += len(rows)
+            log_to_db(PROJECT_NAME, "INFO", f"Backfilled dimensions for {total} films (last id {last_id})")
+            metrics.maybe_flush(PROJECT_NAME)
+
+        log_to_db(PROJECT_NAME, "INFO", f"✔️ Film dimension backfill complete: {total} films")
+    except Exception as e:
+        log_to_db(PROJECT_NAME, "ERROR", f"❌ Film dimension backfill failed: {e}")
+        raise
+    finally:
+        conn.close()
+        metrics.flush(PROJECT_NAME)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+# gen_export.py — synthetic Letterboxd export ZIP generator (for benchmarks)
+# - Same layout as a real export: watchlist.csv, watched.csv, diary.csv (optionally in a sub-folder)
+# - Streams rows straight into the ZIP, so millions of rows don't need to fit in memory
+# - Unicode titles, duplicate rows and malformed cells at configurable rates
+# - Deterministic for a given --seed
+#
+#   python gen_export.py --out ./exports/bench.zip --diary 1000000 --dup-rate 0.02
+
+import io
+import csv
+import random
+import zipfile
+import argparse
+from datetime import date, timedelta
+
+WATCHLIST_HEADER = ["Date", "Name", "Year", "Letterboxd URI"]
+WATCHED_HEADER   = ["Date", "Name", "Year", "Letterboxd URI"]
+DIARY_HEADER     = ["Date", "Name", "Year", "Letterboxd URI", "Rating", "Rewatch", "Tags", "Watched Date"]
+
+# Mixed-script vocabulary so the utf8mb4 path and title collation get exercised
+WORDS = [
+    "Heat", "Night", "City", "Blue", "Velvet", "Dream", "Paris", "Texas", "Stalker", "Solaris",
+    "Amélie", "Léon", "Mère", "Pokój", "Żywot", "Señor", "Niño", "Fräulein", "Über", "Ça",
+    "千と千尋", "神隠し", "七人の侍", "東京物語", "花様年華", "霸王别姬", "기생충", "올드보이",
+    "Андрей", "Рублёв", "Зеркало", "Сталкер", "Οδύσσεια", "Ταξίδι", "אהבה", "سينما", "भारत",
+    "Hôtel", "Ñandú", "Øyvind", "Åsa", "Škoda", "Dvořák", "Ærø", "Ğüzel", "İstanbul", "🎬",
+]
+ARTICLES = ["", "", "", "The ", "A ", "Le ", "La ", "El ", "Die "]
+TAGS     = ["cinema", "rewatch", "netflix", "mubi", "favourite", "with friends", "40mm", "4k"]
+RATINGS  = ["0.5", "1", "1.5", "2", "2.5", "3", "3.5", "4", "4.5", "5"]
+
+# Cells the loader must tolerate without aborting (to_int/to_float/to_bool → NULL)
+MALFORMED_YEAR   = ["19x5", "unknown", " ", "20O1", "-", "2001.0"]
+MALFORMED_RATING = ["abc", "★★★", "", "5/5", "NaN?"]
+MALFORMED_BOOL   = ["maybe", "Ja", "?"]
+
+class TitleFactory:
+    def __init__(self, rng: random.Random):
+        self.rng = rng
+
+    def title(self):
+        rng = self.rng
+        n = rng.choice((1, 1, 2, 2, 2, 3, 4))
+        t = rng.choice(ARTICLES) + " ".join(rng.choice(WORDS) for _ in range(n))
+        if rng.random() < 0.08:
+            t += f" {rng.randint(2, 5)}"
+        if rng.random() < 0.05:
+            t += ": " + rng.choice(WORDS)
+        if rng.random() < 0.02:
+            t = f"  {t}  "  # stray whitespace, as seen in hand-edited exports
+        return t
+
+    def year(self):
+        return str(self.rng.randint(1920, 2025))
+
+def random_date(rng: random.Random, start=date(2012, 1, 1), days=365 * 13) -> str:
+    return (start + timedelta(days=rng.randrange(days))).isoformat()
+
+def film_cells(rng, titles, malformed_rate):
+    name = titles.title()
+    year = titles.year()
+    uri  = f"https://boxd.it/{rng.getrandbits(32):x}"
+    if rng.random() < malformed_rate:
+        which = rng.randrange(3)
+        if which == 0:
+            year = rng.choice(MALFORMED_YEAR)
+        elif which == 1:
+            name = ""          # skipped by the loader
+        else:
+            uri = ""
+    return name, year, uri
+
+def write_csv(z: zipfile.ZipFile, name: str, header, row_fn, n: int, dup_rate: float, rng: random.Random):
+    """Stream n rows from row_fn() into z/name; a dup_rate share of rows repeats an earlier row."""
+    recent = []
+    with z.open(name, "w") as raw, io.TextIOWrapper(raw, encoding="utf-8", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(header)
+        for _ in range(n):
+            if recent and rng.random() < dup_rate:
+                row = rng.choice(recent)
+            else:
+                row = row_fn()
+                if len(recent) < 1000:
+                    recent.append(row)
+                else:
+                    recent[rng.randrange(1000)] = row
+            w.writerow(row)
+
+def generate(out_path: str, watchlist: int, watched: int, diary: int,
+             dup_rate: float = 0.02, malformed_rate: float = 0.005,
+             seed: int = 42, folder: str = "") -> dict:
+    """Write a synthetic export ZIP and return the row counts written per CSV."""
+    rng    = random.Random(seed)
+    titles = TitleFactory(rng)
+    prefix = f"{folder.strip('/')}/" if folder else ""
+
+    def watchlist_row():
+        name, year, uri = film_cells(rng, titles, malformed_rate)
+        return [random_date(rng), name, year, uri]
+
+    def watched_row():
+        name, year, uri = film_cells(rng, titles, malformed_rate)
+        return [random_date(rng), name, year, uri]
+
+    def diary_row():
+        name, year, uri = film_cells(rng, titles, malformed_rate)
+        watched_on = random_date(rng)
+        rating  = rng.choice(RATINGS) if rng.random() < 0.85 else ""
+        rewatch = "Yes" if rng.random() < 0.12 else ""
+        if rng.random() < malformed_rate:
+            rating  = rng.choice(MALFORMED_RATING)
+            rewatch = rng.choice(MALFORMED_BOOL)
+        tags = ", ".join(rng.sample(TAGS, rng.randint(0, 3)))
+        return [watched_on, name, year, uri, rating, rewatch, tags, watched_on]
+
+    with zipfile.ZipFile(out_path, "w", compression=zipfile.ZIP_DEFLATED) as z:
+        write_csv(z, f"{prefix}watchlist.csv", WATCHLIST_HEADER, watchlist_row, watchlist, dup_rate, rng)
+        write_csv(z, f"{prefix}watched.csv",   WATCHED_HEADER,   watched_row,   watched,   dup_rate, rng)
+        write_csv(z, f"{prefix}diary.csv",     DIARY_HEADER,     diary_row,     diary,     dup_rate, rng)
+
+    return {"watchlist": watchlist, "watched": watched, "diary": diary}
+
+def main():
+    ap = argparse.ArgumentParser(description="Generate a synthetic Letterboxd export ZIP")
+    ap.add_argument("--out", required=True, help="Output .zip path")
+    ap.add_argument("--watchlist", type=int, default=2000, help="watchlist.csv rows")
+    ap.add_argument("--watched", type=int, default=5000, help="watched.csv rows")
+    ap.add_argument("--diary", type=int, default=5000, help="diary.csv rows")
+    ap.add_argument("--dup-rate", type=float, default=0.02, help="Share of rows repeating an earlier row")
+    ap.add_argument("--malformed-rate", type=float, default=0.005, help="Share of rows with a malformed cell")
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--folder", default="", help="Put CSVs in this sub-folder, like real exports")
+    args = ap.parse_args()
+
+    counts = generate(args.out, args.watchlist, args.watched, args.diary,
+                      args.dup_rate, args.malformed_rate, args.seed, args.folder)
+    print(f"Wrote {args.out}: {counts}")
+
+if __name__ == "__main__":
+    main()
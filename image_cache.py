@@ -0,0 +1,352 @@
+# image_cache.py — local poster / backdrop cache for film_details (MariaDB + filesystem)
+# - Downloads each film's poster_url / backdrop_url once, concurrently, into a content-addressed
+#   store under IMAGE_DIR (<sha[:2]>/<sha>.<ext>); identical images are stored once
+# - Writes a small JPEG thumbnail per image (thumbs/<sha[:2]>/<sha>.jpg, longest side IMAGE_THUMB_PX)
+# - Records relative paths, dimensions and the source URL on film_details (<kind>_local_path,
+#   <kind>_thumb_path, <kind>_width, <kind>_height, <kind>_sha256, <kind>_cached_url);
+#   dashboards serve the local file when set and fall back to the TMDb URL otherwise
+# - Re-fetches when TMDb's URL changes (enrich refresh mode): <kind>_url != <kind>_cached_url
+# - image_blobs tracks size + last use; unreferenced blobs are deleted every run and the
+#   least recently used ones are evicted once the store exceeds IMAGE_CACHE_MAX_MB.
+#   Evicted films keep <kind>_cached_url, so they aren't re-downloaded until their URL changes
+
+import os
+import io
+import sys
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pymysql
+import requests
+from pymysql.cursors import DictCursor
+from dotenv import load_dotenv
+from PIL import Image
+
+from logger import log_to_db
+import metrics
+import profiling
+import pipeline_state
+
+PROJECT_NAME = "lbx-images"
+
+load_dotenv()
+
+# ---------- Config ----------
+IMAGE_DIR      = os.getenv("IMAGE_DIR", "./data/images")
+MAX_MB         = float(os.getenv("IMAGE_CACHE_MAX_MB", "2048"))
+LOW_WATER      = float(os.getenv("IMAGE_CACHE_LOW_WATER", "0.9"))   # evict down to this share of MAX_MB
+WORKERS        = int(os.getenv("IMAGE_WORKERS", "8"))
+BATCH_SIZE     = int(os.getenv("IMAGE_BATCH_SIZE", "200"))
+THUMB_PX       = int(os.getenv("IMAGE_THUMB_PX", "240"))
+TIMEOUT_S      = float(os.getenv("IMAGE_TIMEOUT_S", "20"))
+MAX_RETRIES    = int(os.getenv("IMAGE_MAX_RETRIES", "3"))
+RETRY_STATUS   = {429, 500, 502, 503, 504}
+
+KINDS = ("poster", "backdrop")
+
+DB = dict(
+    host=os.getenv("MARIADB_HOST", "localhost"),
+    port=int(os.getenv("MARIADB_PORT", "3306")),
+    user=os.getenv("MARIADB_USER", "root"),
+    password=os.getenv("MARIADB_PASS", ""),
+    database=os.getenv("MARIADB_DB", "letterboxd"),
+    charset="utf8mb4",
+    cursorclass=DictCursor,
+    autocommit=True,
+)
+
+# ---------- SQL ----------
+
+SQL_CREATE_BLOBS = """
+CREATE TABLE IF NOT EXISTS image_blobs (
+  sha256       CHAR(64) PRIMARY KEY,
+  ext          VARCHAR(8) NOT NULL,
+  bytes        INT NOT NULL,
+  thumb_bytes  INT NOT NULL,
+  width        INT NOT NULL,
+  height       INT NOT NULL,
+  created_at   DATETIME NOT NULL,
+  last_used_at DATETIME NOT NULL,
+  KEY ix_image_blobs_last_used (last_used_at)
+) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci;
+"""
+
+# per kind; added to film_details if missing
+DETAIL_COLUMNS = [
+    ("sha256",      "CHAR(64) NULL"),
+    ("cached_url",  "VARCHAR(255) NULL"),
+    ("local_path",  "VARCHAR(255) NULL"),
+    ("thumb_path",  "VARCHAR(255) NULL"),
+    ("width",       "INT NULL"),
+    ("height",      "INT NULL"),
+]
+
+SQL_SELECT_TARGETS = """
+SELECT id, poster_url, backdrop_url, poster_cached_url, backdrop_cached_url
+FROM film_details
+WHERE id > %s
+  AND (NOT (poster_url <=> poster_cached_url) OR NOT (backdrop_url <=> backdrop_cached_url))
+ORDER BY id
+LIMIT %s;
+"""
+
+SQL_UPSERT_BLOB = """
+INSERT INTO image_blobs (sha256, ext, bytes, thumb_bytes, width, height, created_at, last_used_at)
+VALUES (%s, %s, %s, %s, %s, %s, NOW(), NOW())
+ON DUPLICATE KEY UPDATE last_used_at = NOW();
+"""
+
+def sql_set_image(kind):
+    return (f"UPDATE film_details SET {kind}_sha256=%s, {kind}_cached_url=%s, {kind}_local_path=%s, "
+            f"{kind}_thumb_path=%s, {kind}_width=%s, {kind}_height=%s WHERE id=%s")
+
+SQL_STORE_BYTES = "SELECT COALESCE(SUM(bytes + thumb_bytes), 0) AS total FROM image_blobs"
+
+SQL_ORPHANS = """
+SELECT b.sha256, b.ext, b.bytes + b.thumb_bytes AS size
+FROM image_blobs b
+WHERE NOT EXISTS (SELECT 1 FROM film_details f WHERE f.poster_sha256 = b.sha256)
+  AND NOT EXISTS (SELECT 1 FROM film_details f WHERE f.backdrop_sha256 = b.sha256);
+"""
+
+SQL_LRU = """
+SELECT sha256, ext, bytes + thumb_bytes AS size
+FROM image_blobs
+ORDER BY last_used_at, sha256
+LIMIT %s;
+"""
+
+def ensure_schema(cur):
+    cur.execute(SQL_CREATE_BLOBS)
+    cur.execute("SHOW COLUMNS FROM film_details")
+    have = {r["Field"] for r in cur.fetchall()}
+    adds = [f"ADD COLUMN {kind}_{col} {ddl}" for kind in KINDS for col, ddl in DETAIL_COLUMNS
+            if f"{kind}_{col}" not in have]
+    for kind in KINDS:
+        cur.execute("SHOW INDEX FROM film_details WHERE Key_name=%s", (f"ix_{kind}_sha256",))
+        if cur.fetchone() is None:
+            adds.append(f"ADD KEY ix_{kind}_sha256 ({kind}_sha256)")
+    if adds:
+        cur.execute("ALTER TABLE film_details " + ", ".join(adds))
+
+# ---------- Store ----------
+
+def blob_path(sha, ext):
+    return os.path.join(sha[:2], f"{sha}.{ext}")
+
+def thumb_path(sha):
+    return os.path.join("thumbs", sha[:2], f"{sha}.jpg")
+
+def _write_atomic(rel, data):
+    path = os.path.join(IMAGE_DIR, rel)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+def _remove(rel):
+    try:
+        os.remove(os.path.join(IMAGE_DIR, rel))
+    except FileNotFoundError:
+        pass
+
+# ---------- Download + thumbnail (worker threads) ----------
+
+_local = threading.local()
+
+def _session():
+    s = getattr(_local, "session", None)
+    if s is None:
+        s = _local.session = requests.Session()
+    return s
+
+def download(url, kind):
+    for attempt in range(MAX_RETRIES + 1):
+        last_try = attempt == MAX_RETRIES
+        try:
+            with metrics.timed_api("tmdb_image", kind) as call:
+                r = _session().get(url, timeout=TIMEOUT_S)
+                call.status(r.status_code)
+        except (requests.Timeout, requests.ConnectionError):
+            if last_try:
+                raise
+            metrics.inc("api_retries_total", api="tmdb_image", reason="timeout")
+            time.sleep(min(30, 2 ** attempt))
+            continue
+        if r.status_code in RETRY_STATUS and not last_try:
+            metrics.inc("api_retries_total", api="tmdb_image", reason=str(r.status_code))
+            ra = r.headers.get("Retry-After")
+            time.sleep(min(30, float(ra)) if ra and ra.isdigit() else min(30, 2 ** attempt))
+            continue
+        r.raise_for_status()
+        return r.content
+
+@profiling.hot
+def cache_image(url, kind):
+    """Fetch one URL into the store (skipping files already there) and thumbnail it.
+    Returns the image_blobs / film_details values; raises on download or decode errors."""
+    data = download(url, kind)
+    sha = hashlib.sha256(data).hexdigest()
+    with Image.open(io.BytesIO(data)) as im:
+        width, height = im.size
+        ext = {"JPEG": "jpg", "PNG": "png", "WEBP": "webp"}.get(im.format, "img")
+        rel, trel = blob_path(sha, ext), thumb_path(sha)
+        if not os.path.exists(os.path.join(IMAGE_DIR, rel)):
+            _write_atomic(rel, data)
+            metrics.inc("rows_total", stage=PROJECT_NAME, table="image_files")
+        else:
+            metrics.inc("cache_hits_total", cache="image_store")
+        if not os.path.exists(os.path.join(IMAGE_DIR, trel)):
+            im.thumbnail((THUMB_PX, THUMB_PX))
+            buf = io.BytesIO()
+            im.convert("RGB").save(buf, "JPEG", quality=80, optimize=True)
+            _write_atomic(trel, buf.getvalue())
+    thumb_bytes = os.path.getsize(os.path.join(IMAGE_DIR, trel))
+    return dict(sha=sha, ext=ext, bytes=len(data), thumb_bytes=thumb_bytes, width=width, height=height,
+                local_path=rel, thumb_path=trel)
+
+# ---------- Batches (main thread owns the DB connection) ----------
+
+def process_batch(conn, pool, rows):
+    jobs = []   # (film_id, kind, url, future or None to clear)
+    for r in rows:
+        for kind in KINDS:
+            url = r[f"{kind}_url"]
+            if url == r[f"{kind}_cached_url"]:
+                continue
+            jobs.append((r["id"], kind, url, pool.submit(cache_image, url, kind) if url else None))
+
+    blobs, updates, failed = {}, {kind: [] for kind in KINDS}, 0
+    for film_id, kind, url, fut in jobs:
+        if fut is None:
+            # TMDb dropped the image: forget the cached copy (blob is swept if now unreferenced)
+            updates[kind].append((None, None, None, None, None, None, film_id))
+            continue
+        try:
+            img = fut.result()
+        except Exception as e:
+            failed += 1
+            log_to_db(PROJECT_NAME, "WARNING", f"Image fetch failed for film {film_id} {kind} {url}: {e}")
+            continue
+        blobs[img["sha"]] = (img["sha"], img["ext"], img["bytes"], img["thumb_bytes"], img["width"], img["height"])
+        updates[kind].append((img["sha"], url, img["local_path"], img["thumb_path"],
+                              img["width"], img["height"], film_id))
+
+    conn.begin()
+    try:
+        with conn.cursor() as c, metrics.timed_sql("image_batch_write"):
+            if blobs:
+                c.executemany(SQL_UPSERT_BLOB, list(blobs.values()))
+            for kind, params in updates.items():
+                if params:
+                    c.executemany(sql_set_image(kind), params)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    done = sum(len(p) for p in updates.values())
+    metrics.inc("rows_total", done, stage=PROJECT_NAME, table="film_details")
+    return done, failed
+
+# ---------- Eviction ----------
+
+def _drop_blobs(conn, blobs):
+    """Remove blobs from disk + image_blobs and detach any film still pointing at them."""
+    if not blobs:
+        return
+    shas = [b["sha256"] for b in blobs]
+    marks = ",".join(["%s"] * len(shas))
+    conn.begin()
+    try:
+        with conn.cursor() as c, metrics.timed_sql("image_evict"):
+            for kind in KINDS:
+                # keep <kind>_cached_url so the film isn't fetched again until TMDb's URL changes
+                c.execute(f"UPDATE film_details SET {kind}_sha256=NULL, {kind}_local_path=NULL, "
+                          f"{kind}_thumb_path=NULL, {kind}_width=NULL, {kind}_height=NULL "
+                          f"WHERE {kind}_sha256 IN ({marks})", shas)
+            c.execute(f"DELETE FROM image_blobs WHERE sha256 IN ({marks})", shas)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    for b in blobs:
+        _remove(blob_path(b["sha256"], b["ext"]))
+        _remove(thumb_path(b["sha256"]))
+
+def evict(conn):
+    """Delete unreferenced blobs, then LRU blobs until the store is under the low-water mark."""
+    with conn.cursor() as c:
+        c.execute(SQL_ORPHANS)
+        orphans = c.fetchall()
+    _drop_blobs(conn, orphans)
+
+    limit = MAX_MB * 1024 * 1024
+    with conn.cursor() as c:
+        c.execute(SQL_STORE_BYTES)
+        total = int(c.fetchone()["total"])
+    evicted = 0
+    if total > limit:
+        target = limit * LOW_WATER
+        while total > target:
+            with conn.cursor() as c:
+                c.execute(SQL_LRU, (BATCH_SIZE,))
+                lru = c.fetchall()
+            if not lru:
+                break
+            victims = []
+            for b in lru:
+                if total <= target:
+                    break
+                victims.append(b)
+                total -= int(b["size"])
+            _drop_blobs(conn, victims)
+            evicted += len(victims)
+    metrics.set_gauge("image_store_bytes", total)
+    return len(orphans), evicted, total
+
+# ---------- Main ----------
+
+def main():
+    conn = pymysql.connect(**DB)
+    try:
+        with conn.cursor() as c:
+            c.execute("SHOW TABLES LIKE 'film_details'")
+            if c.fetchone() is None:
+                log_to_db(PROJECT_NAME, "WARNING", "film_details doesn't exist yet; run enrich_details.py first")
+                return
+            ensure_schema(c)
+            pipeline_state.ensure_schema(c)
+
+        os.makedirs(IMAGE_DIR, exist_ok=True)
+        last_id, done, failed = 0, 0, 0
+        with ThreadPoolExecutor(max_workers=WORKERS) as pool:
+            while True:
+                with conn.cursor() as c, metrics.timed_sql("select_image_targets"):
+                    c.execute(SQL_SELECT_TARGETS, (last_id, BATCH_SIZE))
+                    rows = c.fetchall()
+                if not rows:
+                    break
+                n, f = process_batch(conn, pool, rows)
+                done, failed, last_id = done + n, failed + f, rows[-1]["id"]
+                log_to_db(PROJECT_NAME, "INFO", f"Cached {done} images so far ({failed} failed)")
+                metrics.maybe_flush(PROJECT_NAME)
+
+        orphans, evicted, total = evict(conn)
+        with conn.cursor() as c:
+            pipeline_state.mark_run_complete(c, PROJECT_NAME)
+        log_to_db(PROJECT_NAME, "INFO",
+                  f"✔️ Image cache: {done} images updated, {failed} failed, {orphans} orphans removed, "
+                  f"{evicted} evicted, store {total / 1024 / 1024:.1f} MB")
+    except Exception as e:
+        log_to_db(PROJECT_NAME, "ERROR", f"❌ Image cache failed: {e}")
+        sys.exit(1)
+    finally:
+        conn.close()
+        metrics.flush(PROJECT_NAME)
+
+if __name__ == "__main__":
+    with profiling.run(PROJECT_NAME):
+        main()
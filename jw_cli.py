@@ -1,10 +1,112 @@
 # pip install simple-justwatch-python-api httpx
+# Single lookup:  python jw_cli.py "Heat" --year 1995
+# Batch lookup:   python jw_cli.py --batch titles.txt --workers 8 > results.jsonl
+#   one title per line, optionally "Title<TAB>Year" or "Title (Year)"; blank / # lines skipped.
+#   Matches are picked with jw_update.pick_best_match (same scoring as the pipeline) and one
+#   JSON object per title is written to stdout as soon as it's done (input order not kept;
+#   "line" says which input it was).
+import re
+import sys
+import json
 import argparse
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from simplejustwatchapi.justwatch import search, offers_for_countries
 
+TITLE_YEAR = re.compile(r"^(.*?)\s*\((\d{4})\)\s*$")
+
+def parse_line(line):
+    """'Heat\t1995' / 'Heat (1995)' / 'Heat' → (title, year or None); None for blank / comments."""
+    line = line.strip()
+    if not line or line.startswith("#"):
+        return None
+    if "\t" in line:
+        title, _, year = line.partition("\t")
+        year = year.strip()
+        return title.strip(), int(year) if year.isdigit() else None
+    m = TITLE_YEAR.match(line)
+    if m:
+        return m.group(1), int(m.group(2))
+    return line, None
+
+def offer_dict(o):
+    return {
+        "monetization_type": o.monetization_type,
+        "presentation_type": o.presentation_type,
+        "price": o.price_string,
+        "provider_id": o.package.package_id if o.package else None,
+        "provider_name": o.package.name if o.package else None,
+        "url": o.url,
+    }
+
+def filter_offers(offers, args):
+    if args.type:
+        offers = [o for o in offers if o.monetization_type == args.type]
+    if args.provider_id:
+        offers = [o for o in offers if (o.package and o.package.package_id in set(args.provider_id))]
+    return offers
+
+def lookup(jw_update, line_no, title, year, args):
+    """One batch row: search → pick_best_match → offers; errors are reported, not raised."""
+    out = {"line": line_no, "title": title, "year": year, "match": None, "offers": []}
+    try:
+        results = jw_update.jw_call("search", jw_update.search, title, args.country, args.lang, args.count, args.best_only)
+        best, via, confidence, matched_type = jw_update.pick_best_match(results, title, year)
+        if not best:
+            return out
+        out["match"] = {
+            "entry_id": best.entry_id, "title": best.title, "year": getattr(best, "release_year", None),
+            "type": matched_type, "via": via, "confidence": confidence,
+        }
+        by_country = jw_update.jw_call("offers_for_countries", jw_update.offers_for_countries,
+                                       best.entry_id, {args.country}, args.lang, args.best_only)
+        offers = (by_country or {}).get(args.country, []) or []
+        out["offers"] = [offer_dict(o) for o in filter_offers(offers, args)]
+    except Exception as e:
+        out["error"] = f"{type(e).__name__}: {e}"
+    return out
+
+def run_batch(args):
+    # imported here so single lookups keep working without the pipeline modules installed
+    import jw_update
+
+    client = jw_update.use_shared_client(max_connections=args.workers)
+    src = sys.stdin if args.batch == "-" else open(args.batch, encoding="utf-8")
+    done = failed = 0
+    try:
+        with ThreadPoolExecutor(max_workers=args.workers) as pool:
+            pending = set()
+            for line_no, line in enumerate(src, 1):
+                parsed = parse_line(line)
+                if not parsed:
+                    continue
+                pending.add(pool.submit(lookup, jw_update, line_no, parsed[0], parsed[1], args))
+                # bounded in-flight work: don't read the whole file into the queue
+                if len(pending) >= args.workers * 2:
+                    finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for f in finished:
+                        failed += emit(f.result())
+                        done += 1
+            for f in pending:
+                failed += emit(f.result())
+                done += 1
+    finally:
+        if src is not sys.stdin:
+            src.close()
+        client.close()
+    print(f"{done} titles, {failed} errors", file=sys.stderr)
+    if failed:
+        raise SystemExit(1)
+
+def emit(row):
+    sys.stdout.write(json.dumps(row, ensure_ascii=False) + "\n")
+    sys.stdout.flush()
+    return 1 if "error" in row else 0
+
 def main():
     ap = argparse.ArgumentParser(description="Manual JustWatch (unofficial) tester")
-    ap.add_argument("title", help="Title to search")
+    ap.add_argument("title", nargs="?", help="Title to search")
+    ap.add_argument("--batch", metavar="FILE", help="Look up every title in FILE ('-' = stdin), JSON Lines to stdout")
+    ap.add_argument("--workers", type=int, default=8, help="Concurrent lookups in --batch mode (default 8)")
     ap.add_argument("--year", type=int, help="Prefer a match with this release year")
     ap.add_argument("--country", default="GB", help="Country code (default GB)")
     ap.add_argument("--lang", default="en", help="Language code (default en)")
@@ -14,6 +116,12 @@ def main():
     ap.add_argument("--provider-id", type=int, action="append", help="Only show these provider IDs (can repeat)")
     args = ap.parse_args()
 
+    if args.batch:
+        run_batch(args)
+        return
+    if not args.title:
+        ap.error("title is required unless --batch is given")
+
     results = search(args.title, args.country, args.lang, args.count, args.best_only)
 
     if not results:
@@ -33,10 +141,7 @@ def main():
     offers_by_country = offers_for_countries(match.entry_id, {args.country}, args.lang, args.best_only)
     offers = (offers_by_country or {}).get(args.country, []) or []
 
-    if args.type:
-        offers = [o for o in offers if o.monetization_type == args.type]
-    if args.provider_id:
-        offers = [o for o in offers if (o.package and o.package.package_id in set(args.provider_id))]
+    offers = filter_offers(offers, args)
 
     if not offers:
         print("No offers (after filters).")
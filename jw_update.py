@@ -7,11 +7,21 @@
 import os
 import time
 from dotenv import load_dotenv
+import httpx
 import pymysql
 from pymysql.cursors import DictCursor
 
 from logger import log_to_db
-from simplejustwatchapi.justwatch import search, offers_for_countries
+import metrics
+import profiling
+import pipeline_state
+import title_match
+import api_budget
+from simplejustwatchapi.query import (
+    prepare_search_request, parse_search_response,
+    prepare_offers_for_countries_request, parse_offers_for_countries_response,
+)
+from simplejustwatchapi.exceptions import JustWatchHttpError
 
 PROJECT_NAME = "lbx-justwatch"
 
@@ -22,15 +32,22 @@ COUNTRY       = os.getenv("JW_COUNTRY", "GB")
 LANG          = os.getenv("JW_LANGUAGE", "en")
 SLEEP_S       = float(os.getenv("JW_SLEEP_S", "0.8"))
 BATCH_SIZE    = int(os.getenv("JW_BATCH_SIZE", "500"))
+MAX_RETRIES   = int(os.getenv("JW_MAX_RETRIES", "2"))    # 429 / 5xx / transport errors; honours Retry-After
+BACKOFF_S     = float(os.getenv("JW_BACKOFF_S", "1.0"))
 STALE_DAYS    = int(os.getenv("JW_STALE_DAYS", "7"))
 BEST_ONLY     = True
 
 # Which source to map this run
 JW_SOURCE       = os.getenv("JW_SOURCE", "WATCHLIST").upper()           # WATCHLIST | DIARY
-JW_SOURCE_TABLE = os.getenv("JW_SOURCE_TABLE") or ("watchlist" if JW_SOURCE == "WATCHLIST" else "diary")
+SOURCE_TABLES   = {"WATCHLIST": "watchlist", "DIARY": "diary"}
+JW_SOURCE_TABLE = os.getenv("JW_SOURCE_TABLE") or SOURCE_TABLES.get(JW_SOURCE, "diary")
 JW_ID_COL       = os.getenv("JW_ID_COL", "id")
 JW_TITLE_COL    = os.getenv("JW_TITLE_COL", "film_name")
 JW_YEAR_COL     = os.getenv("JW_YEAR_COL", "film_year")
+JW_NORM_COL     = os.getenv("JW_NORM_COL", "film_name_norm")   # title_match.normalize(title); "" = table has none
+
+# Point JustWatch calls at api_sim.py (or another stand-in) instead of the live GraphQL API
+JW_API_URL = os.getenv("JW_API_URL") or "https://apis.justwatch.com/graphql"
 
 # Offers are tracked only for WATCHLIST history table per your schema
 UPDATE_OFFERS = os.getenv("JW_UPDATE_OFFERS", "true").lower() in ("1", "true", "yes")
@@ -61,66 +78,121 @@ def g(obj, *names):
                 return v
     return None
 
-def pick_best_match(results, title, year):
-    """Heuristic to pick best JustWatch result; returns (obj, via, confidence, matched_type)."""
-    def norm(s): return (s or "").strip().lower()
-    tnorm = norm(title)
+def jw_call(endpoint, fn, *args, **kwargs):
+    """Call the JustWatch client with latency metrics; 429 / 5xx / transport errors are retried
+    with backoff (Retry-After when sent), other HTTP errors (400, 422, ...) are raised at once."""
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            with metrics.timed_api("justwatch", endpoint) as call:
+                try:
+                    return fn(*args, **kwargs)
+                except JwHttpError as e:
+                    if e.status:
+                        call.status(e.status)
+                    raise
+        except JustWatchHttpError as e:
+            status = getattr(e, "status", None)
+            if attempt == MAX_RETRIES or (status and status != 429 and status < 500):
+                raise
+            reason = "throttled" if status == 429 else str(status) if status else "transport"
+            metrics.inc("api_retries_total", api="justwatch", reason=reason)
+            time.sleep(api_budget.retry_delay(getattr(e, "http_response", None), attempt, BACKOFF_S))
+
+# ---------- JustWatch client ----------
+# search / offers_for_countries mirror the library's functions of the same name, built from its
+# public simplejustwatchapi.query request/parse pairs, but POST through jw_update's own transport
+# so the pooled client and JW_API_URL don't have to be patched into the library.
+
+_client = None   # pooled httpx.Client set by use_shared_client(); None = one-off request per call
+
+class JwHttpError(JustWatchHttpError):
+    """JustWatchHttpError that keeps the HTTP response (None for transport errors) for jw_call."""
+    def __init__(self, msg, http_response=None):
+        super().__init__(msg, http_response.text if http_response is not None else None)
+        self.http_response = http_response
+        self.status = http_response.status_code if http_response is not None else None
+
+def _post(request_json):
+    """POST one GraphQL request; HTTP failures raise JwHttpError (a JustWatchHttpError, like the library)."""
+    try:
+        r = (_client.post if _client else httpx.post)(JW_API_URL, json=request_json)
+        r.raise_for_status()
+        return r.json()
+    except httpx.HTTPStatusError as e:
+        raise JwHttpError(str(e), e.response) from e
+    except httpx.HTTPError as e:
+        raise JwHttpError(str(e)) from e
+
+def search(title, country="US", language="en", count=4, best_only=True):
+    request = prepare_search_request(title=title, country=country, language=language, count=count,
+                                     best_only=best_only, offset=0, providers=None, min_release_year=None,
+                                     max_release_year=None, object_types=None)
+    return parse_search_response(_post(request))
+
+def offers_for_countries(node_id, countries, language="en", best_only=True):
+    if not countries:
+        return {}
+    request = prepare_offers_for_countries_request(node_id=node_id, countries=countries, language=language,
+                                                   best_only=best_only)
+    return parse_offers_for_countries_response(_post(request), countries)
+
+def use_shared_client(max_connections=10):
+    """Send every jw_update JustWatch call through one pooled, keep-alive HTTP client instead of a
+    fresh connection per request. Returns the client; the caller closes it when done."""
+    global _client
+    _client = httpx.Client(limits=httpx.Limits(max_connections=max_connections,
+                                               max_keepalive_connections=max_connections))
+    return _client
+
+def result_year(r):
+    y = g(r, "year", "release_year", "original_release_year")
+    if not y:
+        od = g(r, "original_release_date")
+        y = (od or "")[:4] if od else None
+    try:
+        return int(y) if y else None
+    except Exception:
+        return None
+
+@profiling.hot
+def pick_best_match(results, title, year, title_norm=None):
+    """Fuzzy-scores every JustWatch result (title_match.best_match); returns (obj, via, confidence, matched_type).
+    title_norm: the stored normalize(title), when the caller already has it."""
+    results = list(results or [])
     try:
         y = int(year) if year else None
     except Exception:
         y = None
 
-    scored = []
-    for r in results or []:
-        r_title = g(r, "title", "original_title", "name") or ""
-        r_year  = g(r, "year", "original_release_year")
-        if not r_year:
-            od = g(r, "original_release_date")
-            r_year = (od or "")[:4] if od else None
-        try:
-            r_year = int(r_year) if r_year else None
-        except Exception:
-            r_year = None
-
-        score = 0
-        via   = "name_only"
-        if norm(r_title) == tnorm:
-            score += 10
-            if y and r_year == y:
-                score += 10
-                via = "name_year"
-        elif tnorm and tnorm in norm(r_title):
-            score += 3
-            if y and r_year and abs(r_year - y) <= 1:
-                score += 2
-                via = "name_year"
-
-        scored.append((score, via, r_year, r_title, r))
-
-    if not scored:
+    candidates = [((g(r, "title", "name"), g(r, "original_title")), result_year(r)) for r in results]
+    idx, sim, year_ok = title_match.best_match(title, y, candidates, query_norm=title_norm or None)
+    if idx is None:
         return None, None, None, None
 
-    scored.sort(key=lambda x: x[0], reverse=True)
-    score, via, r_year, r_title, r = scored[0]
+    r = results[idx]
     obj_type = (g(r, "object_type", "type") or "").upper()
     matched_type = "MOVIE" if obj_type.startswith("MOVIE") else "SHOW"
-    confidence = max(0, min(100, score * 5))
+    via = "name_year" if year_ok else "name_only"
+    confidence = round(sim * (100 if year_ok else 50))
     return r, via, confidence, matched_type
 
 def fetch_offers(entry_id: str):
-    """Normalize offers for COUNTRY; returns list of dicts with provider_id/name/presentation_type/url."""
+    """Normalize offers for COUNTRY; returns list of dicts with provider_id/name/presentation_type/monetization_type/url,
+    or None when the call failed (so the stored offers are left alone)."""
     try:
-        raw = offers_for_countries(entry_id, countries=[COUNTRY])
+        raw = jw_call("offers_for_countries", offers_for_countries, entry_id, countries=[COUNTRY])
     except Exception as e:
         log_to_db(PROJECT_NAME, "WARNING", f"offers_for_countries failed for {entry_id}: {e}")
-        return []
+        return None
 
     offers = raw.get(COUNTRY, []) if isinstance(raw, dict) else (raw or [])
     out = []
     for off in offers:
-        provider_id       = g(off, "provider_id", "providerId")
-        provider_name     = g(off, "provider_name", "providerName")
+        package           = g(off, "package")
+        provider_id       = g(off, "provider_id", "providerId") or g(package, "package_id", "packageId")
+        provider_name     = g(off, "provider_name", "providerName") or g(package, "name", "clearName")
         presentation_type = g(off, "presentation_type", "presentationType")
+        monetization_type = g(off, "monetization_type", "monetizationType")
         urls              = g(off, "urls")
         url = None
         if isinstance(urls, dict):
@@ -133,17 +205,91 @@ def fetch_offers(entry_id: str):
             "provider_id": provider_id,
             "provider_name": provider_name,
             "presentation_type": presentation_type,
+            "monetization_type": monetization_type,
             "url": url
         })
     return out
 
 # ---------- SQL ----------
 
-SQL_SELECT_CANDIDATES = f"""
+SQL_CREATE_TITLE_MAP = """
+CREATE TABLE IF NOT EXISTS jw_title_map (
+  source          VARCHAR(16) NOT NULL,
+  source_row_id   INT NOT NULL,
+  entry_id        VARCHAR(32),
+  matched_via     VARCHAR(16),
+  confidence      INT,
+  matched_title   VARCHAR(255),
+  matched_year    INT NULL,
+  matched_type    VARCHAR(8),
+  last_checked_at DATETIME,
+  film_id         INT NULL,
+  matched_title_norm VARCHAR(255) NULL,
+  PRIMARY KEY (source, source_row_id),
+  KEY ix_film_id (film_id)
+) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci;
+"""
+
+SQL_CREATE_OFFERS_HISTORY = """
+CREATE TABLE IF NOT EXISTS jw_offers_history (
+  id                INT AUTO_INCREMENT PRIMARY KEY,
+  watchlist_id      INT NOT NULL,
+  entry_id          VARCHAR(32),
+  provider_id       INT NOT NULL,
+  provider_name     VARCHAR(255),
+  presentation_type VARCHAR(16),
+  monetization_type VARCHAR(16),
+  url               TEXT,
+  valid_from        DATETIME NOT NULL,
+  valid_to          DATETIME NULL,
+  KEY ix_offer_lookup (watchlist_id, provider_id, valid_from)
+) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci;
+"""
+
+# jw_offers_current — the open rows of jw_offers_history, kept in step with it (same
+# transaction) so "what's streaming now" is an index read instead of a history scan
+SQL_CREATE_OFFERS_CURRENT = """
+CREATE TABLE IF NOT EXISTS jw_offers_current (
+  watchlist_id      INT NOT NULL,
+  provider_id       INT NOT NULL,
+  presentation_type VARCHAR(16) NOT NULL DEFAULT '',
+  monetization_type VARCHAR(16) NOT NULL DEFAULT '',
+  entry_id          VARCHAR(32),
+  provider_name     VARCHAR(255),
+  url               TEXT,
+  valid_from        DATETIME NOT NULL,
+  PRIMARY KEY (watchlist_id, provider_id, presentation_type, monetization_type),
+  KEY ix_offers_current_provider (provider_id, monetization_type, watchlist_id),
+  KEY ix_offers_current_monetization (monetization_type, watchlist_id)
+) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci;
+"""
+
+# jw_offers_history doesn't record monetization_type, so jw_offers_current isn't seeded from it:
+# watchlist titles with open offers are marked due instead and the next run fetches them again
+SQL_RECHECK_OPEN_OFFERS = """
+UPDATE jw_title_map m
+JOIN (SELECT DISTINCT watchlist_id FROM jw_offers_history WHERE valid_to IS NULL) h
+  ON h.watchlist_id = m.source_row_id
+SET m.last_checked_at = '1970-01-01'
+WHERE m.source = 'WATCHLIST';
+"""
+# same for rows seeded from history before monetization_type was part of the key
+SQL_RECHECK_UNTYPED_OFFERS = """
+UPDATE jw_title_map m
+JOIN (SELECT DISTINCT watchlist_id FROM jw_offers_current WHERE monetization_type IS NULL) c
+  ON c.watchlist_id = m.source_row_id
+SET m.last_checked_at = '1970-01-01'
+WHERE m.source = 'WATCHLIST';
+"""
+
+_NORM_SELECT = f"s.`{JW_NORM_COL}`" if JW_NORM_COL else "NULL"
+
+SQL_SELECT_CANDIDATES_FOR = f"""
 SELECT s.`{JW_ID_COL}`    AS source_row_id,
        s.`{JW_TITLE_COL}` AS title,
-       s.`{JW_YEAR_COL}`  AS year
-FROM `{JW_SOURCE_TABLE}` s
+       s.`{JW_YEAR_COL}`  AS year,
+       {_NORM_SELECT} AS title_norm
+FROM `{{table}}` s
 LEFT JOIN jw_title_map m
   ON m.source = %s
  AND m.source_row_id = s.`{JW_ID_COL}`
@@ -152,11 +298,36 @@ WHERE m.source_row_id IS NULL
 ORDER BY s.`{JW_ID_COL}`
 LIMIT {BATCH_SIZE};
 """
+SQL_SELECT_CANDIDATES = SQL_SELECT_CANDIDATES_FOR.format(table=JW_SOURCE_TABLE)
+
+# Another row of the same source with the same normalized title + year (diary rewatches, a
+# re-added watchlist title) that was mapped recently: copy its match instead of searching again.
+# Uses the (film_name_norm, film_year) index the loader maintains.
+SQL_REUSE_MAP_FOR = f"""
+SELECT m.entry_id, m.matched_via, m.confidence, m.matched_title, m.matched_year, m.matched_type,
+       m.matched_title_norm
+FROM `{{table}}` s
+JOIN jw_title_map m
+  ON m.source = %s
+ AND m.source_row_id = s.`{JW_ID_COL}`
+WHERE s.`{JW_NORM_COL}` = %s AND s.`{JW_YEAR_COL}` <=> %s AND s.`{JW_ID_COL}` <> %s
+  AND m.entry_id IS NOT NULL
+  AND m.last_checked_at >= (NOW() - INTERVAL {STALE_DAYS} DAY)
+LIMIT 1;
+"""
+
+# pipeline.py hands over changed rows directly; this skips the ones whose mapping is still fresh
+SQL_MAP_IS_FRESH = f"""
+SELECT 1 FROM jw_title_map
+WHERE source = %s AND source_row_id = %s
+  AND last_checked_at >= (NOW() - INTERVAL {STALE_DAYS} DAY);
+"""
 
 SQL_UPSERT_MAP = """
 INSERT INTO jw_title_map
-(source, source_row_id, entry_id, matched_via, confidence, matched_title, matched_year, matched_type, last_checked_at)
-VALUES (%s,%s,%s,%s,%s,%s,%s,%s,NOW())
+(source, source_row_id, entry_id, matched_via, confidence, matched_title, matched_year, matched_type,
+ matched_title_norm, last_checked_at)
+VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,NOW())
 ON DUPLICATE KEY UPDATE
   entry_id        = VALUES(entry_id),
   matched_via     = VALUES(matched_via),
@@ -164,56 +335,104 @@ ON DUPLICATE KEY UPDATE
   matched_title   = VALUES(matched_title),
   matched_year    = VALUES(matched_year),
   matched_type    = VALUES(matched_type),
+  matched_title_norm = VALUES(matched_title_norm),
   last_checked_at = VALUES(last_checked_at);
 """
 
-# jw_offers_history (WATCHLIST only)
-SQL_SELECT_LAST_OFFER = """
-SELECT provider_id, provider_name, presentation_type, url, valid_from, valid_to
+# jw_offers_history (WATCHLIST only); an offer is (provider, presentation, monetization)
+SQL_SELECT_OPEN_OFFERS = """
+SELECT id, provider_id, provider_name, presentation_type, monetization_type, url
 FROM jw_offers_history
-WHERE watchlist_id = %s AND provider_id = %s
-ORDER BY valid_from DESC
-LIMIT 1;
+WHERE watchlist_id = %s AND valid_to IS NULL;
 """
-SQL_CLOSE_OFFER = """
+SQL_CLOSE_OFFERS = """
 UPDATE jw_offers_history
 SET valid_to = NOW()
-WHERE watchlist_id = %s AND provider_id = %s AND valid_to IS NULL;
+WHERE id IN ({ids});
 """
 SQL_INSERT_OFFER = """
 INSERT INTO jw_offers_history
-(watchlist_id, entry_id, provider_id, provider_name, presentation_type, url, valid_from, valid_to)
-VALUES (%s, %s, %s, %s, %s, %s, NOW(), NULL);
+(watchlist_id, entry_id, provider_id, provider_name, presentation_type, monetization_type, url, valid_from, valid_to)
+VALUES (%s, %s, %s, %s, %s, %s, %s, NOW(), NULL);
 """
 
-# ---------- Core ----------
+SQL_DELETE_CURRENT = """
+DELETE FROM jw_offers_current
+WHERE watchlist_id = %s;
+"""
+SQL_INSERT_CURRENT = """
+INSERT INTO jw_offers_current
+(watchlist_id, provider_id, presentation_type, monetization_type, entry_id, provider_name, url, valid_from)
+VALUES (%s, %s, %s, %s, %s, %s, %s, NOW());
+"""
 
-def upsert_offer_history_watchlist(conn, watchlist_id, entry_id, provider_id, provider_name, presentation_type, url):
-    with conn.cursor() as c:
-        c.execute(SQL_SELECT_LAST_OFFER, (watchlist_id, provider_id))
-        last = c.fetchone()
+# ---------- Core ----------
 
-        def changed(a, b): return (a or "") != (b or "")
+def offer_key(off):
+    return (off.get("provider_id"), off.get("presentation_type") or "", off.get("monetization_type") or "")
 
-        if not last:
-            c.execute(SQL_INSERT_OFFER, (
-                watchlist_id, entry_id, provider_id,
-                provider_name or str(provider_id or ""),
-                presentation_type, url
-            ))
-            return
+@profiling.hot
+def sync_offers_watchlist(conn, watchlist_id, entry_id, offers_list):
+    """Make jw_offers_history / jw_offers_current match the offers JustWatch returned for one title:
+    open history rows whose offer is gone or changed (url, provider name) are closed, new offers get
+    a history row, and the title's current rows are rebuilt. Runs inside the caller's transaction."""
+    offers = {}
+    for off in offers_list:
+        if off.get("provider_id") is not None:
+            off["provider_name"] = off.get("provider_name") or str(off["provider_id"])
+            offers.setdefault(offer_key(off), off)
 
-        if changed(last.get("presentation_type"), presentation_type) or changed(last.get("url"), url) or changed(last.get("provider_name"), provider_name):
-            if last["valid_to"] is None:
-                c.execute(SQL_CLOSE_OFFER, (watchlist_id, provider_id))
-            c.execute(SQL_INSERT_OFFER, (
-                watchlist_id, entry_id, provider_id,
-                provider_name or str(provider_id or ""),
-                presentation_type, url
-            ))
+    def changed(a, b): return (a or "") != (b or "")
 
+    with conn.cursor() as c:
+        with metrics.timed_sql("select_open_offers"):
+            c.execute(SQL_SELECT_OPEN_OFFERS, (watchlist_id,))
+            open_rows = c.fetchall()
+
+        still_open, close_ids = set(), []
+        for h in open_rows:
+            key = offer_key(h)
+            off = offers.get(key)
+            if off is None or key in still_open or changed(h["url"], off["url"]) \
+                    or changed(h["provider_name"], off["provider_name"]):
+                close_ids.append(h["id"])
+            else:
+                still_open.add(key)
+        if close_ids:
+            with metrics.timed_sql("close_offers"):
+                c.execute(SQL_CLOSE_OFFERS.format(ids=", ".join(["%s"] * len(close_ids))), close_ids)
+
+        new = [k for k in offers if k not in still_open]
+        if new:
+            with metrics.timed_sql("insert_offers"):
+                c.executemany(SQL_INSERT_OFFER, [
+                    (watchlist_id, entry_id, k[0], offers[k]["provider_name"], offers[k]["presentation_type"],
+                     offers[k]["monetization_type"], offers[k]["url"]) for k in new
+                ])
+
+        with metrics.timed_sql("rebuild_current"):
+            c.execute(SQL_DELETE_CURRENT, (watchlist_id,))
+            if offers:
+                c.executemany(SQL_INSERT_CURRENT, [
+                    (watchlist_id, k[0], k[1], k[2], entry_id, off["provider_name"], off["url"])
+                    for k, off in offers.items()
+                ])
+
+def source_table(source):
+    return JW_SOURCE_TABLE if source == JW_SOURCE else SOURCE_TABLES[source]
+
+def reuse_match(conn, source, src_id, title_norm, year):
+    """Fresh jw_title_map row of another source row with this normalized title + year, or None."""
+    if not JW_NORM_COL:
+        return None
+    with conn.cursor() as c, metrics.timed_sql("reuse_map"):
+        c.execute(SQL_REUSE_MAP_FOR.format(table=source_table(source)), (source, title_norm, year, src_id))
+        return c.fetchone()
+
+@profiling.hot
 def update_one(conn, row, cur_source):
-    """Map a single row from source → jw_title_map, and (if WATCHLIST) update offers history."""
+    """Map a single row from source → jw_title_map, and (if WATCHLIST) update offers history.
+    Returns the mapping as enrich_details.enrich_one expects it, or None when nothing was mapped."""
     src_id = row["source_row_id"]
     title  = (row["title"] or "").strip()
     year   = row.get("year")
@@ -222,45 +441,50 @@ def update_one(conn, row, cur_source):
         log_to_db(PROJECT_NAME, "WARNING", f"Empty title for {cur_source}:{src_id}, skipping")
         return
 
-    # 1) JustWatch search
-    try:
-        results = search(title, country=COUNTRY, language=LANG, best_only=BEST_ONLY)
-    except Exception as e:
-        log_to_db(PROJECT_NAME, "ERROR", f"search() failed for {title}: {e}")
-        return
+    title_norm = row.get("title_norm")
+
+    # 1) same normalized title + year already mapped on another row → reuse that match
+    reused = reuse_match(conn, cur_source, src_id, title_norm, year) if title_norm else None
+    if reused:
+        entry_id, matched_via, confidence = reused["entry_id"], reused["matched_via"], reused["confidence"]
+        matched_title, matched_year, matched_type = reused["matched_title"], reused["matched_year"], reused["matched_type"]
+        matched_title_norm = reused["matched_title_norm"] or title_match.normalize(matched_title)
+        metrics.inc("cache_hits_total", cache="jw_title_map_reuse")
+    else:
+        # 2) JustWatch search
+        try:
+            results = jw_call("search", search, title, country=COUNTRY, language=LANG, best_only=BEST_ONLY)
+        except Exception as e:
+            log_to_db(PROJECT_NAME, "ERROR", f"search() failed for {title}: {e}")
+            return
 
-    if not results:
-        log_to_db(PROJECT_NAME, "WARNING", f"No JW results for {title} ({year})")
-        return
+        if not results:
+            log_to_db(PROJECT_NAME, "WARNING", f"No JW results for {title} ({year})")
+            return
 
-    # 2) pick best
-    best, matched_via, confidence, matched_type = pick_best_match(results, title, year)
-    if not best:
-        log_to_db(PROJECT_NAME, "WARNING", f"No match selected for {title} ({year})")
-        return
+        # 3) pick best, extract JustWatch entry_id (tm... for movies, ts... for shows)
+        best, matched_via, confidence, matched_type = pick_best_match(results, title, year, title_norm)
+        if not best:
+            log_to_db(PROJECT_NAME, "WARNING", f"No match selected for {title} ({year})")
+            return
 
-    # 3) extract JustWatch entry_id (tm... for movies, ts... for shows)
-    entry_id = g(best, "id", "jw_entity_id", "jwId", "jw_id")
-    if not entry_id:
-        # Don’t spam logs per your feedback; keep a single warn per title
-        log_to_db(PROJECT_NAME, "WARNING", f"Matched but no JustWatch entry_id for {title} ({year})")
-        return
+        entry_id = g(best, "entry_id", "id", "jw_entity_id", "jwId", "jw_id")
+        if not entry_id:
+            # Don’t spam logs per your feedback; keep a single warn per title
+            log_to_db(PROJECT_NAME, "WARNING", f"Matched but no JustWatch entry_id for {title} ({year})")
+            return
 
-    matched_title = g(best, "title", "original_title", "name") or title
-    matched_year  = g(best, "year", "original_release_year")
-    if not matched_year:
-        od = g(best, "original_release_date")
-        matched_year = (od or "")[:4] if od else None
-    try:
-        matched_year = int(matched_year) if matched_year else None
-    except Exception:
-        matched_year = None
+        matched_title = g(best, "title", "original_title", "name") or title
+        matched_year  = result_year(best)
+        matched_title_norm = title_match.normalize(matched_title)
 
     # 4) upsert mapping
-    with conn.cursor() as c:
+    with conn.cursor() as c, metrics.timed_sql("upsert_map"):
         c.execute(SQL_UPSERT_MAP, (
-            cur_source, src_id, entry_id, matched_via, confidence, matched_title, matched_year, matched_type
+            cur_source, src_id, entry_id, matched_via, confidence, matched_title, matched_year, matched_type,
+            matched_title_norm
         ))
+    metrics.inc("rows_total", stage=PROJECT_NAME, table="jw_title_map")
 
     log_to_db(PROJECT_NAME, "INFO",
               f"Mapped {cur_source}:{src_id} → {entry_id} ({matched_title}, {matched_year}) via {matched_via} [{confidence}]")
@@ -268,29 +492,62 @@ def update_one(conn, row, cur_source):
     # 5) offers history (WATCHLIST only)
     if UPDATE_OFFERS and cur_source == "WATCHLIST":
         offers_list = fetch_offers(entry_id)
-        if offers_list:
-            for off in offers_list:
-                provider_id       = off.get("provider_id")
-                if provider_id is None:
-                    continue
-                provider_name     = off.get("provider_name") or str(provider_id)
-                presentation_type = off.get("presentation_type")
-                url               = off.get("url")
-                upsert_offer_history_watchlist(
-                    conn,
-                    watchlist_id=src_id,
-                    entry_id=entry_id,
-                    provider_id=provider_id,
-                    provider_name=provider_name,
-                    presentation_type=presentation_type,
-                    url=url
-                )
+        if offers_list is not None:
+            # history + current table for one title commit together; an empty list closes them all
+            conn.begin()
+            try:
+                sync_offers_watchlist(conn, src_id, entry_id, offers_list)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+    return {"source": cur_source, "source_row_id": src_id, "entry_id": entry_id,
+            "matched_title": matched_title, "matched_year": matched_year, "matched_type": matched_type,
+            "matched_title_norm": matched_title_norm}
+
+def ensure_schema(c):
+    c.execute(SQL_CREATE_TITLE_MAP)
+    c.execute("SHOW COLUMNS FROM jw_title_map LIKE 'matched_title_norm'")
+    if c.fetchone() is None:
+        c.execute("ALTER TABLE jw_title_map ADD COLUMN matched_title_norm VARCHAR(255) NULL")
+    c.execute(SQL_CREATE_OFFERS_HISTORY)
+    c.execute("SHOW COLUMNS FROM jw_offers_history LIKE 'monetization_type'")
+    if c.fetchone() is None:
+        # open rows without it don't match any offer key, so the next check closes and reopens them typed
+        c.execute("ALTER TABLE jw_offers_history ADD COLUMN monetization_type VARCHAR(16) NULL AFTER presentation_type")
+    pipeline_state.ensure_schema(c)
+    # "recently changed offers" (api_server.py) reads history by open / close time
+    for index, col in (("ix_offer_valid_from", "valid_from"), ("ix_offer_valid_to", "valid_to")):
+        c.execute("SHOW INDEX FROM jw_offers_history WHERE Key_name=%s", (index,))
+        if c.fetchone() is None:
+            c.execute(f"ALTER TABLE jw_offers_history ADD KEY {index} ({col})")
+    c.execute("SHOW TABLES LIKE 'jw_offers_current'")
+    created_current = c.fetchone() is None
+    c.execute(SQL_CREATE_OFFERS_CURRENT)
+    if created_current:
+        c.execute(SQL_RECHECK_OPEN_OFFERS)
+        log_to_db(PROJECT_NAME, "INFO", f"jw_offers_current created; {c.rowcount} watchlist titles due for an offers check")
+    else:
+        # FLATRATE and RENT / BUY at the same quality used to share one row
+        c.execute("SHOW INDEX FROM jw_offers_current WHERE Key_name='PRIMARY' AND Column_name='monetization_type'")
+        if c.fetchone() is None:
+            c.execute(SQL_RECHECK_UNTYPED_OFFERS)
+            log_to_db(PROJECT_NAME, "INFO", f"{c.rowcount} watchlist titles had offers without monetization_type, due for a check")
+            c.execute("DELETE FROM jw_offers_current WHERE monetization_type IS NULL")
+            c.execute("ALTER TABLE jw_offers_current "
+                      "MODIFY monetization_type VARCHAR(16) NOT NULL DEFAULT '', "
+                      "DROP PRIMARY KEY, "
+                      "ADD PRIMARY KEY (watchlist_id, provider_id, presentation_type, monetization_type)")
 
 def main():
     conn = pymysql.connect(**DB)
     try:
-        # select candidates for this source
         with conn.cursor() as c:
+            ensure_schema(c)
+
+        # select candidates for this source
+        with conn.cursor() as c, metrics.timed_sql("select_candidates"):
             c.execute(SQL_SELECT_CANDIDATES, (JW_SOURCE,))
             rows = c.fetchall()
 
@@ -301,14 +558,20 @@ def main():
             log_to_db(PROJECT_NAME, "INFO",
                       f"[{i}/{total}] {JW_SOURCE}:{row['source_row_id']} — {row['title']} ({row.get('year')})")
             update_one(conn, row, JW_SOURCE)
+            metrics.inc("rows_total", stage=PROJECT_NAME, table=JW_SOURCE_TABLE)
+            metrics.maybe_flush(PROJECT_NAME)
             time.sleep(SLEEP_S)
 
+        with conn.cursor() as c:
+            pipeline_state.mark_run_complete(c, f"{PROJECT_NAME}:{JW_SOURCE}")
         log_to_db(PROJECT_NAME, "INFO", "✔️ JustWatch mapping complete.")
     except Exception as e:
         log_to_db(PROJECT_NAME, "ERROR", f"❌ Fatal error in jw_update: {e}")
         raise
     finally:
         conn.close()
+        metrics.flush(PROJECT_NAME)
 
 if __name__ == "__main__":
-    main()
+    with profiling.run(PROJECT_NAME):
+        main()
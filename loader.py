@@ -4,12 +4,18 @@ from typing import List, Dict, Optional
 import pymysql
 from dotenv import load_dotenv
 from logger import log_to_db
+import metrics
+import profiling
+import stats
+import pipeline_state
+import title_match
 
 load_dotenv()
 
 PROJECT_NAME = "letterboxd_loader"
 
 EXPORT_DIR = os.getenv("DOWNLOAD_DIR", "./exports")
+DIARY_BATCH = int(os.getenv("LOADER_DIARY_BATCH", "500"))   # diary rows per old-month lookup
 
 DB = dict(
     host=os.getenv("MARIADB_HOST", "localhost"),
@@ -30,10 +36,23 @@ def latest_zip(path: str) -> str:
         raise SystemExit(msg)
     return zips[-1]
 
+@profiling.hot
 def open_csv(z: zipfile.ZipFile, name: str) -> List[Dict[str, str]]:
-    with z.open(name) as f:
+    with metrics.timed("csv_read_seconds", file=os.path.basename(name)), z.open(name) as f:
         return list(csv.DictReader(io.TextIOWrapper(f, encoding="utf-8")))
 
+def diary_months(cur, keys) -> Dict[tuple, Optional[str]]:
+    """Current watch_month for the given (logged_date, film_name, film_year) keys, one uq_diary
+    range per key (<=> so a NULL year still matches)."""
+    if not keys:
+        return {}
+    where = " OR ".join(["(logged_date = %s AND film_name = %s AND film_year <=> %s)"] * len(keys))
+    with metrics.timed_sql("select_diary_months"):
+        cur.execute(f"SELECT logged_date, film_name, film_year, watch_month FROM diary WHERE {where}",
+                    [v for k in keys for v in k])
+        return {(str(d["logged_date"]), d["film_name"], d["film_year"]): d["watch_month"]
+                for d in cur.fetchall()}
+
 def to_int(val: Optional[str]) -> Optional[int]:
     if val is None: return None
     val = val.strip()
@@ -106,65 +125,87 @@ def ensure_schema(cur):
     ensure_unique(cur, "watched",   "uq_watched",   "film_name, film_year, watched_date")
     ensure_unique(cur, "diary",     "uq_diary",     "logged_date, film_name, film_year")
 
-def main():
-    zip_path = latest_zip(EXPORT_DIR)
-    log_to_db(PROJECT_NAME, "INFO", f"📦 Using export: {zip_path}")
+def load(conn, zip_path, on_changed=None):
+    """
+    Upsert one export into watchlist / watched / diary and refresh the stats it touched.
+    on_changed(source, row) is called for every inserted or changed WATCHLIST / DIARY row with
+    {"source_row_id", "title", "year", "title_norm"} (pipeline.py feeds these straight to the JustWatch mapper).
+    """
+    with conn.cursor() as cur:
+        # stats keys touched by this load (rowcount: 1 inserted, 2 changed, 0 identical)
+        touched_watchlist_months, touched_diary_months, touched_film_years = set(), set(), set()
 
-    conn = pymysql.connect(**DB)
-    try:
-        with conn.cursor() as cur:
-            ensure_schema(cur)
+        with zipfile.ZipFile(zip_path) as z:
+            names = set(z.namelist())
+
+            ins_watchlist = ins_watched = ins_diary = 0
 
-            with zipfile.ZipFile(zip_path) as z:
-                names = set(z.namelist())
-
-                ins_watchlist = ins_watched = ins_diary = 0
-
-                # watchlist.csv
-                cand = [n for n in names if n.endswith("/watchlist.csv") or n == "watchlist.csv"]
-                if cand:
-                    rows = open_csv(z, cand[0])
-                    for r in rows:
-                        added_date = r.get("Date") or None
-                        film_name  = r.get("Name") or None
-                        film_year  = to_int(r.get("Year"))
-                        film_uri   = r.get("Letterboxd URI") or None
-                        if not film_name: continue
+            # watchlist.csv
+            cand = [n for n in names if n.endswith("/watchlist.csv") or n == "watchlist.csv"]
+            if cand:
+                rows = open_csv(z, cand[0])
+                for r in rows:
+                    added_date = r.get("Date") or None
+                    film_name  = r.get("Name") or None
+                    film_year  = to_int(r.get("Year"))
+                    film_uri   = r.get("Letterboxd URI") or None
+                    if not film_name: continue
+                    with metrics.timed_sql("upsert_watchlist"):
                         cur.execute(
-                          """INSERT INTO watchlist (added_date, film_name, film_year, film_uri)
-                             VALUES (%s, %s, %s, %s)
-                             ON DUPLICATE KEY UPDATE film_uri = VALUES(film_uri)""",
-                          (added_date, film_name, film_year, film_uri)
+                          """INSERT INTO watchlist (added_date, film_name, film_year, film_uri, film_name_norm)
+                             VALUES (%s, %s, %s, %s, %s)
+                             ON DUPLICATE KEY UPDATE id = LAST_INSERT_ID(id),
+                                                     film_uri = VALUES(film_uri),
+                                                     film_name_norm = VALUES(film_name_norm)""",
+                          (added_date, film_name, film_year, film_uri, title_match.normalize(film_name))
                         )
-                        ins_watchlist += 1
-                else:
-                    log_to_db(PROJECT_NAME, "WARNING", "⚠️  watchlist.csv not found in ZIP")
-
-                # watched.csv
-                cand = [n for n in names if n.endswith("/watched.csv") or n == "watched.csv"]
-                if cand:
-                    rows = open_csv(z, cand[0])
-                    for r in rows:
-                        watched_date = r.get("Date") or None
-                        film_name    = r.get("Name") or None
-                        film_year    = to_int(r.get("Year"))
-                        film_uri     = r.get("Letterboxd URI") or None
-                        if not film_name: continue
+                    if cur.rowcount == 1:
+                        touched_watchlist_months.add(stats.month_of(added_date))
+                    if cur.rowcount and on_changed:
+                        # LAST_INSERT_ID(id) makes lastrowid the row's id on update as well
+                        on_changed("WATCHLIST", {"source_row_id": cur.lastrowid, "title": film_name, "year": film_year,
+                                             "title_norm": title_match.normalize(film_name)})
+                    ins_watchlist += 1
+                    metrics.inc("rows_total", stage=PROJECT_NAME, table="watchlist")
+                    metrics.maybe_flush(PROJECT_NAME)
+            else:
+                log_to_db(PROJECT_NAME, "WARNING", "⚠️  watchlist.csv not found in ZIP")
+
+            # watched.csv
+            cand = [n for n in names if n.endswith("/watched.csv") or n == "watched.csv"]
+            if cand:
+                rows = open_csv(z, cand[0])
+                for r in rows:
+                    watched_date = r.get("Date") or None
+                    film_name    = r.get("Name") or None
+                    film_year    = to_int(r.get("Year"))
+                    film_uri     = r.get("Letterboxd URI") or None
+                    if not film_name: continue
+                    with metrics.timed_sql("upsert_watched"):
                         cur.execute(
-                          """INSERT INTO watched (watched_date, film_name, film_year, film_uri)
-                             VALUES (%s, %s, %s, %s)
-                             ON DUPLICATE KEY UPDATE film_uri = VALUES(film_uri)""",
-                          (watched_date, film_name, film_year, film_uri)
+                          """INSERT INTO watched (watched_date, film_name, film_year, film_uri, film_name_norm)
+                             VALUES (%s, %s, %s, %s, %s)
+                             ON DUPLICATE KEY UPDATE film_uri = VALUES(film_uri),
+                                                     film_name_norm = VALUES(film_name_norm)""",
+                          (watched_date, film_name, film_year, film_uri, title_match.normalize(film_name))
                         )
-                        ins_watched += 1
-                else:
-                    log_to_db(PROJECT_NAME, "WARNING", "⚠️  watched.csv not found in ZIP")
-
-                # diary.csv
-                cand = [n for n in names if n.endswith("/diary.csv") or n == "diary.csv"]
-                if cand:
-                    rows = open_csv(z, cand[0])
-                    for r in rows:
+                    ins_watched += 1
+                    metrics.inc("rows_total", stage=PROJECT_NAME, table="watched")
+                    metrics.maybe_flush(PROJECT_NAME)
+            else:
+                log_to_db(PROJECT_NAME, "WARNING", "⚠️  watched.csv not found in ZIP")
+
+            # diary.csv
+            cand = [n for n in names if n.endswith("/diary.csv") or n == "diary.csv"]
+            if cand:
+                rows = open_csv(z, cand[0])
+                # current month per diary key, so an entry whose watched date moved also
+                # refreshes the month it left; looked up per batch for the export's keys only
+                for start in range(0, len(rows), DIARY_BATCH):
+                    batch = [r for r in rows[start:start + DIARY_BATCH] if r.get("Name")]
+                    old_months = diary_months(cur, [(r.get("Date") or None, r["Name"], to_int(r.get("Year")))
+                                                    for r in batch])
+                    for r in batch:
                         logged_date  = r.get("Date") or None
                         film_name    = r.get("Name") or None
                         film_year    = to_int(r.get("Year"))
@@ -173,24 +214,58 @@ def main():
                         rewatch      = to_bool(r.get("Rewatch"))
                         tags         = (r.get("Tags") or None)
                         watched_date = r.get("Watched Date") or None
-                        if not film_name: continue
-                        cur.execute(
-                          """INSERT INTO diary
-                             (logged_date, film_name, film_year, film_uri, rating, rewatch, tags, watched_date)
-                             VALUES (%s,%s,%s,%s,%s,%s,%s,%s)
-                             ON DUPLICATE KEY UPDATE
-                               film_uri     = VALUES(film_uri),
-                               rating       = VALUES(rating),
-                               rewatch      = VALUES(rewatch),
-                               tags         = VALUES(tags),
-                               watched_date = VALUES(watched_date)""",
-                          (logged_date, film_name, film_year, film_uri, rating, rewatch, tags, watched_date)
-                        )
+                        with metrics.timed_sql("upsert_diary"):
+                            cur.execute(
+                              """INSERT INTO diary
+                                 (logged_date, film_name, film_year, film_uri, rating, rewatch, tags, watched_date, film_name_norm)
+                                 VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s)
+                                 ON DUPLICATE KEY UPDATE
+                                   id           = LAST_INSERT_ID(id),
+                                   film_name_norm = VALUES(film_name_norm),
+                                   film_uri     = VALUES(film_uri),
+                                   rating       = VALUES(rating),
+                                   rewatch      = VALUES(rewatch),
+                                   tags         = VALUES(tags),
+                                   watched_date = VALUES(watched_date)""",
+                              (logged_date, film_name, film_year, film_uri, rating, rewatch, tags, watched_date,
+                               title_match.normalize(film_name))
+                            )
+                        if cur.rowcount:
+                            touched_diary_months.add(stats.month_of(watched_date or logged_date))
+                            touched_diary_months.add(stats.month_of(old_months.get((logged_date, film_name, film_year))))
+                            touched_film_years.add(film_year)
+                            if on_changed:
+                                on_changed("DIARY", {"source_row_id": cur.lastrowid, "title": film_name, "year": film_year,
+                                             "title_norm": title_match.normalize(film_name)})
                         ins_diary += 1
-                else:
-                    log_to_db(PROJECT_NAME, "WARNING", "⚠️  diary.csv not found in ZIP")
+                        metrics.inc("rows_total", stage=PROJECT_NAME, table="diary")
+                        metrics.maybe_flush(PROJECT_NAME)
+            else:
+                log_to_db(PROJECT_NAME, "WARNING", "⚠️  diary.csv not found in ZIP")
+
+            log_to_db(PROJECT_NAME, "INFO", f"✅ Upserted rows → watchlist={ins_watchlist}, watched={ins_watched}, diary={ins_diary}")
+
+    stats.refresh(conn, diary_months=touched_diary_months, film_years=touched_film_years,
+                  watchlist_months=touched_watchlist_months)
+    log_to_db(PROJECT_NAME, "INFO", f"📊 Stats refreshed → {len(touched_diary_months - {None})} diary months, "
+                                    f"{len(touched_film_years)} film years, "
+                                    f"{len(touched_watchlist_months - {None})} watchlist months")
+
+def main():
+    zip_path = latest_zip(EXPORT_DIR)
+    log_to_db(PROJECT_NAME, "INFO", f"📦 Using export: {zip_path}")
 
-                log_to_db(PROJECT_NAME, "INFO", f"✅ Upserted rows → watchlist={ins_watchlist}, watched={ins_watched}, diary={ins_diary}")
+    conn = pymysql.connect(**DB)
+    try:
+        with conn.cursor() as cur:
+            ensure_schema(cur)
+            stats.ensure_schema(cur)
+            title_match.ensure_schema(cur)
+            pipeline_state.ensure_schema(cur)
+
+        load(conn, zip_path)
+        with conn.cursor() as cur:
+            pipeline_state.mark_run_complete(cur, PROJECT_NAME)
 
         log_to_db(PROJECT_NAME, "INFO", "✔️  Load complete.")
     except Exception as e:
@@ -198,6 +273,8 @@ def main():
         sys.exit(1)
     finally:
         conn.close()
+        metrics.flush(PROJECT_NAME)
 
 if __name__ == "__main__":
-    main()
+    with profiling.run(PROJECT_NAME):
+        main()
@@ -3,6 +3,8 @@ import pymysql
 from dotenv import load_dotenv
 from datetime import datetime, timezone
 
+import metrics
+
 load_dotenv()
 
 def get_log_conn():
@@ -19,6 +21,8 @@ def log_to_db(project, level, message):
     """Log to DB and console"""
     ts = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S%z")
     print(f"[{ts}] {project} {level}: {message}")  # Console
+    if level == "ERROR":
+        metrics.inc("errors_total", stage=project)
 
     try:
         conn = get_log_conn()
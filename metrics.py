@@ -0,0 +1,187 @@
+# metrics.py — in-process counters + latency histograms for every pipeline stage
+# - Exported as a Prometheus textfile (node-exporter textfile collector format)
+# - Set METRICS_DIR to enable writing; counting is always on and cheap
+# - Written at the end of each run and every METRICS_FLUSH_S during long runs
+
+import os
+import time
+import threading
+from contextlib import contextmanager
+
+METRICS_DIR     = os.getenv("METRICS_DIR", "")                     # e.g. /data/metrics (empty = don't write)
+METRICS_FLUSH_S = float(os.getenv("METRICS_FLUSH_S", "60"))
+
+PREFIX = "lbx_"
+
+# Latency buckets in seconds; covers ~1ms SQL statements up to slow API calls
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+HELP = {
+    "rows_total":          ("counter",   "Rows processed per stage and table"),
+    "api_calls_total":     ("counter",   "External API calls by api, endpoint and outcome (ok / throttled / error)"),
+    "cache_hits_total":    ("counter",   "In-process cache hits by cache name"),
+    "api_retries_total":   ("counter",   "External API calls retried by api and reason"),
+    "errors_total":        ("counter",   "ERROR-level log lines by stage"),
+    "api_latency_seconds": ("histogram", "External API call latency"),
+    "sql_latency_seconds": ("histogram", "SQL statement latency"),
+    "csv_read_seconds":    ("histogram", "Time to read one CSV out of the export ZIP"),
+    "http_requests_total": ("counter",   "Query API requests by route and status"),
+    "http_latency_seconds": ("histogram", "Query API request latency by route"),
+    "image_store_bytes":   ("gauge",     "Bytes in the local image cache after eviction"),
+    "run_duration_seconds": ("gauge",    "Wall time of the current/last run"),
+    "last_run_timestamp_seconds": ("gauge", "Unix time the stage last flushed metrics"),
+}
+
+_lock       = threading.Lock()
+_counters   = {}   # (name, labels) -> float
+_gauges     = {}   # (name, labels) -> float
+_histograms = {}   # (name, labels) -> [bucket_counts..., sum, count]
+_started    = time.time()
+_last_flush = _started
+_job        = None  # pin_job(): one process running several stages writes a single file
+
+def _key(name, labels):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+def inc(name, value=1, **labels):
+    """Increment counter `name` (without prefix) for the given label set."""
+    k = _key(name, labels)
+    with _lock:
+        _counters[k] = _counters.get(k, 0) + value
+
+def set_gauge(name, value, **labels):
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+def observe(name, seconds, **labels):
+    """Record one observation in histogram `name`."""
+    k = _key(name, labels)
+    with _lock:
+        h = _histograms.get(k)
+        if h is None:
+            h = _histograms[k] = [0] * (len(BUCKETS) + 2)
+        for i, le in enumerate(BUCKETS):
+            if seconds <= le:
+                h[i] += 1
+        h[-2] += seconds
+        h[-1] += 1
+
+@contextmanager
+def timed(name, **labels):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - t0, **labels)
+
+class ApiCall:
+    """Yielded by timed_api; set .outcome for calls that returned but didn't succeed."""
+    __slots__ = ("outcome",)
+
+    def __init__(self):
+        self.outcome = "ok"
+
+    def status(self, code):
+        """Outcome from an HTTP status: 429 → throttled, other 4xx / 5xx → error."""
+        if code == 429:
+            self.outcome = "throttled"
+        elif code >= 400:
+            self.outcome = "error"
+
+@contextmanager
+def timed_api(api, endpoint):
+    """Time an external call and count it; failures are counted with outcome=error (unless the
+    caller already set one, e.g. throttled) and re-raised."""
+    t0 = time.perf_counter()
+    call = ApiCall()
+    try:
+        yield call
+    except Exception:
+        if call.outcome == "ok":
+            call.outcome = "error"
+        raise
+    finally:
+        observe("api_latency_seconds", time.perf_counter() - t0, api=api, endpoint=endpoint)
+        inc("api_calls_total", api=api, endpoint=endpoint, outcome=call.outcome)
+
+def timed_sql(statement):
+    return timed("sql_latency_seconds", statement=statement)
+
+# ---------- Export ----------
+
+def _fmt_labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    esc = lambda v: v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in items) + "}"
+
+def _fmt_num(v):
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+def render(job):
+    """Return all metrics in Prometheus text exposition format, labelled with job=<job>."""
+    job_label = (("job", job),)
+    with _lock:
+        counters   = dict(_counters)
+        gauges     = dict(_gauges)
+        histograms = {k: list(v) for k, v in _histograms.items()}
+
+    by_name = {}
+    for (name, labels), v in counters.items():
+        by_name.setdefault(name, []).append(("c", labels, v))
+    for (name, labels), v in gauges.items():
+        by_name.setdefault(name, []).append(("g", labels, v))
+    for (name, labels), v in histograms.items():
+        by_name.setdefault(name, []).append(("h", labels, v))
+
+    out = []
+    for name in sorted(by_name):
+        mtype, help_text = HELP.get(name, ("untyped", name))
+        full = PREFIX + name
+        out.append(f"# HELP {full} {help_text}")
+        out.append(f"# TYPE {full} {mtype}")
+        for kind, labels, v in sorted(by_name[name], key=lambda x: x[1]):
+            labels = tuple(labels) + job_label
+            if kind != "h":
+                out.append(f"{full}{_fmt_labels(labels)} {_fmt_num(v)}")
+                continue
+            for i, le in enumerate(BUCKETS):
+                out.append(f"{full}_bucket{_fmt_labels(labels, (('le', _fmt_num(le)),))} {v[i]}")
+            out.append(f"{full}_bucket{_fmt_labels(labels, (('le', '+Inf'),))} {v[-1]}")
+            out.append(f"{full}_sum{_fmt_labels(labels)} {_fmt_num(v[-2])}")
+            out.append(f"{full}_count{_fmt_labels(labels)} {v[-1]}")
+    return "\n".join(out) + "\n"
+
+def pin_job(job):
+    """Write every flush under this job name, whatever the calling stage passes (pipeline.py)."""
+    global _job
+    _job = job
+
+def flush(job):
+    """Write <METRICS_DIR>/<job>.prom atomically (tmp file + rename, as the textfile collector expects)."""
+    global _last_flush
+    job = _job or job
+    _last_flush = time.time()
+    if not METRICS_DIR:
+        return None
+    set_gauge("run_duration_seconds", round(_last_flush - _started, 3))
+    set_gauge("last_run_timestamp_seconds", int(_last_flush))
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    path = os.path.join(METRICS_DIR, f"{job}.prom")
+    tmp  = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(render(job))
+        os.replace(tmp, path)
+    except OSError as e:
+        print(f"metrics: failed to write {path}: {e}")
+        return None
+    return path
+
+def maybe_flush(job):
+    """Periodic flush for long loops; no-op until METRICS_FLUSH_S has passed since the last write."""
+    if METRICS_DIR and time.time() - _last_flush >= METRICS_FLUSH_S:
+        flush(job)
@@ -0,0 +1,225 @@
+# pipeline.py — fetch → load → map → enrich in one process, instead of four one-shot containers
+# - Stages are threads joined by in-memory queues: the loader hands each inserted / changed
+#   WATCHLIST and DIARY row straight to that source's mapper, and the mappers hand each new
+#   jw_title_map row to the enricher, so downstream stages start while upstream is still running
+#   and never scan the tables for work
+# - WATCHLIST and DIARY mapping run concurrently, each on its own DB connection
+# - Shared across stages: one pooled JustWatch HTTP client, enrich_details' TMDb / OMDb session
+#   and budgets, the title normalization cache, and an entry_id → film id map (a film on both
+#   the watchlist and the diary is fetched from TMDb once)
+# - PIPELINE_SWEEP (default on) also picks up what the queues can't carry: mappings gone stale,
+#   rows that failed in earlier runs, targets left over from a quota stop
+# - Each stage records the same pipeline_runs stage name as its standalone container
+#
+#   PIPELINE_FETCH=false python pipeline.py   # load the newest ZIP in DOWNLOAD_DIR, skip Playwright
+
+import os
+import sys
+import time
+import queue
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import pymysql
+from pymysql.cursors import DictCursor
+from dotenv import load_dotenv
+
+from logger import log_to_db
+import metrics
+import profiling
+import pipeline_state
+import stats
+import title_match
+import loader
+import jw_update
+import enrich_details
+
+PROJECT_NAME = "lbx-pipeline"
+
+load_dotenv()
+
+# ---------- Config ----------
+FETCH   = os.getenv("PIPELINE_FETCH", "true").lower() in ("1", "true", "yes")
+SWEEP   = os.getenv("PIPELINE_SWEEP", "true").lower() in ("1", "true", "yes")
+ENRICH  = os.getenv("PIPELINE_ENRICH", "true").lower() in ("1", "true", "yes")
+SOURCES = [s.strip().upper() for s in os.getenv("PIPELINE_SOURCES", "WATCHLIST,DIARY").split(",") if s.strip()]
+
+DB = dict(
+    host=os.getenv("MARIADB_HOST", "localhost"),
+    port=int(os.getenv("MARIADB_PORT", "3306")),
+    user=os.getenv("MARIADB_USER", "root"),
+    password=os.getenv("MARIADB_PASS", ""),
+    database=os.getenv("MARIADB_DB", "letterboxd"),
+    charset="utf8mb4",
+    cursorclass=DictCursor,
+    autocommit=True,
+)
+
+DONE = object()   # end-of-stream marker on every queue
+
+def drain(q):
+    """Yield queue items until DONE."""
+    return iter(q.get, DONE)
+
+# ---------- Stages ----------
+
+def fetch():
+    if not FETCH:
+        return loader.latest_zip(loader.EXPORT_DIR)
+    import fetch_export   # Playwright is only needed when we actually fetch
+    if not fetch_export.USER or not fetch_export.PASS:
+        raise SystemExit("Set LETTERBOXD_USER and LETTERBOXD_PASS (or PIPELINE_FETCH=false).")
+    return asyncio.run(fetch_export.run())
+
+def load(zip_path, outboxes):
+    """Upsert the export; every changed row goes to its source's mapper as it's written."""
+    counts = dict.fromkeys(outboxes, 0)
+
+    def on_changed(source, row):
+        if source in outboxes:
+            outboxes[source].put(row)
+            counts[source] += 1
+
+    conn = pymysql.connect(**DB)
+    try:
+        loader.load(conn, zip_path, on_changed=on_changed)
+        with conn.cursor() as c:
+            pipeline_state.mark_run_complete(c, loader.PROJECT_NAME)
+        log_to_db(PROJECT_NAME, "INFO", f"📦 Load done, changed rows → "
+                                        + ", ".join(f"{s}={n}" for s, n in counts.items()))
+    finally:
+        conn.close()
+        for q in outboxes.values():
+            q.put(DONE)
+
+def map_source(source, inbox, outbox):
+    """Map the rows the loader changed, then (SWEEP) this source's usual stale / unmapped backlog."""
+    conn = pymysql.connect(**DB)
+    mapped = skipped = 0
+    stage = f"{jw_update.PROJECT_NAME}:{source}"
+
+    def map_row(row):
+        nonlocal mapped
+        hit = jw_update.update_one(conn, row, source)
+        if hit:
+            outbox.put(hit)
+            mapped += 1
+        metrics.inc("rows_total", stage=PROJECT_NAME, table=jw_update.SOURCE_TABLES[source])
+        metrics.maybe_flush(PROJECT_NAME)
+        time.sleep(jw_update.SLEEP_S)
+
+    try:
+        for row in drain(inbox):
+            with conn.cursor() as c, metrics.timed_sql("map_is_fresh"):
+                c.execute(jw_update.SQL_MAP_IS_FRESH, (source, row["source_row_id"]))
+                fresh = c.fetchone() is not None
+            if fresh:
+                skipped += 1
+                continue
+            map_row(row)
+        if SWEEP:
+            with conn.cursor() as c, metrics.timed_sql("select_candidates"):
+                c.execute(jw_update.SQL_SELECT_CANDIDATES_FOR.format(table=jw_update.source_table(source)), (source,))
+                backlog = c.fetchall()
+            for row in backlog:
+                map_row(row)
+        with conn.cursor() as c:
+            pipeline_state.mark_run_complete(c, stage)
+        log_to_db(PROJECT_NAME, "INFO", f"🔗 {source}: {mapped} mapped, {skipped} still fresh")
+    finally:
+        conn.close()
+
+def enrich(inbox):
+    """Enrich mappings as they arrive, then (SWEEP) older unenriched ones, then spend OMDb quota."""
+    conn = pymysql.connect(**DB)
+    film_ids = {}   # entry_id → film_details.id, shared by both sources' rows
+    stream = drain(inbox)
+    try:
+        with conn.cursor() as c:
+            enrich_details.TMDB_BUDGET.load(c)
+        enrich_details.enrich_rows(conn, stream, film_ids=film_ids)
+        if SWEEP:
+            with conn.cursor() as c, metrics.timed_sql("select_targets"):
+                c.execute(enrich_details.SQL_SELECT_TARGETS)
+                rows = c.fetchall()
+            enrich_details.enrich_rows(conn, rows, total=len(rows), film_ids=film_ids)
+        enrich_details.drain_box_office(conn)
+        with conn.cursor() as c:
+            pipeline_state.mark_run_complete(c, f"{enrich_details.PROJECT}:enrich")
+        log_to_db(PROJECT_NAME, "INFO", "✓ Enrichment done")
+    finally:
+        # enrich_rows stops early on a quota stop; read the rest of the stream so it ends cleanly
+        # (an exhausted stream stays exhausted, so this is a no-op after a full run)
+        for _ in stream:
+            pass
+        enrich_details.flush_budgets(conn)
+        conn.close()
+
+# ---------- Main ----------
+
+def main():
+    unknown = set(SOURCES) - set(jw_update.SOURCE_TABLES)
+    if unknown:
+        raise SystemExit(f"PIPELINE_SOURCES: unknown source(s) {', '.join(sorted(unknown))}")
+    enrich_on = ENRICH and bool(enrich_details.TMDB_API_KEY)
+    if ENRICH and not enrich_on:
+        log_to_db(PROJECT_NAME, "WARNING", "TMDB_API_KEY not set, skipping enrichment")
+
+    metrics.pin_job(PROJECT_NAME)
+    conn = pymysql.connect(**DB)
+    try:
+        with conn.cursor() as c:
+            loader.ensure_schema(c)
+            stats.ensure_schema(c)
+            title_match.ensure_schema(c)
+            pipeline_state.ensure_schema(c)
+            jw_update.ensure_schema(c)
+            if enrich_on:
+                enrich_details.ensure_schema(c)
+    finally:
+        conn.close()
+
+    failed = []
+    client = None
+    try:
+        zip_path = fetch()
+        log_to_db(PROJECT_NAME, "INFO", f"📦 Using export: {zip_path}")
+
+        client = jw_update.use_shared_client(max_connections=2 * len(SOURCES))
+        to_map = {s: queue.Queue() for s in SOURCES}
+        to_enrich = queue.Queue()
+        with ThreadPoolExecutor(max_workers=len(SOURCES) + 2, thread_name_prefix="stage") as pool:
+            upstream = {pool.submit(load, zip_path, to_map): "load"}
+            upstream.update({pool.submit(map_source, s, to_map[s], to_enrich): f"map:{s}" for s in SOURCES})
+            enricher = pool.submit(enrich, to_enrich) if enrich_on else None
+
+            for f, name in upstream.items():
+                if f.exception():
+                    failed.append(name)
+                    log_to_db(PROJECT_NAME, "ERROR", f"❌ Stage {name} failed: {f.exception()}")
+            to_enrich.put(DONE)
+            if enricher and enricher.exception():
+                failed.append("enrich")
+                log_to_db(PROJECT_NAME, "ERROR", f"❌ Stage enrich failed: {enricher.exception()}")
+
+        if not failed:
+            conn = pymysql.connect(**DB)
+            try:
+                with conn.cursor() as c:
+                    pipeline_state.mark_run_complete(c, PROJECT_NAME)
+            finally:
+                conn.close()
+            log_to_db(PROJECT_NAME, "INFO", "✔️ Pipeline complete.")
+    except Exception as e:
+        log_to_db(PROJECT_NAME, "ERROR", f"❌ Pipeline failed: {e}")
+        failed.append("pipeline")
+    finally:
+        if client:
+            client.close()
+        metrics.flush(PROJECT_NAME)
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    with profiling.run(PROJECT_NAME):
+        main()
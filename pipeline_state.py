@@ -0,0 +1,59 @@
+# pipeline_state.py — small persistent state shared by pipeline stages (MariaDB)
+# - Named checkpoints (e.g. "tmdb_changes_movie") so incremental modes resume where they stopped
+# - Run markers: each stage records a finished run; readers (api_server.py) use the latest
+#   marker id as a data generation for cache invalidation and ETags
+
+from datetime import datetime
+
+SQL_CREATE_CHECKPOINTS = """
+CREATE TABLE IF NOT EXISTS pipeline_checkpoints (
+  name          VARCHAR(64) PRIMARY KEY,
+  checkpoint_at DATETIME NOT NULL,
+  updated_at    DATETIME NOT NULL
+) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci;
+"""
+
+SQL_GET_CHECKPOINT = "SELECT checkpoint_at FROM pipeline_checkpoints WHERE name=%s"
+
+SQL_SET_CHECKPOINT = """
+INSERT INTO pipeline_checkpoints (name, checkpoint_at, updated_at)
+VALUES (%s, %s, NOW())
+ON DUPLICATE KEY UPDATE checkpoint_at=VALUES(checkpoint_at), updated_at=VALUES(updated_at);
+"""
+
+SQL_CREATE_RUNS = """
+CREATE TABLE IF NOT EXISTS pipeline_runs (
+  id          INT AUTO_INCREMENT PRIMARY KEY,
+  stage       VARCHAR(64) NOT NULL,
+  finished_at DATETIME NOT NULL,
+  KEY ix_pipeline_runs_stage (stage, id)
+) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci;
+"""
+
+SQL_MARK_RUN = "INSERT INTO pipeline_runs (stage, finished_at) VALUES (%s, NOW())"
+
+SQL_LAST_RUN = "SELECT MAX(id) AS id FROM pipeline_runs"
+
+def ensure_schema(cur):
+    cur.execute(SQL_CREATE_CHECKPOINTS)
+    cur.execute(SQL_CREATE_RUNS)
+
+def get_checkpoint(cur, name) -> datetime | None:
+    cur.execute(SQL_GET_CHECKPOINT, (name,))
+    row = cur.fetchone()
+    if not row:
+        return None
+    return row["checkpoint_at"] if isinstance(row, dict) else row[0]
+
+def set_checkpoint(cur, name, when: datetime):
+    cur.execute(SQL_SET_CHECKPOINT, (name, when.strftime("%Y-%m-%d %H:%M:%S")))
+
+def mark_run_complete(cur, stage):
+    """Record that `stage` finished writing; bumps the generation seen by last_run_id()."""
+    cur.execute(SQL_MARK_RUN, (stage,))
+
+def last_run_id(cur) -> int:
+    cur.execute(SQL_LAST_RUN)
+    row = cur.fetchone()
+    v = row["id"] if isinstance(row, dict) else (row[0] if row else None)
+    return v or 0
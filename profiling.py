@@ -0,0 +1,145 @@
+# profiling.py — opt-in CPU + allocation profiling for pipeline stages
+# - Off unless PROFILE_DIR is set; when off, @hot returns the function untouched
+#   and run() is an empty context manager, so there is no per-call overhead
+# - run(name) wraps a stage's main() with cProfile, tracemalloc and a stack sampler
+# - @hot functions get per-call wall time + net allocated bytes
+# - Output per run in PROFILE_DIR:
+#     <name>-<ts>.pstats     cProfile dump (snakeviz / pstats)
+#     <name>-<ts>.cpu.txt    top-N functions by cumulative time
+#     <name>-<ts>.collapsed  sampled stacks, flamegraph.pl / speedscope ready
+#     <name>-<ts>.alloc.txt  top-N allocation sites + hot function table
+
+import os
+import sys
+import time
+import pstats
+import cProfile
+import functools
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+PROFILE_DIR       = os.getenv("PROFILE_DIR", "")                 # e.g. /data/profiles (empty = disabled)
+PROFILE_TOP_N     = int(os.getenv("PROFILE_TOP_N", "30"))
+PROFILE_SAMPLE_MS = float(os.getenv("PROFILE_SAMPLE_MS", "5"))   # stack sampling interval
+PROFILE_FRAMES    = int(os.getenv("PROFILE_TRACE_FRAMES", "10")) # tracemalloc traceback depth
+
+ENABLED = bool(PROFILE_DIR)
+
+_hot_lock  = threading.Lock()
+_hot_stats = {}   # qualname -> [calls, total_s, max_s, net_alloc_bytes]
+
+def hot(fn):
+    """Decorator for hot functions; identity when profiling is disabled."""
+    if not ENABLED:
+        return fn
+    name = f"{fn.__module__}.{fn.__qualname__}"
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        tracing = tracemalloc.is_tracing()
+        m0 = tracemalloc.get_traced_memory()[0] if tracing else 0
+        t0 = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            dt = time.perf_counter() - t0
+            dm = (tracemalloc.get_traced_memory()[0] - m0) if tracing else 0
+            with _hot_lock:
+                s = _hot_stats.setdefault(name, [0, 0.0, 0.0, 0])
+                s[0] += 1
+                s[1] += dt
+                s[2] = max(s[2], dt)
+                s[3] += dm
+    return wrapper
+
+class _StackSampler(threading.Thread):
+    """Samples one thread's Python stack at a fixed interval into collapsed-stack counts."""
+
+    def __init__(self, thread_id, interval_s):
+        super().__init__(daemon=True, name="profiling-sampler")
+        self.thread_id = thread_id
+        self.interval_s = interval_s
+        self.counts = {}
+        self._halt = threading.Event()
+
+    def run(self):
+        while not self._halt.wait(self.interval_s):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                key = ";".join(reversed(stack))
+                self.counts[key] = self.counts.get(key, 0) + 1
+
+    def stop(self):
+        self._halt.set()
+        self.join()
+
+def _write_reports(base, prof, sampler, snapshot, peak):
+    prof.dump_stats(f"{base}.pstats")
+
+    with open(f"{base}.cpu.txt", "w", encoding="utf-8") as f:
+        st = pstats.Stats(prof, stream=f)
+        st.sort_stats("cumulative").print_stats(PROFILE_TOP_N)
+
+    with open(f"{base}.collapsed", "w", encoding="utf-8") as f:
+        for stack, n in sorted(sampler.counts.items()):
+            f.write(f"{stack} {n}\n")
+
+    with open(f"{base}.alloc.txt", "w", encoding="utf-8") as f:
+        f.write(f"# Peak traced memory: {peak / 1024:.1f} KiB\n\n")
+        f.write(f"# Top {PROFILE_TOP_N} allocation sites (live at end of run)\n")
+        for stat in snapshot.statistics("lineno")[:PROFILE_TOP_N]:
+            f.write(f"{stat.size / 1024:10.1f} KiB  {stat.count:8d} blocks  {stat.traceback[0]}\n")
+        f.write(f"\n# Top {PROFILE_TOP_N} allocation tracebacks\n")
+        for stat in snapshot.statistics("traceback")[:PROFILE_TOP_N]:
+            f.write(f"\n{stat.size / 1024:.1f} KiB in {stat.count} blocks\n")
+            for line in stat.traceback.format():
+                f.write(f"  {line}\n")
+        f.write("\n# Hot functions: calls, total_s, mean_ms, max_ms, net_alloc_KiB\n")
+        with _hot_lock:
+            rows = sorted(_hot_stats.items(), key=lambda kv: kv[1][1], reverse=True)
+        for name, (calls, total, worst, alloc) in rows:
+            f.write(f"{name:<60} {calls:8d} {total:10.3f} {1000 * total / calls:10.2f} "
+                    f"{1000 * worst:10.2f} {alloc / 1024:12.1f}\n")
+
+@contextmanager
+def run(name):
+    """Profile the enclosed block (normally a stage's main()) and write reports on exit."""
+    if not ENABLED:
+        yield
+        return
+
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    ts   = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    base = os.path.join(PROFILE_DIR, f"{name}-{ts}")
+
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start(PROFILE_FRAMES)
+    sampler = _StackSampler(threading.get_ident(), PROFILE_SAMPLE_MS / 1000.0)
+    sampler.start()
+    prof = cProfile.Profile()
+    prof.enable()
+    try:
+        yield
+    finally:
+        prof.disable()
+        sampler.stop()
+        peak = tracemalloc.get_traced_memory()[1]
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+        ))
+        if started_tracing:
+            tracemalloc.stop()
+        try:
+            _write_reports(base, prof, sampler, snapshot, peak)
+            print(f"profiling: wrote {base}.*")
+        except OSError as e:
+            print(f"profiling: failed to write reports to {base}: {e}")
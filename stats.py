@@ -0,0 +1,324 @@
+# stats.py — incrementally maintained summary tables for diary / watchlist dashboards
+# - One row per month, film year, rating bucket, genre and director; dashboards read these
+#   directly instead of aggregating diary on every page load
+# - refresh() recomputes only the keys a stage actually touched (loader: months / film years
+#   of inserted or changed rows; enrich: genres / people from film_dims.sync_films)
+# - Each touched key is recomputed from the raw rows (DELETE + INSERT … SELECT), so a
+#   refresh is always exact for the keys it covers — no running deltas to drift
+# - Full rebuild for recovery (e.g. after deleting diary rows by hand):
+#     python stats.py
+
+import os
+import pymysql
+from pymysql.cursors import DictCursor
+from dotenv import load_dotenv
+
+from logger import log_to_db
+import metrics
+import pipeline_state
+
+PROJECT_NAME = "lbx-stats"
+
+load_dotenv()
+
+KEY_CHUNK = int(os.getenv("STATS_KEY_CHUNK", "500"))
+
+DB = dict(
+    host=os.getenv("MARIADB_HOST", "localhost"),
+    port=int(os.getenv("MARIADB_PORT", "3306")),
+    user=os.getenv("MARIADB_USER", "root"),
+    password=os.getenv("MARIADB_PASS", ""),
+    database=os.getenv("MARIADB_DB", "letterboxd"),
+    charset="utf8mb4",
+    cursorclass=DictCursor,
+    autocommit=True,
+)
+
+# ---------- Schema ----------
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS stats_diary_month (
+      month      DATE PRIMARY KEY,             -- first day of COALESCE(watched_date, logged_date)
+      entries    INT NOT NULL,
+      films      INT NOT NULL,
+      rewatches  INT NOT NULL,
+      rated      INT NOT NULL,
+      rating_sum DECIMAL(10,1) NOT NULL
+    ) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci;""",
+    """
+    CREATE TABLE IF NOT EXISTS stats_diary_month_rating (
+      month       DATE NOT NULL,
+      rating_half TINYINT NOT NULL,            -- rating * 2, i.e. 1 = ½★ … 10 = ★★★★★
+      entries     INT NOT NULL,
+      PRIMARY KEY (month, rating_half)
+    ) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci;""",
+    """
+    CREATE TABLE IF NOT EXISTS stats_diary_rating (
+      rating_half TINYINT PRIMARY KEY,
+      entries     INT NOT NULL
+    ) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci;""",
+    """
+    CREATE TABLE IF NOT EXISTS stats_diary_film_year (
+      film_year  INT PRIMARY KEY,              -- 0 = unknown year
+      entries    INT NOT NULL,
+      rated      INT NOT NULL,
+      rating_sum DECIMAL(10,1) NOT NULL
+    ) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci;""",
+    """
+    CREATE TABLE IF NOT EXISTS stats_watchlist_month (
+      month DATE PRIMARY KEY,
+      added INT NOT NULL
+    ) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci;""",
+    """
+    CREATE TABLE IF NOT EXISTS stats_genre (
+      genre_id      INT PRIMARY KEY,
+      name          VARCHAR(100) NOT NULL,
+      entries       INT NOT NULL,
+      films         INT NOT NULL,
+      rated         INT NOT NULL,
+      rating_sum    DECIMAL(10,1) NOT NULL,
+      minutes       INT NOT NULL,
+      KEY ix_stats_genre_entries (entries)
+    ) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci;""",
+    """
+    CREATE TABLE IF NOT EXISTS stats_director (
+      person_id  INT PRIMARY KEY,
+      name       VARCHAR(255) NOT NULL,
+      entries    INT NOT NULL,
+      films      INT NOT NULL,
+      rated      INT NOT NULL,
+      rating_sum DECIMAL(10,1) NOT NULL,
+      KEY ix_stats_director_entries (entries)
+    ) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci;""",
+]
+
+# Persistent month columns so touched-month refreshes are index range reads, not diary scans
+MONTH_COLUMNS = [
+    ("diary", "watch_month", "ix_diary_watch_month",
+     "COALESCE(watched_date, logged_date) - INTERVAL (DAYOFMONTH(COALESCE(watched_date, logged_date)) - 1) DAY"),
+    ("watchlist", "added_month", "ix_watchlist_added_month",
+     "added_date - INTERVAL (DAYOFMONTH(added_date) - 1) DAY"),
+]
+
+def ensure_schema(cur):
+    """Summary tables + month columns on diary / watchlist. Call after loader.ensure_schema()."""
+    for ddl in SCHEMA:
+        cur.execute(ddl)
+    for table, col, index, expr in MONTH_COLUMNS:
+        cur.execute(f"SHOW COLUMNS FROM {table} LIKE %s", (col,))
+        if cur.fetchone() is None:
+            cur.execute(f"ALTER TABLE {table} ADD COLUMN {col} DATE AS ({expr}) PERSISTENT, ADD KEY {index} ({col})")
+    cur.execute("SHOW INDEX FROM diary WHERE Key_name='ix_diary_film_year'")
+    if cur.fetchone() is None:
+        cur.execute("ALTER TABLE diary ADD KEY ix_diary_film_year (film_year)")
+
+def month_of(date_str):
+    """'2024-03-17' → '2024-03-01' (the key used by the *_month tables); None for empty."""
+    if not date_str:
+        return None
+    return f"{str(date_str)[:7]}-01"
+
+# ---------- Aggregates ----------
+
+# name → (table, key column, key expression, INSERT … SELECT with a {where} slot)
+AGGREGATES = {
+    "diary_month": ("stats_diary_month", "month", "d.watch_month", """
+        INSERT INTO stats_diary_month (month, entries, films, rewatches, rated, rating_sum)
+        SELECT d.watch_month, COUNT(*), COUNT(DISTINCT d.film_name, COALESCE(d.film_year, 0)),
+               COALESCE(SUM(d.rewatch = 1), 0), COUNT(d.rating), COALESCE(SUM(d.rating), 0)
+        FROM diary d
+        WHERE d.watch_month IS NOT NULL AND {where}
+        GROUP BY d.watch_month"""),
+    "diary_month_rating": ("stats_diary_month_rating", "month", "d.watch_month", """
+        INSERT INTO stats_diary_month_rating (month, rating_half, entries)
+        SELECT d.watch_month, ROUND(d.rating * 2), COUNT(*)
+        FROM diary d
+        WHERE d.watch_month IS NOT NULL AND d.rating IS NOT NULL AND {where}
+        GROUP BY d.watch_month, ROUND(d.rating * 2)"""),
+    "diary_film_year": ("stats_diary_film_year", "film_year", "d.film_year", """
+        INSERT INTO stats_diary_film_year (film_year, entries, rated, rating_sum)
+        SELECT COALESCE(d.film_year, 0), COUNT(*), COUNT(d.rating), COALESCE(SUM(d.rating), 0)
+        FROM diary d
+        WHERE {where}
+        GROUP BY COALESCE(d.film_year, 0)"""),
+    "watchlist_month": ("stats_watchlist_month", "month", "w.added_month", """
+        INSERT INTO stats_watchlist_month (month, added)
+        SELECT w.added_month, COUNT(*)
+        FROM watchlist w
+        WHERE w.added_month IS NOT NULL AND {where}
+        GROUP BY w.added_month"""),
+    "genre": ("stats_genre", "genre_id", "fg.genre_id", """
+        INSERT INTO stats_genre (genre_id, name, entries, films, rated, rating_sum, minutes)
+        SELECT fg.genre_id, MAX(g.name), COUNT(*), COUNT(DISTINCT fg.film_id), COUNT(d.rating),
+               COALESCE(SUM(d.rating), 0), COALESCE(SUM(fd.runtime_min), 0)
+        FROM film_genres fg
+        JOIN genres g        ON g.id = fg.genre_id
+        JOIN film_details fd ON fd.id = fg.film_id
+        JOIN jw_title_map m  ON m.film_id = fg.film_id AND m.source = 'DIARY'
+        JOIN diary d         ON d.id = m.source_row_id
+        WHERE {where}
+        GROUP BY fg.genre_id"""),
+    "director": ("stats_director", "person_id", "fp.person_id", """
+        INSERT INTO stats_director (person_id, name, entries, films, rated, rating_sum)
+        SELECT fp.person_id, MAX(p.name), COUNT(*), COUNT(DISTINCT fp.film_id), COUNT(d.rating),
+               COALESCE(SUM(d.rating), 0)
+        FROM film_people fp
+        JOIN people p       ON p.id = fp.person_id
+        JOIN jw_title_map m ON m.film_id = fp.film_id AND m.source = 'DIARY'
+        JOIN diary d        ON d.id = m.source_row_id
+        WHERE fp.role = 'DIRECTOR' AND {where}
+        GROUP BY fp.person_id"""),
+}
+
+# which aggregates a kind of touched key feeds
+KEY_KINDS = {
+    "diary_months":     ("diary_month", "diary_month_rating"),
+    "film_years":       ("diary_film_year",),
+    "watchlist_months": ("watchlist_month",),
+    "genre_ids":        ("genre",),
+    "person_ids":       ("director",),
+}
+
+DIM_TABLES = ("jw_title_map", "film_details", "genres", "people", "film_genres", "film_people")
+
+SQL_REBUILD_RATING = """
+INSERT INTO stats_diary_rating (rating_half, entries)
+SELECT rating_half, SUM(entries) FROM stats_diary_month_rating GROUP BY rating_half
+"""
+
+# films logged in the touched months → their genres / directors (ratings there may have moved)
+SQL_MONTH_GENRES = """
+SELECT DISTINCT fg.genre_id AS id
+FROM diary d
+JOIN jw_title_map m ON m.source = 'DIARY' AND m.source_row_id = d.id
+JOIN film_genres fg ON fg.film_id = m.film_id
+WHERE d.watch_month IN ({keys})
+"""
+SQL_MONTH_DIRECTORS = """
+SELECT DISTINCT fp.person_id AS id
+FROM diary d
+JOIN jw_title_map m ON m.source = 'DIARY' AND m.source_row_id = d.id
+JOIN film_people fp ON fp.film_id = m.film_id AND fp.role = 'DIRECTOR'
+WHERE d.watch_month IN ({keys})
+"""
+
+def _in(keys):
+    return ",".join(["%s"] * len(keys))
+
+def _chunks(keys):
+    keys = sorted(keys)
+    for i in range(0, len(keys), KEY_CHUNK):
+        yield keys[i:i + KEY_CHUNK]
+
+def _dims_ready(c):
+    c.execute(f"SELECT COUNT(*) AS n FROM information_schema.tables "
+              f"WHERE table_schema = DATABASE() AND table_name IN ({_in(DIM_TABLES)})", DIM_TABLES)
+    return c.fetchone()["n"] == len(DIM_TABLES)
+
+def _key_where(name, key_expr, chunk):
+    """WHERE for one chunk of keys, kept sargable: the NULL stand-in key becomes IS NULL
+    instead of wrapping the indexed column in COALESCE."""
+    null_key = NULL_KEYS.get(name)
+    keys = [k for k in chunk if k != null_key]
+    conds = [f"{key_expr} IN ({_in(keys)})"] if keys else []
+    if null_key is not None and null_key in chunk:
+        conds.append(f"{key_expr} IS NULL")
+    return "(" + " OR ".join(conds) + ")", keys
+
+# summary key that stands for a NULL source column (stats_diary_film_year: 0 = unknown year)
+NULL_KEYS = {"diary_film_year": 0}
+
+def _recompute(c, name, keys):
+    table, key_col, key_expr, insert_sql = AGGREGATES[name]
+    for chunk in _chunks(keys):
+        where, args = _key_where(name, key_expr, chunk)
+        with metrics.timed_sql(f"stats_{name}"):
+            c.execute(f"DELETE FROM {table} WHERE {key_col} IN ({_in(chunk)})", chunk)
+            c.execute(insert_sql.format(where=where), args)
+    metrics.inc("rows_total", len(keys), stage=PROJECT_NAME, table=table)
+
+def _rebuild_rating(c):
+    with metrics.timed_sql("stats_diary_rating"):
+        c.execute("DELETE FROM stats_diary_rating")
+        c.execute(SQL_REBUILD_RATING)
+
+def refresh(conn, diary_months=(), film_years=(), watchlist_months=(), genre_ids=(), person_ids=()):
+    """
+    Recompute the summary rows for the given keys in one transaction.
+    Months are 'YYYY-MM-01' strings (see month_of); genre / person ids come from
+    film_dims.sync_films(). Diary months also refresh the genres and directors of the
+    films logged in them, since their ratings / counts may have changed.
+    """
+    touched = dict(
+        diary_months={m for m in diary_months if m},
+        film_years={y or 0 for y in film_years},
+        watchlist_months={m for m in watchlist_months if m},
+        genre_ids=set(genre_ids),
+        person_ids=set(person_ids),
+    )
+    if not any(touched.values()):
+        return touched
+
+    conn.begin()
+    try:
+        with conn.cursor() as c:
+            dims = _dims_ready(c)
+            if dims:
+                for chunk in _chunks(touched["diary_months"]):
+                    c.execute(SQL_MONTH_GENRES.format(keys=_in(chunk)), chunk)
+                    touched["genre_ids"].update(r["id"] for r in c.fetchall())
+                    c.execute(SQL_MONTH_DIRECTORS.format(keys=_in(chunk)), chunk)
+                    touched["person_ids"].update(r["id"] for r in c.fetchall())
+
+            for kind, names in KEY_KINDS.items():
+                if not touched[kind] or (kind in ("genre_ids", "person_ids") and not dims):
+                    continue
+                for name in names:
+                    _recompute(c, name, touched[kind])
+            if touched["diary_months"]:
+                _rebuild_rating(c)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return touched
+
+def rebuild(conn):
+    """Recompute every summary table from scratch (one transaction; readers see old or new)."""
+    conn.begin()
+    try:
+        with conn.cursor() as c:
+            dims = _dims_ready(c)
+            for name, (table, _, _, insert_sql) in AGGREGATES.items():
+                if name in ("genre", "director") and not dims:
+                    continue
+                with metrics.timed_sql(f"stats_{name}"):
+                    c.execute(f"DELETE FROM {table}")
+                    c.execute(insert_sql.format(where="1=1"))
+                metrics.inc("rows_total", c.rowcount, stage=PROJECT_NAME, table=table)
+            _rebuild_rating(c)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+def main():
+    conn = pymysql.connect(**DB)
+    try:
+        with conn.cursor() as c:
+            ensure_schema(c)
+            pipeline_state.ensure_schema(c)
+        rebuild(conn)
+        with conn.cursor() as c:
+            pipeline_state.mark_run_complete(c, PROJECT_NAME)
+        log_to_db(PROJECT_NAME, "INFO", "✔️ Statistics rebuilt from diary / watchlist")
+    except Exception as e:
+        log_to_db(PROJECT_NAME, "ERROR", f"❌ Statistics rebuild failed: {e}")
+        raise
+    finally:
+        conn.close()
+        metrics.flush(PROJECT_NAME)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+# title_match.py — title normalization + fuzzy similarity shared by jw_update.py and enrich_details.py
+# - normalize(): Unicode fold (NFKD, strip accents), casefold, "&" → "and", punctuation → space
+#   (letters of any script are kept), leading / trailing articles dropped ("The Matrix", "Matrix, The" → "matrix")
+# - The loader stores normalize(film_name) as film_name_norm (indexed) on watchlist / watched / diary;
+#   run this module directly to backfill rows loaded before the column existed:
+#     python title_match.py
+# - best_match() scores one query against a whole candidate list: the query is normalized once,
+#   candidates through an LRU cache, and the edit distance is skipped when the length gap alone
+#   already rules a candidate out
+
+import os
+import re
+import unicodedata
+from functools import lru_cache
+
+import pymysql
+from pymysql.cursors import DictCursor
+from dotenv import load_dotenv
+
+from logger import log_to_db
+import metrics
+
+PROJECT_NAME = "lbx-title-match"
+
+load_dotenv()
+
+BATCH_SIZE = int(os.getenv("TITLE_NORM_BATCH_SIZE", "1000"))
+
+DB = dict(
+    host=os.getenv("MARIADB_HOST", "localhost"),
+    port=int(os.getenv("MARIADB_PORT", "3306")),
+    user=os.getenv("MARIADB_USER", "root"),
+    password=os.getenv("MARIADB_PASS", ""),
+    database=os.getenv("MARIADB_DB", "letterboxd"),
+    charset="utf8mb4",
+    cursorclass=DictCursor,
+    autocommit=True,
+)
+
+SIM_LEN_PRUNE = 0.5   # candidates whose length ratio is below this can't reach a useful edit similarity
+
+ARTICLES = {"the", "a", "an", "le", "la", "les", "l", "el", "los", "las", "der", "die", "das", "il", "lo", "gli"}
+
+_NON_WORD = re.compile(r"[\W_]+")   # Unicode-aware: CJK / Cyrillic letters survive
+_TRAILING_ARTICLE = re.compile(r"^(.*),\s*(the|a|an)$", re.IGNORECASE)
+
+@lru_cache(maxsize=65536)
+def normalize(title):
+    """Comparable form of a title; '' for empty input."""
+    if not title:
+        return ""
+    t = title.strip()
+    m = _TRAILING_ARTICLE.match(t)
+    if m:
+        t = f"{m.group(2)} {m.group(1)}"
+    t = unicodedata.normalize("NFKD", t)
+    t = "".join(ch for ch in t if not unicodedata.combining(ch))
+    t = t.casefold().replace("&", " and ").replace("'", "").replace("’", "")
+    tokens = _NON_WORD.sub(" ", t).split()
+    if len(tokens) > 1 and tokens[0] in ARTICLES:
+        tokens = tokens[1:]
+    return " ".join(tokens)
+
+def levenshtein(a, b, max_dist=None):
+    """Edit distance; stops early (returns max_dist + 1) once every path exceeds max_dist."""
+    if a == b:
+        return 0
+    if len(a) < len(b):
+        a, b = b, a
+    if not b:
+        return len(a)
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i]
+        for j, cb in enumerate(b, 1):
+            cur.append(min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb)))
+        if max_dist is not None and min(cur) > max_dist:
+            return max_dist + 1
+        prev = cur
+    return prev[-1]
+
+def similarity(qn, cn):
+    """0..1 similarity of two normalized titles: edit ratio blended with token overlap."""
+    if not qn or not cn:
+        return 0.0
+    if qn == cn:
+        return 1.0
+    longest = max(len(qn), len(cn))
+    qt, ct = set(qn.split()), set(cn.split())
+    jaccard = len(qt & ct) / len(qt | ct)
+    if min(len(qn), len(cn)) / longest < SIM_LEN_PRUNE:
+        # "Alien" vs "Aliens vs Predator: Requiem": edit distance can't help, tokens decide
+        return 0.4 * jaccard
+    # "spider man" vs "spiderman": same letters, different tokens
+    qs, cs = qn.replace(" ", ""), cn.replace(" ", "")
+    if qs == cs:
+        return 0.98
+    dist = levenshtein(qs, cs, max_dist=longest // 2)
+    edit = max(0.0, 1 - dist / max(len(qs), len(cs)))
+    return 0.6 * edit + 0.4 * jaccard
+
+def year_fit(qyear, cyear):
+    """+0.2 same year, +0.1 off by one (festival vs release), -0.2 further apart, 0 if either unknown."""
+    if not qyear or not cyear:
+        return 0.0
+    gap = abs(int(qyear) - int(cyear))
+    return 0.2 if gap == 0 else 0.1 if gap == 1 else -0.2
+
+def best_match(query, year, candidates, query_norm=None):
+    """
+    candidates: [(titles, year)] where titles is a tuple of names for one result (title,
+    original title, …). Returns (index, similarity, year_ok) of the best candidate, or
+    (None, 0.0, False) for an empty list. Ties keep the earlier candidate (API relevance order).
+    """
+    qn = query_norm if query_norm is not None else normalize(query)
+    best = (None, 0.0, False)
+    best_score = float("-inf")
+    for i, (titles, cyear) in enumerate(candidates):
+        sim = max((similarity(qn, normalize(t)) for t in titles if t), default=0.0)
+        fit = year_fit(year, cyear)
+        score = sim + fit
+        if score > best_score:
+            best_score = score
+            best = (i, sim, fit > 0)
+    return best
+
+# ---------- Schema + backfill ----------
+
+SOURCE_TABLES = ("watchlist", "watched", "diary")
+
+def ensure_schema(cur):
+    """film_name_norm + (film_name_norm, film_year) index on each source table."""
+    for table in SOURCE_TABLES:
+        cur.execute(f"SHOW COLUMNS FROM {table} LIKE 'film_name_norm'")
+        if cur.fetchone() is None:
+            cur.execute(f"ALTER TABLE {table} ADD COLUMN film_name_norm VARCHAR(255) NULL, "
+                        f"ADD KEY ix_{table}_name_norm (film_name_norm, film_year)")
+
+def main():
+    conn = pymysql.connect(**DB)
+    try:
+        with conn.cursor() as c:
+            ensure_schema(c)
+        for table in SOURCE_TABLES:
+            last_id, total = 0, 0
+            while True:
+                with conn.cursor() as c, metrics.timed_sql("select_unnormalized"):
+                    # '' = non-Latin title normalized before letters of every script were kept
+                    c.execute(f"SELECT id, film_name FROM {table} "
+                              f"WHERE id > %s AND (film_name_norm IS NULL OR film_name_norm = '') "
+                              f"ORDER BY id LIMIT %s", (last_id, BATCH_SIZE))
+                    rows = c.fetchall()
+                if not rows:
+                    break
+                with conn.cursor() as c, metrics.timed_sql("set_film_name_norm"):
+                    c.executemany(f"UPDATE {table} SET film_name_norm=%s WHERE id=%s",
+                                  [(normalize(r["film_name"]), r["id"]) for r in rows])
+                last_id, total = rows[-1]["id"], total + len(rows)
+                metrics.inc("rows_total", len(rows), stage=PROJECT_NAME, table=table)
+            log_to_db(PROJECT_NAME, "INFO", f"✔️ {table}: normalized {total} titles")
+    except Exception as e:
+        log_to_db(PROJECT_NAME, "ERROR", f"❌ Title normalization backfill failed: {e}")
+        raise
+    finally:
+        conn.close()
+        metrics.flush(PROJECT_NAME)
+
+if __name__ == "__main__":
+    main()